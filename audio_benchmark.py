@@ -0,0 +1,242 @@
+"""
+
+Offline benchmark for the ProxyChat playback pipeline. Drives output_callback (network side) and
+output_callback_audio (audio thread side) with synthetic speakers, packet loss and jitter, without
+opening any real sound devices, so it runs fine on a headless machine.
+
+Underruns only count blocks where a speaker who has already started playing has run out of frames,
+the initial buffering before each speaker's first frame isn't one. Frames lost on the way (played
+as silence by the jitter buffer) are counted separately.
+
+Allocations are counted with tracemalloc snapshots either side of each audio block, which only see
+blocks still alive once the callback returns, so the peak bytes allocated during the block are
+reported alongside to catch temporaries.
+
+Usage: python audio_benchmark.py --speakers 1 4 16 32 --loss 0.05 --jitter-ms 30
+
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+
+class NullStream:
+    """ Stands in for sd.RawInputStream / sd.RawOutputStream, never touches a device """
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def stub_sounddevice():
+    try:
+        import sounddevice as sd
+    except (ImportError, OSError):  # Not installed, or no PortAudio on this machine
+        sd = types.ModuleType("sounddevice")
+        sys.modules["sounddevice"] = sd
+
+    sd.RawInputStream = NullStream
+    sd.RawOutputStream = NullStream
+
+
+stub_sounddevice()
+
+from engine import audio_engine  # NOQA - Must come after the stub
+from engine.audio_engine import (ProxyChat, JitterBuffer, PCMCodec, MuLawCodec, OpusCodec,
+                                 VOICE_FRAME_HEADER, encode_voice_header, decode_voice_packet)
+
+CODECS = {"pcm": PCMCodec, "mulaw": MuLawCodec, "opus": OpusCodec}
+
+
+class BenchmarkStats:
+    def __init__(self):
+        self.callback_times = []
+        self.decode_times = []
+        self.underruns = 0
+        self.lost_frames = 0
+        self.peak_bytes = []
+        self.allocations = []
+
+
+def synthetic_voice(speaker: int, block: int) -> np.ndarray:
+    """ A different tone per speaker, loud enough to always pass voice detection """
+    t = (np.arange(audio_engine.BLOCKSIZE) + block * audio_engine.BLOCKSIZE) / audio_engine.SAMPLE_RATE
+    frequency = 150 + speaker * 37
+
+    return (np.sin(2 * np.pi * frequency * t) * 6000).astype(np.int16)
+
+
+def create_packets(speaker_count: int, block_count: int, codec_type, loss: float, jitter: float, rng: random.Random):
+    """ Returns (arrival time, packet) for every packet that survives, sorted by arrival """
+    block_length = audio_engine.BLOCKSIZE / audio_engine.SAMPLE_RATE
+    packets = []
+
+    for speaker in range(speaker_count):
+        codec = codec_type()
+        angle = 2 * np.pi * speaker / max(speaker_count, 1)
+        rel_x, rel_y = np.cos(angle) * 200, np.sin(angle) * 200
+        volume = rng.uniform(0.2, 1.0)
+
+        for block in range(block_count):
+            encoded = codec.encode(synthetic_voice(speaker, block))
+
+            if rng.random() < loss:
+                continue
+
+            packet = (encode_voice_header(speaker, False, volume, rel_x, rel_y)
+                      + VOICE_FRAME_HEADER.pack(block & 0xFFFF, codec.codec_id) + encoded)
+
+            arrival = block * block_length + rng.uniform(0, jitter)
+            packets.append((arrival, packet))
+
+    packets.sort(key=lambda entry: entry[0])
+    return packets
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """ Everything traced, minus tracemalloc's own bookkeeping """
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+def run(speaker_count: int, block_count: int, codec_type, loss: float, jitter: float, stereo: bool,
+        trace_allocations: bool, seed: int = 0) -> BenchmarkStats:
+    rng = random.Random(seed)
+    stats = BenchmarkStats()
+
+    chat = ProxyChat(None, decode_voice_packet, codec=codec_type(), stereo=stereo)
+    chat.active = True
+
+    packets = create_packets(speaker_count, block_count, codec_type, loss, jitter, rng)
+
+    # Count blocks where a speaker who has already played something has run dry, not the warm-up before it.
+    # Lost frames come back as None too, but the buffer still had frames to play so they aren't underruns
+    original_pop = JitterBuffer.pop
+    started = set()
+
+    block = 0
+
+    def counting_pop(buffer):
+        lost_before = buffer.lost_frames
+        frame_data = original_pop(buffer)
+
+        if frame_data is not None:
+            started.add(id(buffer))
+
+        elif block >= block_count:
+            pass  # Draining
+
+        elif buffer.lost_frames != lost_before:
+            stats.lost_frames += 1
+
+        elif id(buffer) in started:
+            stats.underruns += 1
+
+        return frame_data
+
+    JitterBuffer.pop = counting_pop
+
+    block_length = audio_engine.BLOCKSIZE / audio_engine.SAMPLE_RATE
+    outdata = bytearray(audio_engine.BLOCKSIZE * chat.output_channels * 2)
+    packet_index = 0
+
+    try:
+        if trace_allocations:
+            tracemalloc.start()
+
+        for block in range(block_count + 10):  # A few extra blocks to drain the jitter buffers
+            now = block * block_length
+
+            while packet_index < len(packets) and packets[packet_index][0] <= now:
+                start = time.perf_counter()
+                chat.output_callback(None, None, packets[packet_index][1])
+                stats.decode_times.append(time.perf_counter() - start)
+
+                packet_index += 1
+
+            if trace_allocations:
+                snapshot_before = take_snapshot()
+                tracemalloc.reset_peak()
+                current_before, _ = tracemalloc.get_traced_memory()
+
+            start = time.perf_counter()
+            chat.output_callback_audio(outdata, audio_engine.BLOCKSIZE, None, None)
+            stats.callback_times.append(time.perf_counter() - start)
+
+            if trace_allocations:
+                _, peak = tracemalloc.get_traced_memory()
+                stats.peak_bytes.append(peak - current_before)
+
+                differences = take_snapshot().compare_to(snapshot_before, "lineno")
+                stats.allocations.append(sum(max(0, difference.count_diff) for difference in differences))
+
+    finally:
+        JitterBuffer.pop = original_pop
+
+        if trace_allocations:
+            tracemalloc.stop()
+
+    return stats
+
+
+def percentile_ms(values, percent):
+    return float(np.percentile(values, percent)) * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--speakers", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--blocks", type=int, default=500)
+    parser.add_argument("--loss", type=float, default=0.02, help="Chance of any packet being dropped")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--codec", choices=list(CODECS), default="mulaw")
+    parser.add_argument("--mono", action="store_true")
+    parser.add_argument("--max-budget-fraction", type=float, default=0.5,
+                        help="Fail if the p99 callback time uses more than this much of the block budget")
+    args = parser.parse_args()
+
+    codec_type = CODECS[args.codec]
+
+    try:
+        codec_type()
+    except RuntimeError as e:  # Opus without opuslib installed
+        parser.error(f"--codec {args.codec} isn't available: {e}")
+    budget_ms = audio_engine.BLOCKSIZE / audio_engine.SAMPLE_RATE * 1000
+
+    print(f"Block budget: {budget_ms:.2f}ms, codec: {args.codec}, {'mono' if args.mono else 'stereo'}, "
+          f"loss: {args.loss * 100:.1f}%, jitter: {args.jitter_ms}ms")
+
+    passed = True
+    for speaker_count in args.speakers:
+        timing = run(speaker_count, args.blocks, codec_type, args.loss, args.jitter_ms / 1000, not args.mono, False)
+        allocations = run(speaker_count, min(args.blocks, 100), codec_type, args.loss, args.jitter_ms / 1000,
+                          not args.mono, True)
+
+        p99 = percentile_ms(timing.callback_times, 99)
+        passed = passed and p99 <= budget_ms * args.max_budget_fraction
+
+        print(f"Speakers: {speaker_count:>3} | "
+              f"Callback p50: {percentile_ms(timing.callback_times, 50):.3f}ms, "
+              f"p95: {percentile_ms(timing.callback_times, 95):.3f}ms, "
+              f"p99: {p99:.3f}ms ({p99 / budget_ms * 100:.1f}% of budget), "
+              f"max: {max(timing.callback_times) * 1000:.3f}ms | "
+              f"Decode p99: {percentile_ms(timing.decode_times, 99):.3f}ms | "
+              f"Underruns: {timing.underruns}, lost frames: {timing.lost_frames} | "
+              f"Allocations/block: {np.mean(allocations.allocations):.2f}, "
+              f"peak: {np.mean(allocations.peak_bytes) / 1024:.2f}KiB")
+
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,47 @@
 from PIL import Image
 import numpy as np
 import pygame
+import math
 
 from .logger import Log
 
+MIN_MIP_SIZE = 8
+
+
+def build_mip_chain(surface: pygame.Surface, min_size: int = MIN_MIP_SIZE) -> list[pygame.Surface]:
+    """ The surface followed by successively half sized (box filtered) copies, stopping around min_size pixels """
+    levels = [surface]
+
+    while min(levels[-1].get_size()) // 2 >= min_size:
+        width, height = levels[-1].get_size()
+        levels.append(pygame.transform.smoothscale(levels[-1], (width // 2, height // 2)))
+
+    return levels
+
+
+def mip_level_for_scale(scale: float, level_count: int) -> int:
+    """ The smallest level still at least as big as the requested scale, so it only ever gets scaled down a little """
+    if scale >= 1:
+        return 0
+
+    return min(level_count - 1, math.floor(math.log2(1 / scale)))
+
+
+def scale_from_mips(levels: list[pygame.Surface], scale: float) -> pygame.Surface:
+    """ Level 0 scaled by scale, worked out from the nearest mip level instead of the full size surface """
+    width, height = levels[0].get_size()
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    source = levels[mip_level_for_scale(scale, len(levels))]
+    if source.get_size() == size:
+        return source
+
+    if scale < 1:
+        return pygame.transform.smoothscale(source, size)
+
+    return pygame.transform.scale(source, size)
+
+
 class DefaultAsset:
     raw = None
     def __init__(self, path):
@@ -36,6 +74,7 @@ class Texture2D(DefaultAsset):
     channels: int
 
     pygame_surface = None
+    mip_levels: list[pygame.Surface]
 
     def __init__(self, path: str, quality: float, load_pygame: bool, mode: str):
         """
@@ -48,8 +87,23 @@ class Texture2D(DefaultAsset):
         self.image_mode = mode
         self.quality = quality
         self.use_pygame = load_pygame
+        self.mip_levels = []  # Only built when there is a pygame surface
+        self.__scaled_cache = {}
         super().__init__(path)
 
+    def get_scaled(self, scale: float | None = None) -> pygame.Surface:
+        """ The pygame surface at the given scale (defaults to the textures quality), cached per scale """
+        if scale is None:
+            scale = self.quality
+
+        if scale == 1 or not self.mip_levels:  # Nothing to scale from, fall back to the base surface
+            return self.pygame_surface
+
+        if scale not in self.__scaled_cache:
+            self.__scaled_cache[scale] = scale_from_mips(self.mip_levels, scale)
+
+        return self.__scaled_cache[scale]
+
 
     def load_raw(self, path):
         texture = pygame.image.load(path).convert_alpha()
@@ -63,6 +117,8 @@ class Texture2D(DefaultAsset):
                 pygame.init()
 
             self.pygame_surface = texture
+            self.mip_levels = build_mip_chain(texture)
+            self.__scaled_cache = {}
 
         Log.log(f"Loaded Texture2D: {path}")
 
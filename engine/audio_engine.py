@@ -1,23 +1,291 @@
 import sounddevice as sd
 from collections import defaultdict, deque
 import numpy as np
+import struct
 
 from .logger import Log
 from packet_manager import ConnectionUDP
 
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
 SAMPLE_RATE = 48000
-CHANNELS = 1
-BLOCKSIZE = 1024
+CHANNELS = 1  # Captured / sent voice is mono
+OUTPUT_CHANNELS = 2  # Playback is stereo so voices can be panned
+BLOCKSIZE = 960  # 20ms, the closest block size Opus can encode as a single frame
+
+# ProxyVoiceToClient header: speaker index, over radio, volume, rel_x, rel_y. The audio bytes follow it.
+VOICE_HEADER = struct.Struct(">B?fff")
+
+
+def encode_voice_header(speaker: int, over_radio: bool, volume: float, rel_x: float, rel_y: float) -> bytes:
+    return VOICE_HEADER.pack(speaker, over_radio, volume, rel_x, rel_y)
+
+
+# Start of every encoded voice frame: sequence number, codec id. The encoded audio follows it.
+VOICE_FRAME_HEADER = struct.Struct(">HB")
+VOICE_SEQUENCE_MASK = 0xFFFF
+
+
+def voice_sequence_distance(a: int, b: int) -> int:
+    """ How many frames 'a' is ahead of 'b', negative if it is behind (handles wrap around) """
+    distance = (a - b) & VOICE_SEQUENCE_MASK
+    return distance - (VOICE_SEQUENCE_MASK + 1) if distance > VOICE_SEQUENCE_MASK // 2 else distance
+
+
+def decode_voice_packet(data: bytes) -> dict:
+    """ Splits a ProxyVoiceToClient packet into its header values and audio """
+    speaker, over_radio, volume, rel_x, rel_y = VOICE_HEADER.unpack_from(data)
+
+    return {
+        "bytes": data[VOICE_HEADER.size:], "from": speaker,
+        "vol": volume, "radio": over_radio,
+        "rel_x": rel_x, "rel_y": rel_y
+    }
+
+
+class VoiceCodec:
+    """ Turns a block of int16 PCM into bytes to send, and back again. Instances may hold state (one per stream) """
+    codec_id = -1
+
+    def encode(self, pcm: np.ndarray) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        raise NotImplementedError()
+
+
+class PCMCodec(VoiceCodec):
+    """ No compression, raw int16 """
+    codec_id = 0
+
+    def encode(self, pcm: np.ndarray) -> bytes:
+        return pcm.astype(np.int16, copy=False).tobytes()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.int16)
+
+
+class MuLawCodec(VoiceCodec):
+    """ Pure NumPy mu-law companding, 8 bits per sample (half the size of raw PCM) """
+    codec_id = 1
+    MU = 255
+
+    def encode(self, pcm: np.ndarray) -> bytes:
+        x = pcm.astype(np.float32) / 32768
+        y = np.sign(x) * np.log1p(self.MU * np.abs(x)) / np.log1p(self.MU)
+
+        return np.round((y + 1) * 127.5).astype(np.uint8).tobytes()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        y = np.frombuffer(data, dtype=np.uint8).astype(np.float32) / 127.5 - 1
+        x = np.sign(y) * np.expm1(np.abs(y) * np.log1p(self.MU)) / self.MU
+
+        return np.clip(x * 32768, -32768, 32767).astype(np.int16)
+
+
+class OpusCodec(VoiceCodec):
+    """ Opus via opuslib (optional dependency), roughly 60 bytes per 20ms block at 24kbps """
+    codec_id = 2
+    BITRATE = 24000
+
+    def __init__(self):
+        if opuslib is None:
+            raise RuntimeError("opuslib is not installed, Opus voice is unavailable")
+
+        self.__encoder = None
+        self.__decoder = None
+
+    def encode(self, pcm: np.ndarray) -> bytes:
+        if self.__encoder is None:
+            self.__encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, opuslib.APPLICATION_VOIP)
+            self.__encoder.bitrate = self.BITRATE
+
+        return self.__encoder.encode(pcm.astype(np.int16, copy=False).tobytes(), len(pcm) // CHANNELS)
+
+    def decode(self, data: bytes) -> np.ndarray:
+        if self.__decoder is None:
+            self.__decoder = opuslib.Decoder(SAMPLE_RATE, CHANNELS)
+
+        return np.frombuffer(self.__decoder.decode(data, BLOCKSIZE), dtype=np.int16)
+
+
+VOICE_CODECS: dict[int, type[VoiceCodec]] = {
+    PCMCodec.codec_id: PCMCodec,
+    MuLawCodec.codec_id: MuLawCodec,
+    OpusCodec.codec_id: OpusCodec,
+}
+
+
+CODEC_PREFERENCE = (OpusCodec.codec_id, MuLawCodec.codec_id, PCMCodec.codec_id)  # Best first
+
+
+def create_codec(codec_id: int) -> VoiceCodec | None:
+    """ None if the codec is unknown, or can't be used on this machine (Opus without opuslib) """
+    if codec_id not in VOICE_CODECS:
+        return None
+
+    try:
+        return VOICE_CODECS[codec_id]()
+    except RuntimeError:
+        return None
+
+
+def available_codec_ids() -> list[int]:
+    """ Every codec this machine can encode and decode, best first """
+    return [codec_id for codec_id in CODEC_PREFERENCE if create_codec(codec_id) is not None]
+
+
+def choose_codec(codec_ids) -> VoiceCodec:
+    """ The best codec out of codec_ids that works here, mu-law if there isn't one """
+    for codec_id in CODEC_PREFERENCE:
+        if codec_id in codec_ids:
+            codec = create_codec(codec_id)
+
+            if codec is not None:
+                return codec
+
+    return MuLawCodec()
+
+
+def get_default_codec() -> VoiceCodec:
+    """ Opus if it is installed, otherwise mu-law """
+    return choose_codec(CODEC_PREFERENCE)
+
+
+class VoiceActivityDetector:
+    """ Energy based voice detection, keeps going for a few blocks after speech ends so words don't get clipped """
+    def __init__(self, threshold_db: float = -45.0, hangover_blocks: int = 10):
+        self.threshold = (10 ** (threshold_db / 20) * 32768) ** 2  # Compared against the mean square, no sqrt needed
+        self.hangover_blocks = hangover_blocks
+        self.__blocks_left = 0
+
+    def is_speech(self, pcm: np.ndarray) -> bool:
+        samples = pcm.astype(np.float32)
+
+        if np.dot(samples, samples) / max(len(samples), 1) >= self.threshold:
+            self.__blocks_left = self.hangover_blocks
+            return True
+
+        if self.__blocks_left > 0:
+            self.__blocks_left -= 1
+            return True
+
+        return False
+
+
+class JitterBuffer:
+    """
+    Reorders a single speaker's frames and holds a few back, so that packets arriving unevenly still play smoothly.
+    The depth grows when frames turn up too late to be played, and shrinks again once the link has been steady.
+
+    push() (network thread) only appends to a deque, everything else belongs to pop() (audio thread), so the audio
+    callback never waits on a lock held by the network thread.
+    """
+    STEADY_BLOCKS = 250  # ~5 seconds without a late frame before reducing the depth
+    INCOMING_BLOCKS = 4  # Frames waiting to be picked up are capped at this many times max_depth, dropping the oldest
+
+    def __init__(self, target_depth: int = 2, min_depth: int = 1, max_depth: int = 8):
+        self.target_depth = target_depth
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+
+        self.frames: dict[int, tuple] = {}
+        self.next_sequence: int | None = None
+        self.playing = False
+
+        self.late_frames = 0
+        self.skipped_frames = 0
+        self.lost_frames = 0  # Played as silence because the frame never turned up
+        self.steady_blocks = 0
+
+        # deque append / popleft are atomic, so this is the only thing both threads touch
+        self.__incoming: deque[tuple[int, tuple]] = deque(maxlen=max_depth * self.INCOMING_BLOCKS)
+
+    def __oldest(self) -> int:
+        """ Plain loop rather than min(key=...), this runs in the audio callback """
+        oldest = None
+        oldest_distance = 0
+
+        for sequence in self.frames:
+            distance = voice_sequence_distance(sequence, self.next_sequence)
+
+            if oldest is None or distance < oldest_distance:
+                oldest, oldest_distance = sequence, distance
+
+        return oldest
+
+    def push(self, sequence: int, frame_data: tuple):
+        """ Called from the network thread """
+        self.__incoming.append((sequence, frame_data))
+
+    def __take_incoming(self):
+        while self.__incoming:
+            sequence, frame_data = self.__incoming.popleft()
+
+            if self.next_sequence is None:
+                self.next_sequence = sequence
+
+            if voice_sequence_distance(sequence, self.next_sequence) < 0:
+                # Already played past it, the buffer is too shallow for this link
+                self.late_frames += 1
+                self.steady_blocks = 0
+                self.target_depth = min(self.target_depth + 1, self.max_depth)
+                continue
+
+            self.frames[sequence] = frame_data
+
+            # Keep latency bounded, if we have fallen far behind skip the oldest frames
+            while len(self.frames) > self.max_depth:
+                oldest = self.__oldest()
+                self.frames.pop(oldest)
+                self.next_sequence = (oldest + 1) & VOICE_SEQUENCE_MASK
+                self.skipped_frames += 1
+
+    def pop(self) -> tuple | None:
+        """ Returns the next frame to play, or None if there is nothing to play this block. Audio thread only """
+        self.__take_incoming()
+
+        if not self.playing:
+            if len(self.frames) < max(self.target_depth, 1):
+                return None
+
+            self.playing = True
+            self.next_sequence = self.__oldest()
+
+        if not self.frames:
+            self.playing = False  # End of a burst of speech (or a stall), rebuffer before playing again
+            return None
+
+        frame_data = self.frames.pop(self.next_sequence, None)  # None if lost, plays a block of silence
+        if frame_data is None:
+            self.lost_frames += 1
+
+        self.next_sequence = (self.next_sequence + 1) & VOICE_SEQUENCE_MASK
+
+        self.steady_blocks += 1
+        if self.steady_blocks >= self.STEADY_BLOCKS:
+            self.steady_blocks = 0
+            self.target_depth = max(self.target_depth - 1, self.min_depth)
+
+        return frame_data
 
 
 class ProxyChat:
+    MAX_SPEAKERS = 32
+    PAN_DISTANCE = 50  # Speakers closer than this are panned less, so someone right next to you isn't hard left/right
+    MUFFLE_AMOUNT = 0.8  # How much of a far away voice is low-passed (scaled by distance, radio is never muffled)
 
     def __init__(
         self,
         udp_conn: ConnectionUDP | None,
         decode_func,
         input_device=None,
-        output_device=None
+        output_device=None,
+        codec: VoiceCodec | None = None,
+        stereo: bool = True
     ):
         self.udp_conn = udp_conn
         self.active = False
@@ -25,7 +293,29 @@ class ProxyChat:
 
         self.decode_func = decode_func
 
-        self.audio_buffers = defaultdict(deque)
+        self.codec = codec if codec is not None else get_default_codec()
+        self.decoders: dict = defaultdict(dict)  # speaker -> {codec_id: VoiceCodec}
+        self.unusable_codecs: set[int] = set()  # Codec ids we have been sent but can't decode, their frames are dropped
+        self.vad = VoiceActivityDetector()
+
+        self.audio_buffers: dict[int, JitterBuffer] = {}
+        self.__speaker_buffers: list[JitterBuffer] = []  # Same buffers, safe to walk from the audio thread
+        self.__send_sequence = 0
+
+        self.output_channels = OUTPUT_CHANNELS if stereo else 1
+
+        # Preallocated so the output callback doesn't allocate per sample.
+        # Rows [0, n) hold each speakers dry frame, rows [n, 2n) the low-passed copy of it.
+        # Mixed in float32 rather than int32, the pan / volume gains are fractions and the mix is one BLAS matmul,
+        # which numpy only has for floats. 32 full scale int16 voices sum to under 2^21, well inside float32's exact
+        # 24 bit range, so nothing is lost before the final clip.
+        self.__mix_matrix = np.zeros((self.MAX_SPEAKERS * 2, BLOCKSIZE), dtype=np.float32)
+        self.__filter_scratch = np.zeros((self.MAX_SPEAKERS, BLOCKSIZE), dtype=np.float32)
+        self.__speaker_state = np.zeros((self.MAX_SPEAKERS, 4), dtype=np.float32)  # volume, radio, rel_x, rel_y
+        self.__gains = np.zeros((self.output_channels, self.MAX_SPEAKERS * 2), dtype=np.float32)
+        self.__gain_scratch = np.zeros((5, self.MAX_SPEAKERS), dtype=np.float32)  # muffle, dry, wet, distance, pan
+        self.__on_radio = np.zeros(self.MAX_SPEAKERS, dtype=bool)
+        self.__mix = np.zeros((self.output_channels, BLOCKSIZE), dtype=np.float32)
 
         self.input_stream = sd.RawInputStream(
             samplerate=SAMPLE_RATE,
@@ -38,7 +328,7 @@ class ProxyChat:
 
         self.output_stream = sd.RawOutputStream(
             samplerate=SAMPLE_RATE,
-            channels=CHANNELS,
+            channels=self.output_channels,
             dtype="int16",
             blocksize=BLOCKSIZE,
             callback=self.output_callback_audio,
@@ -51,54 +341,129 @@ class ProxyChat:
         if status:
             print("Input status:", status)
 
-        audio = bytes(indata)
+        pcm = np.frombuffer(indata, dtype=np.int16)
+
+        if not self.vad.is_speech(pcm):
+            return  # Silence, don't waste bandwidth on it
 
         if self.udp_conn is not None:
-            self.udp_conn.send("ProxyVoiceToServer", audio)
+            header = VOICE_FRAME_HEADER.pack(self.__send_sequence, self.codec.codec_id)
+            self.udp_conn.send("ProxyVoiceToServer", header + self.codec.encode(pcm))
+
+            self.__send_sequence = (self.__send_sequence + 1) & VOICE_SEQUENCE_MASK
+
+
+    def __compute_gains(self, active: int) -> np.ndarray:
+        """
+        Equal power panning and distance muffling for every active speaker at once, as (channels, 2 * active).
+        Runs in the output callback, so everything is written into the preallocated scratch rows
+        """
+        volume, radio, rel_x, rel_y = self.__speaker_state[:active].T
+        muffle, dry, wet, distance, pan = self.__gain_scratch[:, :active]
+        on_radio = self.__on_radio[:active]
+
+        np.greater(radio, 0, out=on_radio)
+
+        # The server fades volume out with distance, radio is never muffled
+        np.subtract(1, volume, out=muffle)
+        np.copyto(muffle, 0, where=on_radio)
+        muffle *= self.MUFFLE_AMOUNT
 
+        np.subtract(1, muffle, out=dry)
+        dry *= volume
+        np.multiply(volume, muffle, out=wet)
+
+        gains = self.__gains[:, :active * 2]
+
+        if self.output_channels == 1:
+            np.copyto(gains[0, :active], dry)
+            np.copyto(gains[0, active:], wet)
+            return gains
+
+        # rel_* is listener - speaker, and the second position axis is left/right on screen
+        np.hypot(rel_x, rel_y, out=distance)
+        np.maximum(distance, self.PAN_DISTANCE, out=distance)
+        np.divide(rel_y, distance, out=pan)
+        np.negative(pan, out=pan)
+        np.minimum(pan, 1, out=pan)  # Not np.clip, its python wrapper allocates on every call
+        np.maximum(pan, -1, out=pan)
+        np.copyto(pan, 0, where=on_radio)  # Radio comes through the middle
+
+        pan += 1
+        pan *= np.pi / 4  # Now the pan angle
+
+        for channel, pan_func in enumerate((np.cos, np.sin)):
+            channel_dry, channel_wet = gains[channel, :active], gains[channel, active:]
+
+            pan_func(pan, out=channel_dry)
+            np.multiply(channel_dry, wet, out=channel_wet)
+            channel_dry *= dry
+
+        return gains
+
+    def __low_pass(self, active: int):
+        """ Fills rows [active, 2 * active) with a 4 tap box filtered copy of the dry rows """
+        dry = self.__mix_matrix[:active]
+        scratch = self.__filter_scratch[:active]
+
+        # Shifted 2D views make numpy buffer (copy) the whole matrix for every add, so filter the rows as
+        # one flat run instead, then redo the first few samples of each row that picked up the previous row
+        dry_flat = dry.reshape(-1)
+        scratch_flat = scratch.reshape(-1)
+
+        np.copyto(scratch_flat, dry_flat)
+        scratch_flat[1:] += dry_flat[:-1]
+        scratch_flat[2:] += dry_flat[:-2]
+        scratch_flat[3:] += dry_flat[:-3]
+        np.add.accumulate(dry[:, :3], axis=1, out=scratch[:, :3])  # np.cumsum, without its allocating wrapper
+        scratch *= 0.25
+
+        np.copyto(self.__mix_matrix[active:active * 2], scratch)
 
     def output_callback_audio(self, outdata, frames, time, status):
         if status:
             print("Output status:", status)
 
-        mix = None
+        out = np.frombuffer(outdata, dtype=np.int16)
+        sample_count = min(len(out) // self.output_channels, BLOCKSIZE)
+
         active = 0
+        for buffer in self.__speaker_buffers:
+            frame_data = buffer.pop()
 
-        for queue in self.audio_buffers.values():
-            if not queue:
+            if frame_data is None:
                 continue
 
-            audio, volume, over_radio, rel_x, rel_y = queue.popleft()
+            audio, volume, over_radio, rel_x, rel_y = frame_data
 
-            frame = (np.frombuffer(audio, dtype=np.int16) * volume).astype(np.int16)
+            # Copy into this speakers row, padding if the frame came in short
+            row = self.__mix_matrix[active]
+            length = min(len(audio), sample_count)
 
-            # Safety in case the received frame isn't exactly the requested size.
-            if len(frame) != frames:
-                continue
+            row[:length] = audio[:length]
+            row[length:] = 0
 
-            if mix is None:
-                mix = frame.astype(np.int32)
-            else:
-                mix += frame
+            self.__speaker_state[active] = (volume, over_radio, rel_x, rel_y)
 
             active += 1
+            if active == self.MAX_SPEAKERS:
+                break
 
-        if mix is None:
-            outdata[:] = b"\x00" * len(outdata)
+        if active == 0:
+            out.fill(0)
             return
 
-        mix //= active
-
-        np.clip(
-            mix,
-            -32768,
-            32767,
-            out=mix
-        )
-
-        outdata[:] = mix.astype(np.int16).tobytes()
+        self.__low_pass(active)
+        gains = self.__compute_gains(active)
 
+        # (channels, 2n) @ (2n, samples), pans, muffles and sums every speaker in one go
+        np.matmul(gains, self.__mix_matrix[:active * 2], out=self.__mix)
+        np.minimum(self.__mix, 32767, out=self.__mix)
+        np.maximum(self.__mix, -32768, out=self.__mix)
 
+        interleaved = out[:sample_count * self.output_channels].reshape(sample_count, self.output_channels)
+        np.copyto(interleaved, self.__mix[:, :sample_count].T, casting="unsafe")
+        out[sample_count * self.output_channels:] = 0
 
     def output_callback(self, udp_conn, sender, data: bytes):
         if not self.active:
@@ -107,9 +472,37 @@ class ProxyChat:
         decoded = self.decode_func(data)
 
         player = decoded["from"]
-        audio = decoded["bytes"]
 
-        self.audio_buffers[player].append((
+        if len(decoded["bytes"]) < VOICE_FRAME_HEADER.size:
+            return
+
+        sequence, codec_id = VOICE_FRAME_HEADER.unpack_from(decoded["bytes"])
+        payload = decoded["bytes"][VOICE_FRAME_HEADER.size:]
+
+        if codec_id in self.unusable_codecs:
+            return
+
+        decoders = self.decoders[player]
+        if codec_id not in decoders:
+            decoder = create_codec(codec_id)
+
+            if decoder is None:
+                Log.log(f"WARNING: Can't decode voice codec {codec_id} (from {player}), ignoring it")
+                self.unusable_codecs.add(codec_id)
+                return
+
+            decoders[codec_id] = decoder
+
+        audio = decoders[codec_id].decode(payload)
+
+        if player not in self.audio_buffers:
+            if len(self.__speaker_buffers) == self.MAX_SPEAKERS:
+                return
+
+            self.audio_buffers[player] = JitterBuffer()
+            self.__speaker_buffers.append(self.audio_buffers[player])
+
+        self.audio_buffers[player].push(sequence, (
             audio,
             decoded["vol"],
             decoded["radio"],
@@ -117,7 +510,9 @@ class ProxyChat:
             decoded["rel_y"],
         ))
 
-
+    def set_codecs(self, codec_ids):
+        """ Switches to the best codec everyone in the lobby can decode (sent by the server) """
+        self.codec = choose_codec(codec_ids)
 
     def on_udp_init(self, *args):
         if self.udp_conn is None:
@@ -8,6 +8,8 @@ from .tablet_system import TabletSystem
 
 
 class Game:
+    MAX_FRAME_DELTA = 0.1  # seconds
+
     def __init__(self, username, host, port=5678, dont_display=False):
         if not dont_display:
             Log().new()
@@ -87,7 +89,7 @@ class Game:
                         if event.key == pygame.K_b:
                             self.client.set_radio(False)
 
-                delta = self.clock.get_time() / 1000
+                delta = min(self.clock.get_time() / 1000, self.MAX_FRAME_DELTA)  # Stop a long stall teleporting us
                 keys = pygame.key.get_pressed()
 
                 self.render.update_player_orientation(*looking_pos)
@@ -0,0 +1,55 @@
+from collections import deque
+
+
+def lerp(a: float, b: float, t: float) -> float:
+    return a + (b - a) * t
+
+
+def lerp_angle(a: float, b: float, t: float) -> float:
+    """ Interpolates between two angles (in degrees) taking the shortest path """
+    difference = (b - a + 180) % 360 - 180
+    return a + difference * t
+
+
+class InterpolationBuffer:
+    """
+    Holds recent server snapshots of a single remote player so they can be drawn slightly in the past,
+    smoothly moving between two known states instead of jumping each time a packet lands.
+    """
+    def __init__(self, max_snapshots: int = 32):
+        self.snapshots: deque[tuple[float, tuple[float, float], float]] = deque(maxlen=max_snapshots)
+
+    def add(self, server_time: float, position, rotation: float):
+        """ Stores a snapshot, anything older than the newest stored snapshot is ignored """
+        if self.snapshots and server_time <= self.snapshots[-1][0]:
+            return
+
+        self.snapshots.append((server_time, (float(position[0]), float(position[1])), float(rotation)))
+
+    def sample(self, render_time: float) -> tuple[tuple[float, float], float] | None:
+        """ Returns the (position, rotation) at the given server time, or None if nothing has been received """
+        if not self.snapshots:
+            return None
+
+        first_time, first_position, first_rotation = self.snapshots[0]
+        if render_time <= first_time:
+            return first_position, first_rotation
+
+        last_time, last_position, last_rotation = self.snapshots[-1]
+        if render_time >= last_time:
+            return last_position, last_rotation  # No extrapolation, just hold the newest state
+
+        # Walk backwards, the pair we want is nearly always near the end
+        for i in range(len(self.snapshots) - 1, 0, -1):
+            start_time, start_position, start_rotation = self.snapshots[i - 1]
+
+            if start_time <= render_time:
+                end_time, end_position, end_rotation = self.snapshots[i]
+                t = (render_time - start_time) / (end_time - start_time)
+
+                return (
+                    (lerp(start_position[0], end_position[0], t), lerp(start_position[1], end_position[1], t)),
+                    lerp_angle(start_rotation, end_rotation, t)
+                )
+
+        return first_position, first_rotation
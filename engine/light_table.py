@@ -0,0 +1,136 @@
+import numpy as np
+
+from .map_sections import write_section, read_section
+
+TILE_SIZE = 16
+
+
+class LightTable:
+    """
+    Sparse pixel -> lights lookup, replacing the dense uint64 bit-per-light map (and its 64 light limit).
+    The map is split into tile_size squares, each tile lists the lights reaching it (CSR style, tile t's entries are
+    tile_offsets[t]:tile_offsets[t + 1]) along with a bitmask of exactly which of the tiles pixels each light reaches.
+    Memory scales with how much of the map is lit, not with its area
+    """
+    def __init__(self, shape, tile_offsets: np.ndarray, light_ids: np.ndarray, masks: np.ndarray,
+                 tile_size: int = TILE_SIZE):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.tile_size = tile_size
+        self.tiles_y = -(-self.shape[0] // tile_size)
+        self.tiles_x = -(-self.shape[1] // tile_size)
+
+        self.tile_offsets = tile_offsets
+        self.light_ids = light_ids
+        self.masks = masks  # (entries, tile_size * tile_size / 8) np.packbits of each tiles pixel mask
+
+    def lights_in_tile(self, tile_x: int, tile_y: int) -> np.ndarray:
+        tile = tile_y * self.tiles_x + tile_x
+        return self.light_ids[self.tile_offsets[tile]:self.tile_offsets[tile + 1]]
+
+    def lights_at(self, x: int, y: int) -> list[int]:
+        """ Ids of every light reaching pixel (x, y) """
+        tile = (y // self.tile_size) * self.tiles_x + (x // self.tile_size)
+        start, end = self.tile_offsets[tile], self.tile_offsets[tile + 1]
+
+        bit = (y % self.tile_size) * self.tile_size + (x % self.tile_size)
+        hits = self.masks[start:end, bit >> 3] & (0x80 >> (bit & 7))  # packbits is most significant bit first
+
+        return self.light_ids[start:end][hits != 0].tolist()
+
+    def pixels_of(self, light_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """ (ys, xs) of every pixel a light reaches, straight from the table so a single light can be relit """
+        entries = np.flatnonzero(self.light_ids == light_id)
+        tiles = np.searchsorted(self.tile_offsets, entries, side="right") - 1
+
+        size = self.tile_size
+        pixels = np.unpackbits(self.masks[entries], axis=1, count=size * size).reshape(len(entries), size, size)
+        entry, local_y, local_x = np.nonzero(pixels)
+
+        ys = (tiles[entry] // self.tiles_x) * size + local_y
+        xs = (tiles[entry] % self.tiles_x) * size + local_x
+        return ys, xs
+
+    def write(self, file):
+        file.write(self.tile_size.to_bytes(2, byteorder="big"))
+        file.write(self.shape[0].to_bytes(4, byteorder="big"))
+        file.write(self.shape[1].to_bytes(4, byteorder="big"))
+
+        write_section(file, self.tile_offsets.reshape(1, -1))
+        write_section(file, self.light_ids.reshape(1, -1))
+        write_section(file, self.masks)
+
+    @classmethod
+    def read(cls, file) -> "LightTable":
+        tile_size = int.from_bytes(file.read(2), byteorder="big")
+        shape = (int.from_bytes(file.read(4), byteorder="big"), int.from_bytes(file.read(4), byteorder="big"))
+
+        tile_offsets = read_section(file).reshape(-1)
+        light_ids = read_section(file).reshape(-1)
+        masks = read_section(file)
+
+        return cls(shape, tile_offsets, light_ids, masks, tile_size)
+
+    @classmethod
+    def from_dense(cls, id_map: np.ndarray) -> "LightTable":
+        """ Converts an old bit-per-light uint64 map """
+        builder = LightTableBuilder(id_map.shape)
+        used_bits = int(np.bitwise_or.reduce(id_map, axis=None)) if id_map.size else 0
+
+        for light_id in range(64):
+            if used_bits & (1 << light_id):
+                builder.add(light_id, 0, 0, (id_map & np.uint64(1 << light_id)) != 0)
+
+        return builder.build()
+
+
+class LightTableBuilder:
+    """ Collects the pixels each light reaches, one light at a time, then builds a LightTable """
+    def __init__(self, shape, tile_size: int = TILE_SIZE):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.tile_size = tile_size
+        self.tiles_y = -(-self.shape[0] // tile_size)
+        self.tiles_x = -(-self.shape[1] // tile_size)
+
+        self.__tiles = []
+        self.__light_ids = []
+        self.__masks = []
+
+    def add(self, light_id: int, y1: int, x1: int, in_range: np.ndarray):
+        """ in_range is the bool mask of pixels the light reaches, with its top left corner at (x1, y1) """
+        rows, cols = in_range.shape
+        if rows == 0 or cols == 0:
+            return
+
+        size = self.tile_size
+        tile_y1, tile_x1 = y1 // size, x1 // size
+        tile_y2, tile_x2 = -(-(y1 + rows) // size), -(-(x1 + cols) // size)
+
+        # Pad out to whole tiles, then view it as (tile rows, tile cols, size, size)
+        padded = np.zeros(((tile_y2 - tile_y1) * size, (tile_x2 - tile_x1) * size), dtype=bool)
+        pad_y, pad_x = y1 - tile_y1 * size, x1 - tile_x1 * size
+        padded[pad_y:pad_y + rows, pad_x:pad_x + cols] = in_range
+
+        tiles = padded.reshape(tile_y2 - tile_y1, size, tile_x2 - tile_x1, size).swapaxes(1, 2)
+        tile_y, tile_x = np.nonzero(tiles.any(axis=(2, 3)))
+
+        self.__tiles.append((tile_y + tile_y1) * self.tiles_x + (tile_x + tile_x1))
+        self.__light_ids.append(np.full(len(tile_y), light_id, dtype=np.uint32))
+        self.__masks.append(np.packbits(tiles[tile_y, tile_x].reshape(len(tile_y), size * size), axis=1))
+
+    def build(self) -> LightTable:
+        mask_bytes = -(-self.tile_size * self.tile_size // 8)
+
+        if self.__tiles:
+            tiles = np.concatenate(self.__tiles)
+            light_ids = np.concatenate(self.__light_ids)
+            masks = np.concatenate(self.__masks)
+        else:
+            tiles = np.zeros(0, dtype=np.intp)
+            light_ids = np.zeros(0, dtype=np.uint32)
+            masks = np.zeros((0, mask_bytes), dtype=np.uint8)
+
+        order = np.lexsort((light_ids, tiles))  # By tile, then by light within a tile
+        counts = np.bincount(tiles, minlength=self.tiles_y * self.tiles_x)
+        tile_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.uint32)
+
+        return LightTable(self.shape, tile_offsets, light_ids[order], masks[order], self.tile_size)
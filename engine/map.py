@@ -2,6 +2,9 @@ import numpy as np
 import uuid
 import os
 
+from .map_sections import read_section
+from .light_table import LightTable
+
 
 class MapLoadingException(Exception):
     pass
@@ -11,6 +14,7 @@ class Map:
     MAP_VERSION = 1
 
     background_img = None
+    background_texture = None
     scene = {}
     __maps = {}
     __lights = []
@@ -30,7 +34,7 @@ class Map:
         return path
 
     def load_layout(self, layout: dict) -> None:
-        if layout["version"] not in (1, 2):
+        if layout["version"] not in (1, 2, 3, 4):
             raise MapLoadingException("Invalid map version!")
 
         texture_index = self.render_engine.load_texture(
@@ -39,10 +43,13 @@ class Map:
 
         self.__maps["height"] = layout["map"]["height"]
         self.__maps["light"] = layout["map"]["light"]
+        self.__maps["light-table"] = layout["map"].get("light-table")  # Not in version 1 maps
+        self.__maps["light-ids"] = layout["map"].get("light-ids")  # Dense id map of v2 / v3 maps, see get_light_table
 
         self.__lights = layout["lights"]
 
-        self.background_img = self.render_engine.get_asset(texture_index).pygame_surface
+        self.background_texture = self.render_engine.get_asset(texture_index)
+        self.background_img = self.background_texture.pygame_surface
 
         self.scene = {}
         for world_object in layout["objects"]:
@@ -93,6 +100,17 @@ class Map:
     def get_lights(self):
         return self.__lights
 
+    def get_light_table(self):
+        """
+        LightTable of which lights reach each pixel, None for version 1 maps.
+        v2 / v3 maps store a dense id map instead, it's only converted the first time something asks for the table
+        """
+        if self.__maps.get("light-table") is None and self.__maps.get("light-ids") is not None:
+            self.__maps["light-table"] = LightTable.from_dense(self.__maps["light-ids"])
+            self.__maps["light-ids"] = None
+
+        return self.__maps.get("light-table")
+
 def read_string(file, length=2):
     length = int.from_bytes(file.read(length), byteorder="big")
 
@@ -111,6 +129,17 @@ def load_map(file, expected_dtype=None):
     data = file.read(data_length)
     return np.frombuffer(data, dtype=expected_dtype).reshape(width, height)
 
+def load_height_map(file):
+    """ Height maps are either float32 or packed into uint8 (0-255 -> 0-1), told apart by the size of the data """
+    width, height = int.from_bytes(file.read(2), byteorder="big"), int.from_bytes(file.read(2), byteorder="big")
+    data_length = int.from_bytes(file.read(4), byteorder="big")
+    data = file.read(data_length)
+
+    if data_length == width * height:
+        return np.frombuffer(data, dtype=np.uint8).reshape(width, height).astype(np.float32) / 255
+
+    return np.frombuffer(data, dtype=np.float32).reshape(width, height)
+
 def read_path(file, length=2):
     data = read_string(file, length)
     if "../" in data: raise FileNotFoundError("Bad Path!")  # Stop
@@ -119,6 +148,8 @@ def read_path(file, length=2):
 class LoadedMap(Map):
     MAP_VERSION_1 = 1
     MAP_VERSION_2 = 2
+    MAP_VERSION_3 = 3  # Version 2 with compressed map sections
+    MAP_VERSION_4 = 4  # Version 3 with a sparse light table and wider switch light ids
 
     def __init__(self, render_engine, path):
         super().__init__(render_engine)
@@ -173,9 +204,11 @@ class LoadedMap(Map):
         with open(path, "rb") as f:
             layout["version"] = int.from_bytes(f.read(2), byteorder="big")
 
-            if layout["version"] != self.MAP_VERSION_2:
+            if layout["version"] not in (self.MAP_VERSION_2, self.MAP_VERSION_3, self.MAP_VERSION_4):
                 raise MapLoadingException("Invalid map version!")
 
+            switch_count_size, switch_id_size = (2, 4) if layout["version"] >= self.MAP_VERSION_4 else (1, 1)
+
             layout["background"] = self.temp_load_image(f)
 
             object_count = int.from_bytes(f.read(4), byteorder="big")
@@ -200,9 +233,9 @@ class LoadedMap(Map):
 
                     "lights": [
                         {
-                            "id": int.from_bytes(f.read(1), byteorder="big"),
+                            "id": int.from_bytes(f.read(switch_id_size), byteorder="big"),
                             "enabled": f.read(1) == b"O"
-                        } for _ in range(int.from_bytes(f.read(1), byteorder="big"))
+                        } for _ in range(int.from_bytes(f.read(switch_count_size), byteorder="big"))
                     ]
                 } for _ in range(int.from_bytes(f.read(4), byteorder="big"))
             ]
@@ -217,11 +250,27 @@ class LoadedMap(Map):
             ]
 
 
-            layout["map"] = {
-                "height": load_map(f, expected_dtype=np.float32),
-                "light": load_map(f, expected_dtype=np.float32),
-                "light-ids": load_map(f, expected_dtype=np.uint64),
-            }
+            if layout["version"] >= self.MAP_VERSION_3:
+                height_map = read_section(f)
+                if height_map.dtype == np.uint8:  # Packed heights
+                    height_map = height_map.astype(np.float32) / 255
+
+                layout["map"] = {
+                    "height": height_map,
+                    "light": read_section(f),
+                }
+
+                if layout["version"] >= self.MAP_VERSION_4:
+                    layout["map"]["light-table"] = LightTable.read(f)
+                else:
+                    layout["map"]["light-ids"] = read_section(f)
+
+            else:
+                layout["map"] = {
+                    "height": load_height_map(f),
+                    "light": load_map(f, expected_dtype=np.float32),
+                    "light-ids": load_map(f, expected_dtype=np.uint64),
+                }
 
         self.load_layout(layout)
 
@@ -230,7 +279,7 @@ class LoadedMap(Map):
         with open(path, "rb") as f:
             layout["version"] = int.from_bytes(f.read(2), byteorder="big")
 
-            if layout["version"] == self.MAP_VERSION_2:
+            if layout["version"] in (self.MAP_VERSION_2, self.MAP_VERSION_3, self.MAP_VERSION_4):
                 f.close()
 
                 self.load_v2(path)
@@ -0,0 +1,174 @@
+import numpy as np
+import lz4.frame
+
+"""
+
+Array sections used by v3 map files (height map, light map and light id map).
+
+Section layout (big-endian header, little-endian array data):
+    rows (4) | cols (4) | dtype (1) | flags (1) | packed dtype (1) | raw length (8) | payload length (8) | payload
+
+Flags describe how the payload was built, each pre-pass is undone in reverse order when reading:
+    FLAG_NARROW - unsigned ints stored in the smallest dtype that holds the largest value (packed dtype)
+    FLAG_RLE    - run-length encoded: run count (8) | run values | run lengths (uint32)
+    FLAG_LZ4    - the above compressed as a single LZ4 frame
+
+"""
+
+FLAG_LZ4 = 1
+FLAG_RLE = 2
+FLAG_NARROW = 4
+
+DTYPES = {
+    0: np.dtype("<f4"),
+    1: np.dtype("u1"),
+    2: np.dtype("<u2"),
+    3: np.dtype("<u4"),
+    4: np.dtype("<u8"),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+NARROW_DTYPES = (DTYPES[1], DTYPES[2], DTYPES[3], DTYPES[4])
+RUN_LENGTH_DTYPE = np.dtype("<u4")
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+def narrowest_dtype(array: np.ndarray) -> np.dtype:
+    """ Smallest unsigned dtype that can hold every value in array """
+    largest = int(array.max()) if array.size else 0
+
+    for dtype in NARROW_DTYPES:
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+
+    return array.dtype
+
+
+def run_length_encode(flat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ Returns (values, lengths) of every run of equal values """
+    if flat.size == 0:
+        return flat[:0], np.zeros(0, dtype=RUN_LENGTH_DTYPE)
+
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+
+    return flat[starts], lengths.astype(RUN_LENGTH_DTYPE)
+
+
+def write_section(file, array: np.ndarray, compress: bool = True, rle: bool | None = None, narrow: bool = True):
+    """
+    Writes array as a section. rle=None only run-length encodes when the runs take under half the space of the
+    raw data, narrow only applies to unsigned int arrays
+    """
+    dtype = array.dtype.newbyteorder("<") if array.dtype.itemsize > 1 else array.dtype
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported section dtype: {array.dtype}")
+
+    flat = np.ascontiguousarray(array, dtype=dtype).reshape(-1)
+    flags = 0
+
+    packed_dtype = dtype
+    if narrow and dtype.kind == "u":
+        packed_dtype = narrowest_dtype(flat)
+
+        if packed_dtype.itemsize < dtype.itemsize:
+            flat = flat.astype(packed_dtype)
+            flags |= FLAG_NARROW
+        else:
+            packed_dtype = dtype
+
+    use_rle = rle is not False and flat.size <= np.iinfo(RUN_LENGTH_DTYPE).max
+    if use_rle:
+        values, lengths = run_length_encode(flat)
+        use_rle = rle or 8 + values.nbytes + lengths.nbytes < flat.nbytes // 2
+
+    if use_rle:
+        raw = len(values).to_bytes(8, byteorder="big") + values.tobytes() + lengths.tobytes()
+        flags |= FLAG_RLE
+    else:
+        raw = flat.tobytes()
+
+    payload = raw
+    if compress:
+        payload = lz4.frame.compress(raw)
+        flags |= FLAG_LZ4
+
+    rows, cols = array.shape
+
+    file.write(rows.to_bytes(4, byteorder="big"))
+    file.write(cols.to_bytes(4, byteorder="big"))
+    file.write(DTYPE_CODES[dtype].to_bytes(1, byteorder="big"))
+    file.write(flags.to_bytes(1, byteorder="big"))
+    file.write(DTYPE_CODES[packed_dtype].to_bytes(1, byteorder="big"))
+    file.write(len(raw).to_bytes(8, byteorder="big"))
+    file.write(len(payload).to_bytes(8, byteorder="big"))
+    file.write(payload)
+
+
+def _read_exact(file, length: int) -> bytes:
+    data = file.read(length)
+
+    if len(data) != length:
+        raise EOFError("Map section ended early")
+
+    return data
+
+
+def _read_payload(file, flags: int, raw_length: int, payload_length: int) -> bytearray:
+    """ Reads (and decompresses) the payload a chunk at a time straight into one buffer """
+    raw = bytearray(raw_length)
+
+    if not flags & FLAG_LZ4:
+        if file.readinto(memoryview(raw)) != raw_length:
+            raise EOFError("Map section ended early")
+        return raw
+
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    position = 0
+    remaining = payload_length
+
+    while remaining:
+        chunk = file.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise EOFError("Map section ended early")
+
+        remaining -= len(chunk)
+
+        data = decompressor.decompress(chunk)
+        raw[position:position + len(data)] = data
+        position += len(data)
+
+    if position != raw_length:
+        raise EOFError("Map section decompressed to the wrong size")
+
+    return raw
+
+
+def read_section(file) -> np.ndarray:
+    rows = int.from_bytes(_read_exact(file, 4), byteorder="big")
+    cols = int.from_bytes(_read_exact(file, 4), byteorder="big")
+    dtype = DTYPES[_read_exact(file, 1)[0]]
+    flags = _read_exact(file, 1)[0]
+    packed_dtype = DTYPES[_read_exact(file, 1)[0]]
+    raw_length = int.from_bytes(_read_exact(file, 8), byteorder="big")
+    payload_length = int.from_bytes(_read_exact(file, 8), byteorder="big")
+
+    raw = _read_payload(file, flags, raw_length, payload_length)
+
+    if flags & FLAG_RLE:
+        run_count = int.from_bytes(raw[:8], byteorder="big")
+        values_end = 8 + run_count * packed_dtype.itemsize
+
+        values = np.frombuffer(raw, dtype=packed_dtype, count=run_count, offset=8)
+        lengths = np.frombuffer(raw, dtype=RUN_LENGTH_DTYPE, count=run_count, offset=values_end)
+        flat = np.repeat(values, lengths)
+
+    else:
+        flat = np.frombuffer(raw, dtype=packed_dtype)
+
+    if flags & FLAG_NARROW:
+        flat = flat.astype(dtype)
+
+    # Native byte order, bytearray backed so the result is writable
+    return flat.astype(dtype.newbyteorder("="), copy=False).reshape(rows, cols)
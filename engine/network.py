@@ -1,4 +1,3 @@
-import math
 import os
 import random
 import socket
@@ -7,7 +6,7 @@ import io
 import time
 import tempfile
 from typing import Any
-import pygame
+import numpy as np
 
 from packet_manager import *
 from packet_manager.udp_handshake import PeerServer as Server_UDP_Handshake
@@ -15,7 +14,8 @@ from packet_manager.udp_handshake import Client as Client_UDP_Handshake
 
 from .file_api import encode_dict, decode_dict
 from .logger import Log
-from .audio_engine import ProxyChat
+from .audio_engine import ProxyChat, encode_voice_header, decode_voice_packet, available_codec_ids
+from .interpolation import InterpolationBuffer
 
 
 def send_value(conn, value, compressed=False):
@@ -92,6 +92,8 @@ class Player:
 class Server:
     MAX_PLAYERS = 5
     SERVER_FPS = 60
+    SNAPSHOT_TICKS = 2  # Send a snapshot every n ticks, clients interpolate between them
+    MAX_CATCHUP_TICKS = 10  # If we fall further behind than this, skip ahead rather than spiral
 
     def __init__(self, map_path, public_ip, port=5678, debug_on_lan=False):
         self.local_ip = socket.gethostbyname(socket.gethostname())
@@ -117,7 +119,13 @@ class Server:
         self.connections = []
         self.__addr_lookup: dict[str, int] = {}
 
+        # Voice interest management, indexed by player index
+        self.player_positions = np.zeros((self.MAX_PLAYERS, 2), dtype=np.float32)
+        self.__voice_connections: dict[int, ConnectionUDP] = {}
+        self.__voice_codecs: dict[int, set[int]] = {}  # Codec ids each player can decode, by player index
+
         self.mode = "starting"
+        self.tick = 0
 
     def __startup(self):
         """ Starts up the server, run in a thread (from the 'run' method)"""
@@ -129,14 +137,31 @@ class Server:
 
         Log.log(f"Entering Update Loop")
 
-        tick = 0
-        clock = pygame.time.Clock()
+        tick_length = 1 / self.SERVER_FPS
+        next_tick_time = time.perf_counter()
 
         while True:
             self.__update_networks()
-            self.__update_player_positions()
 
-            clock.tick(self.SERVER_FPS)
+            if self.tick % self.SNAPSHOT_TICKS == 0:
+                self.__update_player_positions()
+
+            self.tick += 1
+            next_tick_time += tick_length
+
+            # Fixed timestep, sleep until the next tick is due (or run straight away if we are behind)
+            time_left = next_tick_time - time.perf_counter()
+
+            if time_left > 0:
+                time.sleep(time_left)
+
+            elif -time_left > tick_length * self.MAX_CATCHUP_TICKS:
+                # Too far behind to catch up, skip the missed ticks but keep counting them so the tick stays in step
+                # with wall clock time (clients interpolate by tick)
+                skipped_ticks = int(-time_left // tick_length)
+
+                self.tick += skipped_ticks
+                next_tick_time += skipped_ticks * tick_length
 
 
     def __get_players_information(self):
@@ -155,6 +180,13 @@ class Server:
         except ValueError:
             pass
 
+        for tcp, udp in self.connections:
+            if tcp is conn_manager and udp:
+                udp.close()  # Forget its channel state, so reconnecting from the same address starts fresh
+
+        if hasattr(conn_manager, "_player_index"):
+            self.__forget_voice_player(getattr(conn_manager, "_player_index"))
+
         conn_manager.sock.close()
 
     @staticmethod
@@ -167,44 +199,70 @@ class Server:
     def on_tps(self, conn_manager: ConnectionTCP, data: bytes):
         conn_manager.send("tps", self.SERVER_FPS.to_bytes(8, byteorder="big"))
 
-    def on_player_toggle_radio(self, conn_manager: ConnectionTCP, data: bytes):
-        player: Player = self.__get_player_from_conn(conn_manager)
+    def on_player_toggle_radio(self, conn_manager: ConnectionUDP, sender, data: bytes):
+        player: Player = self.__get_player_from_addr(sender)
 
         player.using_radio = data == b"1"
 
     def on_player_info(self, conn_manager: ConnectionUDP, sender, data: bytes):
-        player = self.__get_player_from_addr(sender)
+        player_index = self.__get_player_index_from_addr(sender)
+        player = self.players[player_index]
         player.recv_info(read_value(data))
 
+        position = player.position if type(player.position[0]) in (int, float) else player.position[0]
+        self.player_positions[player_index] = position
+
     def on_other_players_info(self, conn_manager: ConnectionUDP, sender, data: bytes):
         conn_manager.send("player_data", write_value(self.__get_players_information()))
 
     def on_recv_voice_data(self, conn_manager: ConnectionUDP, sender, data: bytes):
-        send_player: Player = self.__get_player_from_addr(sender)
-        send_pos = send_player.position if type(send_player.position[0]) in (int, float) else send_player.position[0]
+        send_index = self.__get_player_index_from_addr(sender)
+        send_player: Player = self.players[send_index]
 
-        for conn_tcp, conn_udp in self.connections:
-            if conn_udp == conn_manager: # Stop player hearing themselves
+        # Relative position / volume of every player at once
+        offsets = self.player_positions[:len(self.players)] - self.player_positions[send_index]
+
+        if send_player.using_radio:
+            volumes = np.ones(len(offsets), dtype=np.float32)
+
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            volumes = np.clip((self.max_voice_distance - distances) / self.max_voice_distance, 0, 1)
+
+        volumes[send_index] = 0  # Stop player hearing themselves
+
+        # Only players who can actually hear it get sent anything
+        for recv_index in np.flatnonzero(volumes > 0):
+            conn_udp = self.__voice_connections.get(int(recv_index))
+
+            if conn_udp is None:
                 continue
 
-            # Calculate Relative Position / Volume
-            recv_player: Player = self.__get_player_from_conn(conn_tcp)
-            recv_pos = recv_player.position if type(recv_player.position[0]) in (int, float) else recv_player.position[0]
+            rel_x, rel_y = offsets[recv_index]
+            header = encode_voice_header(send_index, send_player.using_radio, volumes[recv_index], rel_x, rel_y)
+
+            conn_udp.send("ProxyVoiceToClient", header + data)
+
+    def on_voice_codecs(self, conn_manager: ConnectionUDP, sender, data: bytes):
+        """ A player saying which voice codecs it can decode, everyone is told the ones the whole lobby can """
+        self.__voice_codecs[self.__get_player_index_from_addr(sender)] = set(data)
+        self.__send_voice_codecs()
+
+    def __send_voice_codecs(self):
+        if not self.__voice_codecs:
+            return
 
-            dx = recv_pos[0] - send_pos[0]
-            dy = recv_pos[1] - send_pos[1]
+        common = bytes(sorted(set.intersection(*self.__voice_codecs.values())))
 
-            dist = math.sqrt(dx*dx + dy*dy)
-            volume = max(0, (self.max_voice_distance - dist) / self.max_voice_distance)
+        for udp in self.__voice_connections.values():
+            udp.send("voice_codecs", common, channel=Channel.RELIABLE_ORDERED)
 
-            if send_player.using_radio:
-                volume = 1
+    def __forget_voice_player(self, player_index: int):
+        """ A player has left (or timed out), stop sending them voice and renegotiate codecs without them """
+        self.__voice_connections.pop(player_index, None)
 
-            conn_udp.send("ProxyVoiceToClient", write_value({
-                "bytes": data, "from": sender,
-                "vol": volume, "radio": send_player.using_radio,
-                "rel_x": dx, "rel_y": dy
-            }))
+        if self.__voice_codecs.pop(player_index, None) is not None:
+            self.__send_voice_codecs()
 
     def __get_player_from_conn(self, conn: ConnectionUDP | ConnectionTCP) -> Player:
         if hasattr(conn, "_player_index"):
@@ -219,16 +277,18 @@ class Server:
         else:
             raise AttributeError("Player Doesn't Have Connection Set!")
 
-    def __get_player_from_addr(self, addr: tuple[str, int]):
+    def __get_player_index_from_addr(self, addr: tuple[str, int]) -> int:
         ip, port = addr
 
         if ip in self.__addr_lookup:
-            player_id = self.__addr_lookup[ip]
-            return self.players[player_id]
+            return self.__addr_lookup[ip]
 
         else:
             raise LookupError
 
+    def __get_player_from_addr(self, addr: tuple[str, int]):
+        return self.players[self.__get_player_index_from_addr(addr)]
+
 
     def __handle_client(self, conn: socket.socket, addr: tuple[str, int]):
         """ Handles client connections """
@@ -248,8 +308,6 @@ class Server:
             b"ping": self.on_ping,
             b"map_data": self.on_map_request,
             b"tps": self.on_tps,
-
-            b"set_radio": self.on_player_toggle_radio
         }
 
 
@@ -264,6 +322,8 @@ class Server:
 
         udp_con.add_packet_callback("ProxyVoiceToServer", self.on_recv_voice_data)
         udp_con.add_packet_callback("player_info", self.on_player_info)
+        udp_con.add_packet_callback("set_radio", self.on_player_toggle_radio)
+        udp_con.add_packet_callback("voice_codecs", self.on_voice_codecs)
 
         udp_con.set_generic_callback(self.unknown_packet_callback)
 
@@ -277,6 +337,8 @@ class Server:
         setattr(udp_con, "_player_index", player_index)
 
         self.__addr_lookup[packet_manager_tcp.sock.getpeername()[0]] = player_index
+        self.__voice_connections[player_index] = udp_con
+        udp_con.set_connection_drop_callback(lambda: self.__forget_voice_player(player_index))
 
         # Add connection tracking info
         self.connections.append([packet_manager_tcp, udp_con])
@@ -291,10 +353,10 @@ class Server:
                 udp.update()
 
     def __update_player_positions(self):
-        player_info = self.__get_players_information()
+        snapshot = write_value({"tick": self.tick, "players": self.__get_players_information()})
 
         for tcp, udp in self.connections:
-            udp.send("GlobalPlayerData", write_value(player_info))
+            udp.send("GlobalPlayerData", snapshot, channel=Channel.UNRELIABLE_SEQUENCED)
 
 
     def run(self):
@@ -316,6 +378,8 @@ class Server:
 
 
 class Client:
+    INTERPOLATION_DELAY = 0.1  # seconds, remote players are drawn this far in the past
+
     def __init__(self, render_engine, player: Player, host: str, port: int = 5678):
         self.address = (host, port)
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -331,6 +395,9 @@ class Client:
         self.target_tps = 60
         self.target_time = 1 / self.target_tps
 
+        self.interpolation_buffers: dict[str, InterpolationBuffer] = {}
+        self.server_time_offset = None  # server time - local time
+
         self.__tcp_callbacks = {
             b"pong": self.on_pong,
             b"map_data": self.on_recv_map_data,
@@ -340,7 +407,7 @@ class Client:
         self.tcp = None
         self.udp = None
 
-        self.proxy_chat = ProxyChat(self.udp, read_value)
+        self.proxy_chat = ProxyChat(self.udp, decode_voice_packet)
 
     @staticmethod
     def unknown_packet_callback(conn_manager, packet_type, data, protocol: str):
@@ -358,6 +425,8 @@ class Client:
             raise ConnectionError("Failed to establish UDP")
 
         self.udp.add_packet_callback("GlobalPlayerData", self.on_player_info_update)
+        self.udp.add_packet_callback("voice_codecs", self.on_voice_codecs)
+        self.udp.send("voice_codecs", bytes(available_codec_ids()), channel=Channel.RELIABLE_ORDERED)
 
         self.proxy_chat.udp_conn = self.udp
         self.proxy_chat.on_udp_init()
@@ -410,22 +479,59 @@ class Client:
         self.target_tps = int.from_bytes(data, byteorder="big")
         self.target_time = 1 / self.target_tps
 
+    def on_voice_codecs(self, udp_conn, sender, data: bytes):
+        self.proxy_chat.set_codecs(data)
+
     def set_radio(self, is_on: bool):
-        self.tcp.send("set_radio", b"1" if is_on else b"0")
+        if self.udp is not None:
+            self.udp.send("set_radio", b"1" if is_on else b"0", channel=Channel.RELIABLE_ORDERED)
 
     def update_player_info(self):
         """ Update the servers version of out data"""
         if self.udp is not None:
-            self.udp.send("player_info", write_value(self.player.get_info()))
+            self.udp.send("player_info", write_value(self.player.get_info()), channel=Channel.UNRELIABLE_SEQUENCED)
 
     def on_player_info_update(self, udp_conn, sender: tuple[str, int], data: bytes):
         """ Retrieves and updates all player data (including our own) """
 
-        for player_info in read_value(data):  # NOQA - It should always be a list
-            if player_info["username"] not in self.players:
-                self.players[player_info["username"]] = Player()
+        snapshot = read_value(data)
+        server_time = snapshot["tick"] / self.target_tps
+        self.__update_server_time_offset(server_time)
+
+        for player_info in snapshot["players"]:
+            username = player_info["username"]
+
+            if username not in self.players:
+                self.players[username] = Player()
+                self.interpolation_buffers[username] = InterpolationBuffer()
+
+            self.players[username].recv_info(player_info)
+
+            position = player_info["position"]
+            if type(position[0]) not in (int, float):  # Unset positions arrive nested
+                position = position[0]
+
+            self.interpolation_buffers[username].add(server_time, position, player_info["rotation"])
+
+    def __update_server_time_offset(self, server_time: float):
+        """ Tracks the offset to the servers clock, favouring the quickest arriving snapshots """
+        estimate = server_time - time.perf_counter()
+
+        if self.server_time_offset is None or estimate > self.server_time_offset:
+            self.server_time_offset = estimate
+        else:
+            self.server_time_offset += (estimate - self.server_time_offset) * 0.05  # Slowly follow any drift
+
+    def get_render_time(self) -> float:
+        """ The server time remote players should currently be drawn at """
+        return time.perf_counter() + (self.server_time_offset or 0) - self.INTERPOLATION_DELAY
+
+    def get_interpolated_state(self, username: str) -> tuple[tuple[float, float], float] | None:
+        """ Returns the smoothed (position, rotation) of a remote player, or None if we have no snapshots """
+        if username not in self.interpolation_buffers:
+            return None
 
-            self.players[player_info["username"]].recv_info(player_info)
+        return self.interpolation_buffers[username].sample(self.get_render_time())
 
 
     def load_map(self, map_data):
@@ -0,0 +1,25 @@
+import pyopencl as pycl
+
+
+class OpenClContext:
+    def __init__(self, device_type=None):
+        """ device_type (e.g. pycl.device_type.CPU) uses the first device of that type instead of create_some_context """
+        if device_type is None:
+            self.context = pycl.create_some_context()
+        else:
+            self.context = pycl.Context(devices=[self.find_device(device_type)])
+
+        self.queue = pycl.CommandQueue(self.context, device=None)
+
+    @staticmethod
+    def find_device(device_type):
+        for platform in pycl.get_platforms():
+            try:
+                devices = platform.get_devices(device_type=device_type)
+            except pycl.Error:  # Platforms raise instead of returning nothing
+                continue
+
+            if devices:
+                return devices[0]
+
+        raise RuntimeError(f"No OpenCL {pycl.device_type.to_string(device_type)} device found")
@@ -9,17 +9,14 @@ from .assets import Texture2D
 from .map import LoadedMap
 from .logger import Log
 from .model import Model
+from .opencl import OpenClContext
 
 
 mf = pycl.mem_flags
-class OpenClContext:
-    def __init__(self):
-        self.context = pycl.create_some_context()
-        self.queue = pycl.CommandQueue(self.context, device=None)
 
 
 class Render:
-    QUALITY = 0.8   # The amount textures are downscaled
+    QUALITY = 0.8   # The amount textures are downscaled, the world (background + props) is drawn at this scale
     RAY_COUNT = 4000
 
     DEBUG = False
@@ -69,6 +66,8 @@ class Render:
         self.shadow_mask_buffer = pycl.Buffer(self.cl.context, mf.READ_WRITE, size=self.shadow_mask.nbytes, hostbuf=None)
         self.shadow_mask_surface = pygame.Surface(self.display_size, pygame.SRCALPHA)
 
+        self.__world_surface = None
+
         self.player_model = Model("data/models/player.json")
         self.inventory_texture = self.create_inventory_texture()
 
@@ -327,15 +326,20 @@ class Render:
         self.update_network()
         self.compute_shadow_mask()
 
-        self.display.blit(self.__map.background_img, (-self.position[1] + self.display_size[0]//2, -self.position[0] + self.display_size[1]//2))
+        if self.QUALITY >= 1:
+            self.render_world(self.display, 1)
 
-        for world_object in self.__map.scene.values():
-            if "NORENDER" in world_object["path"]:
-                continue
+        else:
+            # Drawn small from the mip chains then stretched up once, far fewer pixels to blit on low end machines
+            world_size = (max(1, round(self.display_size[0] * self.QUALITY)),
+                          max(1, round(self.display_size[1] * self.QUALITY)))
 
-            texture = self.get_asset(world_object["texture_id"])
-            x, y = world_object["position"]
-            self.display.blit(texture.pygame_surface, (x - self.position[1] + self.display_size[0]//2, y - self.position[0] + self.display_size[1]//2))
+            if self.__world_surface is None or self.__world_surface.get_size() != world_size:
+                self.__world_surface = pygame.Surface(world_size)
+
+            self.__world_surface.fill((30, 30, 30))
+            self.render_world(self.__world_surface, self.QUALITY)
+            pygame.transform.scale(self.__world_surface, self.display_size, self.display)
 
         self.render_self()
 
@@ -349,6 +353,24 @@ class Render:
         self.render_hud(deltaTime)
         return None
 
+    def render_world(self, target: pygame.Surface, scale: float):
+        """ Draws the background and props onto target, with everything scaled by scale """
+        half_width, half_height = target.get_width() // 2, target.get_height() // 2
+
+        self.__blit_world_texture(target, self.__map.background_texture, 0, 0, scale, half_width, half_height)
+
+        for world_object in self.__map.scene.values():
+            if "NORENDER" in world_object["path"]:
+                continue
+
+            texture = self.get_asset(world_object["texture_id"])
+            x, y = world_object["position"]
+            self.__blit_world_texture(target, texture, x, y, scale, half_width, half_height)
+
+    def __blit_world_texture(self, target, texture: Texture2D, x, y, scale, half_width, half_height):
+        target.blit(texture.get_scaled(scale), ((x - self.position[1]) * scale + half_width,
+                                                (y - self.position[0]) * scale + half_height))
+
     def render_self(self):
         self.render_model(self.player_model, self.display_size[0] // 2, self.display_size[1] // 2)
 
@@ -358,7 +380,12 @@ class Render:
         self.display.blit(texture, (cx - (texture.get_width() // 2), cy - (texture.get_height() // 2)))
 
     def render_player(self, player):
-        if len(player.position) == 2:  # This networking code is old, and fucked. Royally
+        state = self.client.get_interpolated_state(player.username)
+
+        if state is not None:
+            (player_y, player_x), rotation = state
+
+        elif len(player.position) == 2:  # This networking code is old, and fucked. Royally
             player_y, player_x = player.position
             rotation = player.rotation
         else:
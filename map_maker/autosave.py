@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import queue
+import threading
+
+import project_manager
+
+"""
+
+Background saving for the map maker.
+
+The UI thread only ever takes a snapshot (project_manager.snapshot_project) and queues it, everything else happens on
+a worker thread. Autosaves for a project go next to it:
+
+    <project>.autosave          - a full snapshot, same format as a .project file
+    <project>.autosave.journal  - one JSON line per autosave since that snapshot, holding only the entries that changed
+
+Every FULL_SNAPSHOT_EVERY journal lines the journal is folded into a new full snapshot and emptied. Every file is
+written to a temp file and renamed over, apart from the journal which is only ever appended to (a torn last line is
+ignored when recovering). Each snapshot has a "generation", and journal lines from any other generation are ignored, so
+a crash between writing a snapshot and emptying the journal can't replay old edits over it.
+
+"""
+
+SECTIONS = ("rooms", "objects", "lights", "switches")
+FULL_SNAPSHOT_EVERY = 50
+
+STOP = ("stop", None, None)
+
+
+def autosave_path(project_path: str) -> str:
+    return f"{project_path}.autosave"
+
+
+def journal_path(project_path: str) -> str:
+    return f"{project_path}.autosave.journal"
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """ Per section, the new length and each index whose entry changed """
+    changes = {}
+
+    for section in SECTIONS:
+        old_entries, new_entries = old[section], new[section]
+
+        changed = {
+            str(i): entry for i, entry in enumerate(new_entries)
+            if i >= len(old_entries) or old_entries[i] != entry
+        }
+
+        if changed or len(old_entries) != len(new_entries):
+            changes[section] = {"length": len(new_entries), "changed": changed}
+
+    return changes
+
+
+def apply_diff(snapshot: dict, changes: dict) -> dict:
+    snapshot = dict(snapshot)
+
+    for section, change in changes.items():
+        entries = list(snapshot[section][:change["length"]])
+        entries.extend([None] * (change["length"] - len(entries)))
+
+        for i, entry in change["changed"].items():
+            entries[int(i)] = entry
+
+        snapshot[section] = entries
+
+    return snapshot
+
+
+def recover(project_path: str) -> dict | None:
+    """ The newest autosaved state of a project (full snapshot plus journal), or None if there isn't one """
+    path = autosave_path(project_path)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+
+    if os.path.exists(journal_path(project_path)):
+        with open(journal_path(project_path), "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:  # Cut off part way through writing, everything before it is fine
+                    break
+
+                if entry.get("generation") == snapshot.get("generation"):
+                    snapshot = apply_diff(snapshot, entry["changes"])
+
+    return snapshot
+
+
+def has_newer_autosave(project_path: str) -> bool:
+    path = autosave_path(project_path)
+    if not os.path.exists(path):
+        return False
+
+    newest = max(os.path.getmtime(path), os.path.getmtime(journal_path(project_path))
+                 if os.path.exists(journal_path(project_path)) else 0)
+
+    return not os.path.exists(project_path) or newest > os.path.getmtime(project_path)
+
+
+def discard(project_path: str):
+    for path in (journal_path(project_path), autosave_path(project_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class AutosaveService:
+    """ Owns the worker thread, autosave() / save() just queue a snapshot and return straight away """
+    def __init__(self):
+        self.__jobs: queue.Queue = queue.Queue()
+        self.__held = None  # A job taken off the queue while skipping stale autosaves, runs next
+        self.__worker = threading.Thread(target=self.__run, daemon=True)
+
+        self.__project_path = None
+        self.__base = None  # Last state written for __project_path (snapshot + journal)
+        self.__generation = 0
+        self.__journal_lines = 0
+
+        self.error: Exception | None = None
+        self.last_save_time = 0.0
+
+        self.__worker.start()
+
+    def autosave(self, project_path: str, snapshot: dict):
+        self.__jobs.put(("autosave", project_path, snapshot))
+
+    def save(self, project_path: str, snapshot: dict):
+        """ A proper save, the autosave files for it are removed once it's written """
+        self.__jobs.put(("save", project_path, snapshot))
+
+    def discard(self, project_path: str):
+        """ Removes a projects autosave files, after anything already queued for it """
+        self.__jobs.put(("discard", project_path, None))
+
+    def stop(self):
+        """ Finishes anything queued, then stops the worker """
+        self.__jobs.put(STOP)
+        self.__worker.join()
+
+    def __next_job(self):
+        if self.__held is not None:
+            job, self.__held = self.__held, None
+        else:
+            job = self.__jobs.get()
+
+        # Only the newest autosave matters, skip any that piled up behind it
+        while job[0] == "autosave":
+            try:
+                newer = self.__jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            if newer[0] != "autosave" or newer[1] != job[1]:
+                self.__held = newer
+                break
+
+            job = newer
+
+        return job
+
+    def __run(self):
+        while True:
+            job = self.__next_job()
+            if job is STOP:
+                return
+
+            kind, project_path, snapshot = job
+
+            try:
+                if kind == "save":
+                    project_manager.write_project(project_path, snapshot)
+                    discard(project_path)
+                    self.__project_path = None
+                    print("Save Completed!")
+
+                elif kind == "discard":
+                    discard(project_path)
+                    if project_path == self.__project_path:
+                        self.__project_path = None
+
+                else:
+                    self.__write_autosave(project_path, snapshot)
+
+                self.last_save_time = time.time()
+                self.error = None
+
+            except Exception as e:  # Anything, this thread is the only way saves happen so it must keep running
+                self.error = e
+                print(f"[WARNING] {'Saving' if kind == 'save' else 'Autosaving'} {project_path} failed: "
+                      f"{type(e).__name__}: {e}")
+
+    def __write_autosave(self, project_path: str, snapshot: dict):
+        if project_path != self.__project_path or self.__journal_lines >= FULL_SNAPSHOT_EVERY:
+            self.__write_full(project_path, snapshot)
+            return
+
+        changes = diff_snapshots(self.__base, snapshot)
+        if not changes:
+            return
+
+        with open(journal_path(project_path), "a") as f:
+            f.write(json.dumps({"generation": self.__generation, "changes": changes}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.__base = snapshot
+        self.__journal_lines += 1
+
+    def __write_full(self, project_path: str, snapshot: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(project_path)), exist_ok=True)
+
+        generation = time.time_ns()
+
+        project_manager.write_atomic(autosave_path(project_path), json.dumps({**snapshot, "generation": generation}))
+        project_manager.write_atomic(journal_path(project_path), "")
+
+        self.__project_path = project_path
+        self.__generation = generation
+        self.__base = snapshot
+        self.__journal_lines = 0
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # No display on build servers, nothing here opens a window
+
+MAP_MAKER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(MAP_MAKER_DIR))  # Repo root, for the engine / map_maker imports
+
+import project_manager  # NOQA: E402
+from engine import map_sections, light_table  # NOQA: E402
+
+"""
+
+Headless batch export for map projects, the same export as Ctrl+E in the editor but without a display or any dialogs.
+
+Projects are exported in parallel (one process each), and each one prints how long every stage took. A content hash of
+the project, every image it uses, the export options and the exporter (EXPORTER_FILES and project_manager's
+EXPORTER_VERSION) is kept next to the outputs in HASH_FILE, projects whose hash hasn't changed since their last export
+are skipped (--force exports them anyway).
+
+Texture paths in projects are relative to the map_maker folder, so everything runs from there whatever the cwd is.
+
+Usage: python map_maker/batch_export.py maps/*.project --output-dir build/maps --jobs 8
+
+"""
+
+HASH_FILE = ".export_hashes.json"
+EXPORTER_FILES = (project_manager.__file__, map_sections.__file__, light_table.__file__)
+STAGES = ("load", "height map", "lighting", "background", "images", "write")
+
+
+def content_hash(project_path: str, options: dict) -> str:
+    """ Changes if the project, anything it references, the export options or the exporter change """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(options, sort_keys=True).encode())
+    sha.update(f"{project_manager.EXPORTER_VERSION},{project_manager.MAP_VERSION}".encode())
+
+    for path in (project_path, *EXPORTER_FILES, *project_manager.project_asset_paths(project_path)):
+        sha.update(path.encode())
+        with open(path, "rb") as f:
+            sha.update(hashlib.sha256(f.read()).digest())
+
+    return sha.hexdigest()
+
+
+def output_path(project_path: str, output_dir: str) -> str:
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(project_path))[0] + ".bin")
+
+
+def export_project(project_path: str, path: str, options: dict) -> dict:
+    """ Runs in a worker process, returns the stage timings """
+    timings = {}
+
+    start = time.perf_counter()
+    room_layout, object_layout, lights, switches = project_manager.load_project(project_path)
+    timings["load"] = time.perf_counter() - start
+
+    project_manager.export(path, room_layout, object_layout, lights, switches, timings=timings, **options)
+
+    return timings
+
+
+def load_hashes(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, HASH_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def format_timings(timings: dict) -> str:
+    return "  ".join(f"{stage} {timings[stage]:.2f}s" for stage in STAGES if stage in timings)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export map projects to .bin without the editor")
+    parser.add_argument("projects", nargs="+", help=".project / .cproject files")
+    parser.add_argument("--output-dir", "-o", default=".", help="Where the .bin files go")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Projects exported at once")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Light processes per project, above 1 only helps when there are fewer projects than jobs")
+    parser.add_argument("--height-format", choices=project_manager.HEIGHT_FORMATS, default="float32")
+    parser.add_argument("--no-occlusion", action="store_true", help="Don't bake wall / object shadows into lights")
+    parser.add_argument("--force", action="store_true", help="Export even if nothing changed")
+    args = parser.parse_args(argv)
+
+    projects = [os.path.abspath(path) for path in dict.fromkeys(args.projects)]
+    output_dir = os.path.abspath(args.output_dir)
+
+    names = [os.path.basename(output_path(project, output_dir)) for project in projects]
+    if len(set(names)) != len(names):
+        print("[ERROR] Two projects would export to the same file name")
+        return 2
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.chdir(MAP_MAKER_DIR)
+
+    options = {"occlusion": not args.no_occlusion, "height_format": args.height_format}  # What changes the output
+    hashes = load_hashes(output_dir)
+
+    pending = {}
+    exported = failed = skipped = 0
+
+    for project in projects:
+        path = output_path(project, output_dir)
+
+        try:
+            project_hash = content_hash(project, options)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[FAILED] {project}: {e}")
+            failed += 1
+            continue
+
+        if not args.force and os.path.exists(path) and hashes.get(os.path.basename(path)) == project_hash:
+            print(f"[SKIPPED] {project} (unchanged)")
+            skipped += 1
+            continue
+
+        pending[project] = (path, project_hash)
+
+    start = time.perf_counter()
+    totals = dict.fromkeys(STAGES, 0.0)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(pending))) as executor:
+            futures = {
+                executor.submit(export_project, project, path, {**options, "processes": args.processes}): project
+                for project, (path, _) in pending.items()
+            }
+
+            for future in as_completed(futures):
+                project = futures[future]
+                path, project_hash = pending[project]
+
+                try:
+                    timings = future.result()
+                except Exception as e:  # Keep going, one broken map shouldn't stop the rest
+                    print(f"[FAILED] {project}: {type(e).__name__}: {e}")
+                    hashes.pop(os.path.basename(path), None)
+                    failed += 1
+                    continue
+
+                for stage, seconds in timings.items():
+                    totals[stage] += seconds
+
+                hashes[os.path.basename(path)] = project_hash
+                exported += 1
+                print(f"[EXPORTED] {project} -> {path} ({sum(timings.values()):.2f}s)")
+                print(f"    {format_timings(timings)}")
+
+        project_manager.write_atomic(os.path.join(output_dir, HASH_FILE), json.dumps(hashes, indent=2))
+
+    print(f"\n{exported} exported, {skipped} skipped, {failed} failed in {time.perf_counter() - start:.2f}s")
+    if exported:
+        print(f"Stage totals: {format_timings(totals)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import math
+
+import numpy as np
+import pygame
+import pyopencl as pycl
+
+import project_manager
+from engine.opencl import OpenClContext
+
+"""
+
+Live lighting preview for the map maker, using the games own kernels (light_mask.cl / shadow_mask.cl) on a CPU
+OpenCL device so it works on any machine the editor does.
+
+The height map is only rebuilt when rooms or objects change. When lights change, light_mask only reruns over the
+squares the changed lights covered before and after (it still sums every light for those pixels), so dragging a light
+about only touches the pixels around it. shadow_mask then draws what a player standing at the middle of the editors
+view would see.
+
+Both kernels use the games layout, arrays are indexed [map row, map column] and the kernels "x" is the row.
+
+"""
+
+KERNEL_PATH = "../data/kernel"
+VIEW_HEIGHT = 0.9
+MAX_VIEW_SIZE = 2048  # World pixels each way, zoomed out views are capped to this around the middle of the screen
+
+mf = pycl.mem_flags
+
+
+class LightingPreview:
+    def __init__(self):
+        self.cl = OpenClContext(pycl.device_type.CPU)
+
+        with open(f"{KERNEL_PATH}/light_mask.cl", "r") as f:
+            self.__lighting_func = pycl.Program(self.cl.context, f.read()).build().update
+
+        with open(f"{KERNEL_PATH}/shadow_mask.cl", "r") as f:
+            self.__shadow_func = pycl.Program(self.cl.context, f.read()).build().mask
+
+        self.offset = (0, 0)
+        self.shape = None  # (rows, columns) of the height / light maps
+
+        self.__geometry = None  # Snapshot of the rooms and objects the height map was built from
+        self.__lights: list = []  # The light entries currently in the light map
+
+        self.__height_map = None
+        self.__light_map = None
+
+        self.__view_size = None
+        self.__pixels = None
+        self.__pixels_buffer = None
+        self.__deltas = None
+        self.__ray_count = 0
+
+    def update(self, room_layout: list, object_layout: list, lights: list):
+        """ Brings the maps up to date with the layout, only redoing what actually changed """
+        snapshot = project_manager.snapshot_project(room_layout, object_layout, [], [])
+        geometry = (snapshot["rooms"], snapshot["objects"])
+
+        if geometry != self.__geometry:
+            self.__geometry = geometry
+            self.__build_maps(room_layout, object_layout)
+
+        lights = [(tuple(light[0]), *light[1:]) for light in lights if light[3]]  # Only lights on by default
+        if lights != self.__lights:
+            self.__update_light_map(lights)
+
+    def __build_maps(self, room_layout, object_layout):
+        _, _, self.offset, height_map = project_manager.prepare_export(room_layout, object_layout)
+        self.shape = height_map.shape
+
+        self.__height_map = pycl.Buffer(self.cl.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=height_map)
+        self.__light_map = pycl.Buffer(self.cl.context, mf.READ_WRITE, size=height_map.nbytes)
+        pycl.enqueue_fill_buffer(self.cl.queue, self.__light_map, np.float32(0), 0, height_map.nbytes)
+
+        self.__lights = []
+
+    def __light_data(self, lights) -> tuple[np.ndarray, int]:
+        """
+        (light buffer data, light count). OpenCL buffers can't be empty, so with no lights the data is a single row the
+        kernel never reads (a count of 0 just clears the area, rather than dividing by a radius of 0)
+        """
+        data = np.array([
+            (int(x + self.offset[0]), int(y + self.offset[1]), int(radius))
+            for (x, y), _, radius, _, _ in lights
+            if radius > 0
+        ], dtype=np.int32).reshape(-1, 3)
+
+        if len(data) == 0:
+            return np.zeros((1, 3), dtype=np.int32), 0
+
+        return data, len(data)
+
+    def __update_light_map(self, lights):
+        """ Reruns light_mask over the bounding box of every light that was added, removed or changed """
+        old = set(self.__lights)
+        new = set(lights)
+        changed = old ^ new
+
+        rows, columns = self.shape
+        top, left, bottom, right = rows, columns, 0, 0
+
+        for light in changed:
+            _, _, x1, x2, y1, y2 = project_manager.light_bounds(light, self.offset, self.shape)
+
+            top, bottom = min(top, max(0, y1 - 1)), max(bottom, min(rows, y2 + 1))
+            left, right = min(left, max(0, x1 - 1)), max(right, min(columns, x2 + 1))
+
+        self.__lights = lights
+        if top >= bottom or left >= right:
+            return
+
+        light_data, light_count = self.__light_data(lights)
+        light_buffer = pycl.Buffer(self.cl.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=light_data)
+
+        self.__lighting_func(
+            self.cl.queue, (bottom - top, right - left), None,
+            self.__light_map,
+            light_buffer,
+
+            np.int32(columns),
+            np.int32(light_count),
+
+            global_offset=(top, left)
+        )
+
+    def __create_view_buffers(self, view_size):
+        self.__view_size = view_size
+        self.__pixels = np.empty(view_size, dtype=np.uint8)  # [x][y] like pygame.surfarray
+        self.__pixels_buffer = pycl.Buffer(self.cl.context, mf.WRITE_ONLY, size=self.__pixels.nbytes)
+
+        self.__ray_count = round(min(view_size) * math.pi) * 2
+        angles = np.radians(np.arange(self.__ray_count) * (360 / self.__ray_count))
+        deltas = np.stack((np.cos(angles), np.sin(angles)), axis=1).astype(np.float32)
+
+        self.__deltas = pycl.Buffer(self.cl.context, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=deltas)
+
+    def render(self, world_x: float, world_y: float, view_size: tuple[int, int]) -> tuple[pygame.Surface, tuple]:
+        """
+        Shadow mask of a player standing at (world_x, world_y), view_size world pixels across.
+        Returns the surface (black, alpha is how dark each pixel is) and the world position of its top left
+        """
+        view_size = (max(2, min(int(view_size[0]), MAX_VIEW_SIZE)), max(2, min(int(view_size[1]), MAX_VIEW_SIZE)))
+        if view_size != self.__view_size:
+            self.__create_view_buffers(view_size)
+
+        view_width, view_height = view_size
+        column_offset = int(world_x + self.offset[0]) - view_width // 2
+        row_offset = int(world_y + self.offset[1]) - view_height // 2
+
+        pycl.enqueue_fill_buffer(self.cl.queue, self.__pixels_buffer, np.uint8(255), 0, self.__pixels.nbytes)
+
+        self.__shadow_func(
+            self.cl.queue, (self.__ray_count,), None,
+            self.__pixels_buffer,
+            self.__height_map,
+            self.__light_map,
+            self.__deltas,
+
+            np.int32(view_height),  # The kernels "screen width" runs along its x, which is the maps rows
+            np.int32(view_width),
+
+            np.int32(self.shape[0]),
+            np.int32(self.shape[1]),
+
+            np.int32(min(view_size) // 2),
+
+            np.int32(row_offset),
+            np.int32(column_offset),
+
+            np.float32(VIEW_HEIGHT)
+        )
+
+        pycl.enqueue_copy(self.cl.queue, self.__pixels, self.__pixels_buffer)
+
+        surface = pygame.Surface(view_size, pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 255))
+        pygame.surfarray.pixels_alpha(surface)[:, :] = self.__pixels
+
+        top_left = (column_offset - self.offset[0], row_offset - self.offset[1])
+        return surface, top_left
+
+    def read_light_map(self) -> np.ndarray:
+        """ Copies the light map back, (rows, columns) of 0-255 """
+        light_map = np.empty(self.shape, dtype=np.float32)
+        pycl.enqueue_copy(self.cl.queue, light_map, self.__light_map)
+
+        return light_map
@@ -2,12 +2,19 @@ import random
 import pygame
 import os
 import math
+import time
+import zipfile
+import threading
+import itertools
 import tkinter as tk
-from tkinter import filedialog
+from collections import OrderedDict
+from tkinter import filedialog, messagebox
 
+import autosave
 import project_manager
-
-tk.Tk().withdraw()
+import texture_catalogue
+from undo_history import UndoHistory, AddRoom, SetRoomValue, ChangeDoors, AddObject, MoveObject, MoveLight, AddItem
+from engine.assets import build_mip_chain, scale_from_mips
 
 pygame.init()
 
@@ -121,6 +128,9 @@ class Room:
     hiding_spot: bool = False
 
     rendering: pygame.Surface | None
+    render_version: int  # Unique to each rendering, scaled copies of older ones are stale
+
+    __render_count = itertools.count()
 
     def __init__(self, room_id, world_x, world_y, width, height, colour):
         self.room_id = room_id
@@ -131,6 +141,7 @@ class Room:
         self.colour = colour
         self.floor_tile = None
         self.rendering: None | pygame.Surface = None
+        self.render_version = -1
         self.walls: list[Wall | None] = [Wall(), Wall(True), Wall(), Wall(True)]
 
     def __render_wall(self, start_x, start_y, end_x, end_y, wall: Wall):
@@ -191,6 +202,7 @@ class Room:
 
     def render_room(self):
         self.rendering: pygame.Surface = pygame.Surface((self.width, self.height), flags=pygame.SRCALPHA).convert_alpha()
+        self.render_version = next(Room.__render_count)
         assert isinstance(self.rendering, pygame.Surface)
 
         font = pygame.font.SysFont("Arial", 20)
@@ -252,8 +264,147 @@ class Room:
 
 
 
+class ScaledSurfaceCache:
+    """
+    LRU of scaled copies of surfaces, bounded by their total pixel count. Entries belong to an owner (a room id, a
+    texture path) at some version of it, asking for a newer version drops every entry of the older one. Only the
+    scaled copies are kept, never the surfaces they were made from
+    """
+    def __init__(self, max_pixels: int):
+        self.max_pixels = max_pixels
+        self.pixels = 0
+        self.__entries: OrderedDict = OrderedDict()  # (owner, variant) -> scaled
+        self.__owners: dict = {}  # owner -> (version, set of variants cached for it)
+
+    def get(self, owner, version, variant, create):
+        """ The scaled copy of owner at version for variant (the scale, size...), made with create() if not cached """
+        owned = self.__owners.get(owner)
+
+        if owned is not None and owned[0] != version:
+            self.discard(owner)
+            owned = None
+
+        key = (owner, variant)
+        if owned is not None and key in self.__entries:
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+
+        if owned is None:
+            owned = self.__owners[owner] = (version, set())
+
+        scaled = create()
+        self.__entries[key] = scaled
+        owned[1].add(variant)
+        self.pixels += scaled.get_width() * scaled.get_height()
+
+        while self.pixels > self.max_pixels and len(self.__entries) > 1:
+            self.__remove(next(iter(self.__entries)))
+
+        return scaled
+
+    def discard(self, owner):
+        """ Drops every entry of owner """
+        _, variants = self.__owners.pop(owner, (None, ()))
+
+        for variant in variants:
+            scaled = self.__entries.pop((owner, variant))
+            self.pixels -= scaled.get_width() * scaled.get_height()
+
+    def __remove(self, key):
+        owner, variant = key
+        scaled = self.__entries.pop(key)
+        self.pixels -= scaled.get_width() * scaled.get_height()
+
+        variants = self.__owners[owner][1]
+        variants.discard(variant)
+        if not variants:
+            del self.__owners[owner]
+
+    def clear(self):
+        self.__entries.clear()
+        self.__owners.clear()
+        self.pixels = 0
+
+
+class SpatialGrid:
+    """ Uniform grid over world space, each cell holds the keys of every rect touching it """
+    def __init__(self, cell_size: int = 256):
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], set] = {}
+        self.rects: dict = {}  # key -> (x, y, w, h)
+
+    def __cell_range(self, x, y, w, h):
+        size = self.cell_size
+        return (range(int(x // size), int((x + max(w, 1) - 1) // size) + 1),
+                range(int(y // size), int((y + max(h, 1) - 1) // size) + 1))
+
+    def insert(self, key, rect):
+        if key in self.rects:
+            self.remove(key)
+
+        self.rects[key] = tuple(rect)
+        cols, rows = self.__cell_range(*rect)
+
+        for cx in cols:
+            for cy in rows:
+                self.cells.setdefault((cx, cy), set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None:
+            return
+
+        cols, rows = self.__cell_range(*rect)
+        for cx in cols:
+            for cy in rows:
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def query(self, x, y, w, h) -> set:
+        """ Keys of every rect overlapping (x, y, w, h) """
+        cols, rows = self.__cell_range(x, y, w, h)
+        found = set()
+
+        if len(cols) * len(rows) > len(self.cells):  # Huge query (zoomed right out), walk the filled cells instead
+            for (cx, cy), keys in self.cells.items():
+                if cx in cols and cy in rows:
+                    found |= keys
+        else:
+            for cx in cols:
+                for cy in rows:
+                    keys = self.cells.get((cx, cy))
+                    if keys:
+                        found |= keys
+
+        return {key for key in found if self.__overlaps(self.rects[key], x, y, w, h)}
+
+    @staticmethod
+    def __overlaps(rect, x, y, w, h):
+        return rect[0] < x + w and x < rect[0] + rect[2] and rect[1] < y + h and y < rect[1] + rect[3]
+
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
+
+
 class App:
+    MAX_CACHED_PIXELS = 32_000_000  # ~128MB of scaled room surfaces
+    MAX_CACHED_SCREENS = 4  # Rooms scaling bigger than this many screens only have their visible part scaled
+
+    DIRTY_RENDERING = True  # Only redraw what changed, and sleep while there's no input
+    MAX_FPS = 60
+    IDLE_WAIT_MS = 1000
+    EXPORT_POLL_MS = 100
+
+    AUTOSAVE_SECONDS = 30
+    UNTITLED_PROJECT = "autosave/untitled.project"  # Where unsaved work gets autosaved to
+
     def __init__(self):
+        tk.Tk().withdraw()  # Only for the file dialogs, kept out of import so export worker processes don't open one
+
         self.display = pygame.display.set_mode(pygame.display.get_desktop_sizes()[0])
         self.__display_loading()
         self.running = False
@@ -273,7 +424,9 @@ class App:
                         "N -> Create new object",
                         "G -> Toggle Grid Snap"),
             "lights": ("Left-Click -> Add a new light",
-                       "Alt + Left-Click -> Add snapped light switch to wall (Hold Alt to preview)")
+                       "Left-Click + Drag (On Light) -> Move a light",
+                       "Alt + Left-Click -> Add snapped light switch to wall (Hold Alt to preview)",
+                       "P -> Toggle live lighting preview")
         }
 
         self.camera_position = [0, 0]
@@ -281,10 +434,10 @@ class App:
 
         self.zoom_map = [0.25, 0.5, 1, 1.5, 2.5, 5, 10, 20]
         self.zoom = self.zoom_map.index(1)
+        self.room_surface_cache = ScaledSurfaceCache(self.MAX_CACHED_PIXELS)
 
-        self.textures_loaded = 0
-        self.textures = self.__load_textures("../data/textures")
-        print(f"Found and loaded {self.textures_loaded} textures!")
+        self.textures = texture_catalogue.TextureCatalogue("../data/textures", "../data/temp/thumbnails")
+        print(f"Found {len(self.textures)} textures!")
 
 
         self.room_layout: list[Room] = [Room(1, 0, 0, 500, 300, (150, 10, 10)),
@@ -292,10 +445,15 @@ class App:
         self.object_layout: list = []
 
         self.object_layer_surface = None
+        self.object_layer_origin = (0, 0)  # Camera offset in screen pixels the layer was drawn at
+        self.spatial_index = SpatialGrid()  # ("room", room) / ("object", index) -> world rect, for culling and picking
+        self.object_mips = {}  # path -> mip chain, so zoomed out views scale down from a small copy
+        self.object_surface_cache = ScaledSurfaceCache(self.MAX_CACHED_PIXELS // 4)
         self.dragging_object = None
         self.dragging_object_loc = [0, 0]
         self.dragging_object_start_loc = [0, 0]
         self.object_grid_snap = True
+        self.rebuild_spatial_index()
         self.create_object_layer()
 
         self.grid_snap = 25
@@ -304,6 +462,12 @@ class App:
 
         self.font = pygame.font.SysFont("Arial", 20)
         self.text_sizes = {}
+        self.text_cache = {}
+
+        self.clock = pygame.time.Clock()
+        self.scene_surface = pygame.Surface(self.display.get_size())
+        self.overlay_rects: list[pygame.Rect] = []
+        self.full_redraw = True
 
         self.dragging = False
         self.mouse_held = False
@@ -329,8 +493,23 @@ class App:
 
         # End of test data
 
-        self.undo_log = []
-        self.redo_log = []
+        self.history = UndoHistory()
+
+        self.project_path: str | None = None
+        self.chunked_project: project_manager.ChunkedProject | None = None  # Chunks load in as they come on screen
+        self.autosave = autosave.AutosaveService()
+        self.autosaved_version = self.history.version
+        self.last_autosave = time.monotonic()
+        self.__recover_untitled()
+
+        self.lighting_preview = None  # lighting_preview.LightingPreview, only created once it's turned on
+        self.show_lighting_preview = False
+        self.dragging_light = None
+        self.dragging_light_start = (0, 0)
+
+        self.export_thread: threading.Thread | None = None
+        self.export_progress = None  # (stage, done, total), written by the export thread, read each frame
+        self.export_error = None
 
     def inc_edit_mode(self):
         new_index = (self.editing_modes.index(self.editing_layer) + 1) % len(self.editing_modes)
@@ -341,21 +520,6 @@ class App:
         self.editing_layer = mode
 
 
-    def __load_textures(self, path, texture_data=None) -> dict:
-        if texture_data is None: texture_data = {}
-
-        for filename in os.listdir(path):
-            if os.path.isfile(os.path.join(path, filename)):
-                if filename.endswith(".png"):
-                    texture_data[filename] = pygame.image.load(os.path.join(path, filename)).convert_alpha()
-                    self.textures_loaded += 1
-
-            elif os.path.isdir(os.path.join(path, filename)):
-                internals: dict = self.__load_textures(os.path.join(path, filename))
-                texture_data[filename] = internals
-
-        return texture_data
-
     def __world_space_to_camera(self, x, y):
         return (x + self.camera_position[0]) * self.camera_scale, (y + self.camera_position[1]) * self.camera_scale
 
@@ -378,20 +542,54 @@ class App:
                 room.render_room()
 
             assert isinstance(room.rendering, pygame.Surface)
-            self.display.blit(
-                pygame.transform.scale_by(room.rendering, self.camera_scale),
-                self.__world_space_to_camera(room.world_x, room.world_y)
-            )
+            scaled = self.__scaled_room(room)
+            if scaled is None:
+                continue  # Off screen
+
+            surface, position = scaled
+            self.display.blit(surface, position)
 
             if self.editing_layer == "walls" and room != self.selected_room and self.selected_room is not None:
-                assert room.rendering is not None
-                blanking_surface = pygame.Surface(room.rendering.get_size(), pygame.SRCALPHA)
-                blanking_surface.fill((50, 50, 50, 150))
+                self.display.blit(self.__blanking_surface(surface.get_size()), position)
+
+    def __scaled_room(self, room):
+        """ Returns (surface, screen position) of the room at the current zoom, or None if none of it is on screen """
+        scale = self.camera_scale
+        scaled_size = (max(1, round(room.rendering.get_width() * scale)),
+                       max(1, round(room.rendering.get_height() * scale)))
+
+        screen_pixels = self.display.get_width() * self.display.get_height()
+        if scaled_size[0] * scaled_size[1] <= screen_pixels * self.MAX_CACHED_SCREENS:
+            surface = self.room_surface_cache.get(
+                room.room_id, room.render_version, scale,
+                lambda: pygame.transform.scale(room.rendering, scaled_size)
+            )
+            return surface, self.__world_space_to_camera(room.world_x, room.world_y)
 
-                self.display.blit(
-                    pygame.transform.scale_by(blanking_surface, self.camera_scale),
-                    self.__world_space_to_camera(room.world_x, room.world_y)
-                )
+        # Zoomed right in, scale only the part of the room on screen (not cached, it changes as the camera moves)
+        view_x1, view_y1 = self.__camera_to_world_space(0, 0)
+        view_x2, view_y2 = self.__camera_to_world_space(*self.display.get_size())
+
+        x1 = max(0, math.floor(view_x1 - room.world_x))
+        y1 = max(0, math.floor(view_y1 - room.world_y))
+        x2 = min(room.rendering.get_width(), math.ceil(view_x2 - room.world_x))
+        y2 = min(room.rendering.get_height(), math.ceil(view_y2 - room.world_y))
+
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        visible = room.rendering.subsurface((x1, y1, x2 - x1, y2 - y1))
+        surface = pygame.transform.scale(visible, (math.ceil((x2 - x1) * scale), math.ceil((y2 - y1) * scale)))
+        return surface, self.__world_space_to_camera(room.world_x + x1, room.world_y + y1)
+
+    def __blanking_surface(self, size):
+        """ Greys out rooms other than the selected one, shared between every room of the same (scaled) size """
+        def create():
+            blanking_surface = pygame.Surface(size, pygame.SRCALPHA)
+            blanking_surface.fill((50, 50, 50, 150))
+            return blanking_surface
+
+        return self.room_surface_cache.get("blanking", 0, size, create)
 
 
     def __display_tool_tips(self):
@@ -400,7 +598,7 @@ class App:
             x = 5
             y = 35
             for i, tip in enumerate(tips):
-                rect = self.font.render(tip, True, (255,255,255))
+                rect = self.__render_text(tip)
                 self.display.blit(rect, (x, y))
                 y += rect.get_height() + 2
 
@@ -430,10 +628,13 @@ class App:
         if w == 0 or h == 0:
             return
 
-        new_room_id = len(self.room_layout) + 1
+        new_room_id = max((room.room_id for room in self.room_layout), default=0) + 1
+        if self.chunked_project is not None:  # Rooms still to be loaded have ids too
+            new_room_id = max(new_room_id, self.chunked_project.index["max_room_id"] + 1)
         colour = (random.randint(10, 255), random.randint(10, 255), random.randint(10, 255))
         self.room_layout.append(Room(new_room_id, start_x, start_y, w, h, colour))
-        self.add_undo_step("create-room", new_room_id)
+        self.index_room(self.room_layout[-1])
+        self.add_undo_step(AddRoom(self.room_layout[-1]))
 
     def render_door_creation_points(self):
         if self.selected_room is None:
@@ -504,15 +705,15 @@ class App:
 
         world_x, world_y = self.__camera_to_world_space(mouse_x, mouse_y)
 
-        for room in self.room_layout:
-            if (room.world_x < world_x < room.world_x + room.width and
-                room.world_y < world_y < room.world_y + room.height):
+        rooms = self.query_spatial_index("room", world_x, world_y)
+        if len(rooms) > 1:
+            rooms.sort(key=self.room_layout.index)  # Overlapping rooms, first in the layout wins like before
 
-                if dont_set_just_return:
-                    return room
+        if rooms:
+            if dont_set_just_return:
+                return rooms[0]
 
-                self.selected_room = room
-                break
+            self.selected_room = rooms[0]
 
         if dont_set_just_return:
             return None
@@ -571,245 +772,14 @@ class App:
 
             self.selected_room_cache.blit(toggle_hiding_spot, (15, y))
 
-    def add_undo_step(self, undo_type: str, data):
-        self.undo_log.append((undo_type, data))
-        self.redo_log = []
+    def add_undo_step(self, command):
+        self.history.push(command)
 
     def undo(self):
-        if len(self.undo_log) == 0:
-            return
-
-        event, data = self.undo_log.pop(-1)
-
-        if event == "create-room":
-            room_id = data
-
-            actual_room = None
-            for room in self.room_layout:
-                if room.room_id == room_id:
-                    actual_room = room
-                    break
-
-            assert actual_room is not None, "Invalid room id in undo statement"
-            self.room_layout.remove(actual_room)
-            self.redo_log.append(("create-room", actual_room))
-
-        elif event == "room-change_tile":
-            room, old, new = data
-
-            room.floor_tile = old
-
-            room.render_room()
-
-            self.redo_log.append(("room-change_tile", (room, old, new)))
-
-        elif event == "new-door":
-            room, doors, door_to_remove = data
-
-            i = doors.index(door_to_remove)
-            doors.pop(i)
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.redo_log.append(("new-door", (room, doors, door_to_remove)))
-
-        elif event == "move-door":
-            # self.selected_room.walls[wall_index], door_index, self.wall_drag_start_offset, current_offset
-            room, wall, door_index, old_offset, new_offset = data
-            wall.doors[door_index].offset = old_offset
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.redo_log.append(("move-door", (room, wall, door_index, old_offset, new_offset)))
-
-        elif event == "door_config-delete":
-            room, door, wall_index, door_index = data
-
-            room.walls[wall_index].doors.insert(door_index, door)
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.redo_log.append(("door_config-delete", (room, door, wall_index, door_index)))
-
-        elif event == "door_config-visable":
-            room, door, starting_state, new_state = data
-
-            door.has_door = starting_state
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.redo_log.append(("door_config-visable", (room, door, starting_state, new_state)))
-
-        elif event == "door_config-width":
-            room, door, starting_width, end_width = data
-
-            door.width = starting_width
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.redo_log.append(("door_config-width", (room, door, starting_width, end_width)))
-
-        elif event == "toggle_hiding_spot":
-            room, old, new = data
-            room.hiding_spot = old
-            room.render_room()
-
-            self.redo_log.append(("toggle_hiding_spot", (room, old, new)))
-
-        elif event == "new-object":
-            room, index, obj = data
-
-            self.object_layout.pop(index)
-
-            self.create_object_layer()
-
-            self.redo_log.append(("new-object", (room, index, obj)))
-
-        elif event == "object-move":
-            index, start, end = data
-
-            self.object_layout[index][1][0] = start[0]
-            self.object_layout[index][1][1] = start[1]
-
-            self.create_object_layer()
-
-            self.redo_log.append(("object-move", (index, start, end)))
-
-        elif event == "light-add":
-            index, light_data = data
-
-            self.lights.pop(index)
-
-            self.redo_log.append(("light-add", (index, light_data)))
-
-        elif event == "switch-add":
-            index, switch_data = data
-
-            self.switches.pop(index)
-
-            self.redo_log.append(("switch-add", (index, switch_data)))
-
-        else:
-            print("Unknown undo event:", event)
-
+        self.history.undo(self)
 
     def redo(self):
-        if len(self.redo_log) == 0:
-            return
-
-        event, data = self.redo_log.pop(-1)
-        if event == "create-room":
-            self.room_layout.append(data)
-            self.undo_log.append(("create-room", data.room_id))
-
-        elif event == "room-change_tile":
-            room, old, new = data
-
-            room.floor_tile = new
-
-            room.render_room()
-
-            self.undo_log.append(("room-change_tile", (room, old, new)))
-
-        elif event == "new-door":
-            room, doors, door_to_remove = data
-
-            doors.append(door_to_remove)
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.undo_log.append(("new-door", (room, doors, door_to_remove)))
-
-        elif event == "move-door":
-            room, wall, door_index, old_offset, new_offset = data
-
-            wall.doors[door_index].offset = new_offset
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.undo_log.append(("move-door", (room, wall, door_index, old_offset, new_offset)))
-
-        elif event == "door_config-delete":
-            room, door, wall_index, door_index = data
-
-            room.walls[wall_index].doors.remove(door)
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.undo_log.append(("door_config-delete", (room, door, wall_index, door_index)))
-
-        elif event == "door_config-visable":
-            room, door, starting_state, new_state = data
-
-            door.has_door = new_state
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.undo_log.append(("door_config-visable", (room, door, starting_state, new_state)))
-
-        elif event == "door_config-width":
-            room, door, starting_width, end_width = data
-
-            door.width = end_width
-
-            room.render_room()
-            self.render_door_creation_points()
-
-            self.undo_log.append(("door_config-width", (room, door, starting_width, end_width)))
-
-        elif event == "toggle_hiding_spot":
-            room, old, new = data
-            room.hiding_spot = new
-            room.render_room()
-
-            self.undo_log.append(("toggle_hiding_spot-width", (room, old, new)))
-
-        elif event == "new-object":
-            room, index, obj = data
-
-            self.object_layout.insert(index, obj)
-
-            self.create_object_layer()
-
-            self.undo_log.append(("new-object", (room, index, obj)))
-
-        elif event == "object-move":
-            index, start, end = data
-
-            self.object_layout[index][1][0] = end[0]
-            self.object_layout[index][1][1] = end[1]
-
-            self.create_object_layer()
-
-            self.undo_log.append(("object-move", (index, start, end)))
-
-        elif event == "light-add":
-            index, light = data
-
-            self.lights.insert(index, light)
-
-            self.undo_log.append(("light-add", (index, light)))
-
-        elif event == "switch-add":
-            index, switch = data
-
-            self.switches.insert(index, switch)
-
-            self.undo_log.append(("switch-add", (index, switch)))
-
-
-        else:
-            print("Unknown redo event:", event)
-
+        self.history.redo(self)
 
     def clicked_on_room_preview(self, x, y):
         if 10 < x < 10 + self.text_sizes["Change Floor"][0]:
@@ -817,12 +787,12 @@ class App:
                 path = filedialog.askopenfilename(defaultextension="png", filetypes=[("PNG files", "*.png")])
 
                 try:
-                    img = pygame.image.load(path).convert_alpha()
+                    img = self.textures.load(path)
                     new_tile = [img, path]
                     old_tile = self.selected_room.floor_tile
                     self.selected_room.floor_tile = new_tile
 
-                    self.add_undo_step("room-change_tile", (self.selected_room, old_tile, new_tile))
+                    self.add_undo_step(SetRoomValue(self.selected_room, self.selected_room, "floor_tile", old_tile, new_tile))
                     self.selected_room.render_room()
                 except:  # NOQA
                     pass
@@ -835,7 +805,7 @@ class App:
                 self.selected_room.hiding_spot = new
 
                 self.selected_room.render_room()
-                self.undo_log.append(("toggle_hiding_spot", (self.selected_room, old, new)))
+                self.add_undo_step(SetRoomValue(self.selected_room, self.selected_room, "hiding_spot", old, new))
 
 
     def clicked_on_doorway_preview(self, x, y):
@@ -850,7 +820,7 @@ class App:
 
                 if new_width is not None:
                     self.wall_door_config_door.width = new_width
-                    self.add_undo_step("door_config-width", (self.selected_room, self.wall_door_config_door, starting_width, new_width))
+                    self.add_undo_step(SetRoomValue(self.selected_room, self.wall_door_config_door, "width", starting_width, new_width))
 
                     self.selected_room.render_room()
                     self.render_door_creation_points()
@@ -861,7 +831,7 @@ class App:
                 new_state = not starting_state
 
                 self.wall_door_config_door.has_door = new_state
-                self.add_undo_step("door_config-visable", (self.selected_room, self.wall_door_config_door, starting_state, new_state))
+                self.add_undo_step(SetRoomValue(self.selected_room, self.wall_door_config_door, "has_door", starting_state, new_state))
 
                 self.selected_room.render_room()
                 self.render_door_creation_points()
@@ -875,7 +845,7 @@ class App:
                     for j, door in enumerate(wall.doors):
                         if door == self.wall_door_config_door:
                             self.selected_room.walls[i].doors.pop(j)
-                            self.add_undo_step("door_config-delete", (self.selected_room, self.wall_door_config_door, i, j))
+                            self.add_undo_step(ChangeDoors(self.selected_room, i, j, self.wall_door_config_door, False))
 
                 self.selected_room.render_room()
                 self.render_door_creation_points()
@@ -929,23 +899,110 @@ class App:
         config_screen.blit(remove_door_rect, (15, y))
 
     def create_object_layer(self):
-        self.object_layer_surface = pygame.Surface(self.display.get_size(), pygame.SRCALPHA)
+        """ Redraws every visible object, the spatial index has to be up to date first """
+        if self.object_layer_surface is None or self.object_layer_surface.get_size() != self.display.get_size():
+            self.object_layer_surface = pygame.Surface(self.display.get_size(), pygame.SRCALPHA)
+
+        self.object_layer_origin = self.__object_layer_origin()
+        self.__draw_objects(self.object_layer_surface.get_rect())
+
+    def rebuild_spatial_index(self):
+        self.spatial_index.clear()
+
+        for room in self.room_layout:
+            self.index_room(room)
+
+        for i in range(len(self.object_layout)):
+            self.index_object(i)
+
+    def index_room(self, room: Room):
+        self.spatial_index.insert(("room", room), (room.world_x, room.world_y, room.width, room.height))
+
+    def unindex_room(self, room: Room):
+        """ Call after removing a room """
+        self.spatial_index.remove(("room", room))
+        self.room_surface_cache.discard(room.room_id)
+
+    def index_object(self, index: int):
+        """ Call after adding or moving object_layout[index] """
+        surface, pos, _ = self.object_layout[index]
+        self.spatial_index.insert(("object", index), (pos[0], pos[1], surface.get_width(), surface.get_height()))
+
+    def reindex_objects_from(self, index: int, old_count: int):
+        """ Objects from index onwards shifted after an insert or pop, old_count is how many there were before """
+        for i in range(index, old_count):
+            self.spatial_index.remove(("object", i))
+
+        for i in range(index, len(self.object_layout)):
+            self.index_object(i)
+
+    def object_index(self, obj) -> int:
+        """ Where obj is in object_layout, found by identity as identical objects can sit on top of each other """
+        return next(i for i, entry in enumerate(self.object_layout) if entry is obj)
+
+    def query_spatial_index(self, kind: str, x, y, w=0, h=0) -> list:
+        """ Rooms / object indices overlapping the world space rect (or point) """
+        return [key[1] for key in self.spatial_index.query(x, y, w, h) if key[0] == kind]
+
+    def __object_layer_origin(self):
+        return (round(self.camera_position[0] * self.camera_scale),
+                round(self.camera_position[1] * self.camera_scale))
+
+    def __pan_object_layer(self):
+        """ Shifts the already drawn layer by how far the camera moved and only draws the strips that scrolled in """
+        origin = self.__object_layer_origin()
+        dx, dy = origin[0] - self.object_layer_origin[0], origin[1] - self.object_layer_origin[1]
+
+        if not dx and not dy:
+            return
+
+        width, height = self.object_layer_surface.get_size()
+        if abs(dx) >= width or abs(dy) >= height:
+            self.create_object_layer()
+            return
+
+        self.object_layer_origin = origin
+        self.object_layer_surface.scroll(dx, dy)
+
+        if dx:
+            self.__draw_objects(pygame.Rect(0 if dx > 0 else width + dx, 0, abs(dx), height))
+        if dy:
+            self.__draw_objects(pygame.Rect(0, 0 if dy > 0 else height + dy, width, abs(dy)))
+
+    def __draw_objects(self, rect: pygame.Rect):
+        """ Clears rect (screen space) on the object layer and draws the objects overlapping it, in layout order """
+        layer = self.object_layer_surface
+        layer.set_clip(rect)
+        layer.fill((0, 0, 0, 0), rect)
+
+        world_x, world_y = self.__camera_to_world_space(rect.x, rect.y)
+        visible = self.query_spatial_index("object", world_x, world_y, rect.width / self.camera_scale,
+                                           rect.height / self.camera_scale)
+
+        for i in sorted(visible):
+            surface, pos, path = self.object_layout[i]
+            scaled = self.__scale_object(surface, path)
 
-        for i, (surface, pos, path) in enumerate(self.object_layout):
             if i == self.dragging_object:
-                surface = pygame.transform.scale_by(surface, self.camera_scale).convert_alpha()
-                mask = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+                scaled = scaled.convert_alpha()
+                mask = pygame.Surface(scaled.get_size(), pygame.SRCALPHA)
                 mask.fill((0, 0, 0, 100))
 
-                surface.blit(mask, (0, 0))
+                scaled.blit(mask, (0, 0))
 
-                self.object_layer_surface.blit(
-                    surface, self.__world_space_to_camera(*pos)
-                )
-            else:
-                self.object_layer_surface.blit(
-                    pygame.transform.scale_by(surface, self.camera_scale), self.__world_space_to_camera(*pos)
-                )
+            layer.blit(scaled, self.__world_space_to_camera(*pos))
+
+        layer.set_clip(None)
+
+    def __scale_object(self, surface, path):
+        """ Scaled copies are kept per zoom level, so zooming back and forth never rescales """
+        def create():
+            if path not in self.object_mips or self.object_mips[path][0] is not surface:
+                self.object_mips[path] = build_mip_chain(surface)
+
+            return scale_from_mips(self.object_mips[path], self.camera_scale)
+
+        return self.object_surface_cache.get(path, id(surface), self.camera_scale, create)
 
     def add_object(self):
         path = filedialog.askopenfilename(defaultextension="png", filetypes=[("PNG files", "*.png")])
@@ -956,10 +1013,11 @@ class App:
             #if self.selected_room:
             #    pos = [self.selected_room.world_x, self.selected_room.world_y]
 
-            img = pygame.image.load(path).convert_alpha()
-            self.object_layout.append((img, pos, path))
+            obj = (self.textures.load(path), pos, path)
+            self.object_layout.append(obj)
+            self.index_object(len(self.object_layout) - 1)
 
-            self.add_undo_step("new-object", (self.selected_room, len(self.object_layout) - 1, (img, pos, path)))
+            self.add_undo_step(AddObject(obj))
             self.create_object_layer()
         except:  # NOQA
             pass
@@ -967,46 +1025,195 @@ class App:
 
     def print_log(self):
         print("> Map Maker Log <")
-        print("Undo History")
-        for event, data in self.undo_log:
-            print(f"{event} | {data}")
+        print(f"Undo History ({self.history.size / 1024:.1f}KiB)")
+        for command in self.history.undo_steps:
+            print(command)
 
         print("Redo History")
-        for event, data in self.redo_log:
-            print(f"{event} | {data}")
+        for command in self.history.redo_steps:
+            print(command)
+
+    @staticmethod
+    def __project_filetypes():
+        return [("Map Maker Project File", "*.project"),
+                ("Chunked Map Maker Project", f"*{project_manager.CHUNKED_EXTENSION}")]
 
     def save(self):
-        path = filedialog.asksaveasfilename(defaultextension="project", filetypes=[("Map Maker Project File", "*.project")])
+        path = filedialog.asksaveasfilename(defaultextension="project", filetypes=self.__project_filetypes())
         if not path: return
 
-        project_manager.save_project(path, self.room_layout, self.object_layout, self.lights, self.switches)
-        print("Save Completed!")
+        if self.project_path is None:
+            self.autosave.discard(self.UNTITLED_PROJECT)  # It's not untitled anymore
+
+        self.autosave.save(path, self.__snapshot())
+        self.project_path = path
+        self.autosaved_version = self.history.version
+        print("Saving...")
 
     def export(self):
+        if self.export_thread is not None:
+            print("Already exporting!")
+            return
+
         path = filedialog.asksaveasfilename(defaultextension="bin",
                                             filetypes=[("Map Binary", "*.bin")])
         if not path: return
 
-        project_manager.export(path, self.room_layout, self.object_layout, self.lights, self.switches)
-        print("Export Completed!")
+        self.__load_all_chunks()  # The export needs every room and object, not just the ones seen so far
+
+        # Copies of the layout lists, so adding / removing things while it exports doesn't change what gets written
+        layout = (list(self.room_layout), list(self.object_layout), list(self.lights), list(self.switches))
+
+        self.export_progress = ("Starting", 0, 1)
+        self.export_error = None
+        self.export_thread = threading.Thread(target=self.__run_export, args=(path, *layout), daemon=True)
+        self.export_thread.start()
+
+    def __run_export(self, path, room_layout, object_layout, lights, switches):
+        try:
+            project_manager.export_parallel(path, room_layout, object_layout, lights, switches,
+                                            progress=self.__set_export_progress)
+        except Exception as e:  # Reported by __poll_export, on the main thread
+            self.export_error = e
+
+    def __set_export_progress(self, stage, done, total):
+        self.export_progress = (stage, done, total)
+
+    def __poll_export(self) -> pygame.Rect | None:
+        """ Called every frame, draws the exports progress (returning where) and reports once it finishes """
+        if self.export_thread is None:
+            return None
+
+        if not self.export_thread.is_alive():
+            self.export_thread.join()
+            self.export_thread = None
+
+            if self.export_error is not None:
+                print(f"Export Failed! {self.export_error}")
+            else:
+                print("Export Completed!")
+
+            return None
+
+        stage, done, total = self.export_progress
+        progress_rect = self.font.render(f"Exporting - {stage} ({done}/{total})", True, (255, 255, 255))
+        return self.display.blit(progress_rect, (5, self.display.get_height() - progress_rect.get_height() - 5))
 
     def load(self):
-        path = filedialog.askopenfilename(defaultextension="project", filetypes=[("Map Maker Project File", "*.project")])
+        path = filedialog.askopenfilename(defaultextension="project", filetypes=self.__project_filetypes())
         if not path: return
 
-        self.room_layout, self.object_layout, self.lights, self.switches = project_manager.load_project(path)
-        self.redraw_all_rooms()
+        if autosave.has_newer_autosave(path) and messagebox.askyesno(
+                "Recover Autosave", "This project has autosaved changes newer than the last save, load them instead?"):
+            self.__set_project(project_manager.project_from_data(autosave.recover(path)), path)
+            print("Recovered Autosave!")
+            return
+
+        if zipfile.is_zipfile(path):
+            chunked_project = project_manager.ChunkedProject(path)
+            self.__set_project(([], [], chunked_project.lights, chunked_project.switches), path, chunked_project)
+            self.__stream_chunks()
+        else:
+            self.__set_project(project_manager.load_project(path), path)
+
         print("Load Completed!")
 
+    def __set_project(self, project, path: str | None, chunked_project=None):
+        self.room_layout, self.object_layout, self.lights, self.switches = project
+        self.project_path = path
+
+        if self.chunked_project is not None:
+            self.chunked_project.close()
+        self.chunked_project = chunked_project
+
+        self.rebuild_spatial_index()
+        self.history.clear()  # Old steps point at the rooms and lists that were just replaced
+        self.autosaved_version = self.history.version
+        self.redraw_all_rooms()
+
+    def __recover_untitled(self):
+        """ Unsaved work from a session that didn't close properly """
+        if not os.path.exists(autosave.autosave_path(self.UNTITLED_PROJECT)):
+            return
+
+        if messagebox.askyesno("Recover Autosave", "Found autosaved work from an unsaved project, recover it?"):
+            self.__set_project(project_manager.project_from_data(autosave.recover(self.UNTITLED_PROJECT)), None)
+            print("Recovered Autosave!")
+        else:
+            autosave.discard(self.UNTITLED_PROJECT)
+
+    def __snapshot(self) -> dict:
+        snapshot = project_manager.snapshot_project(self.room_layout, self.object_layout, self.lights, self.switches)
+
+        if self.chunked_project is not None and not self.chunked_project.fully_loaded:
+            # Unloaded chunks are still as they were saved (nothing can edit them), they go back in their saved order
+            snapshot = self.chunked_project.merge_unloaded(snapshot)
+
+        return snapshot
+
+    def __add_chunk_contents(self, rooms: list, objects: list):
+        """
+        (layout index, room / object) pairs from the chunked project, inserted so the layout stays in saved order
+        (with anything made since loading after it all), keeping z-order and which overlapping room is picked
+        """
+        for index, room in rooms:
+            self.room_layout.insert(index, room)
+            self.index_room(room)
+
+        if objects:
+            old_count = len(self.object_layout)
+
+            for index, obj in objects:
+                self.object_layout.insert(index, obj)
+
+                if self.dragging_object is not None and index <= self.dragging_object:
+                    self.dragging_object += 1
+
+            self.reindex_objects_from(objects[0][0], old_count)  # The first pair has the lowest index
+            self.create_object_layer()
+
+        if rooms or objects:
+            self.full_redraw = True
+
+    def __stream_chunks(self):
+        """ Loads the chunks of a chunked project on (or just off) the screen that haven't been loaded yet """
+        if self.chunked_project is None or self.chunked_project.fully_loaded:
+            return
+
+        # A screen of margin each way, so panning doesn't show them popping in
+        x, y = self.__camera_to_world_space(-self.display.get_width(), -self.display.get_height())
+        width = self.display.get_width() * 3 / self.camera_scale
+        height = self.display.get_height() * 3 / self.camera_scale
+
+        self.__add_chunk_contents(*self.chunked_project.load_region(x, y, width, height))
+
+    def __load_all_chunks(self):
+        if self.chunked_project is not None and not self.chunked_project.fully_loaded:
+            self.__add_chunk_contents(*self.chunked_project.load_remaining())
+
+    def __tick_autosave(self, force=False):
+        """ Queues a snapshot for the autosave thread every AUTOSAVE_SECONDS, if anything changed """
+        if self.history.version == self.autosaved_version:
+            return
+
+        if not force and time.monotonic() - self.last_autosave < self.AUTOSAVE_SECONDS:
+            return
+
+        self.autosave.autosave(self.project_path or self.UNTITLED_PROJECT, self.__snapshot())
+        self.autosaved_version = self.history.version
+        self.last_autosave = time.monotonic()
+
     def select_object(self, mx, my):
         wx, wy = self.__camera_to_world_space(mx, my)
-        # Don't exit early, we want the top most object
-        for i, (img, pos, path) in enumerate(self.object_layout):
-            if pos[0] < wx < pos[0] + img.get_width():
-                if pos[1] < wy < pos[1] + img.get_height():
-                    self.dragging_object = i
-                    self.dragging_object_loc = pos
-                    self.dragging_object_start_loc = (*pos,)  # Copy the tuple (store it for later)
+        hits = self.query_spatial_index("object", wx, wy)
+
+        if hits:
+            i = max(hits)  # The top most object
+            pos = self.object_layout[i][1]
+
+            self.dragging_object = i
+            self.dragging_object_loc = pos
+            self.dragging_object_start_loc = (*pos,)  # Copy the tuple (store it for later)
 
         self.create_object_layer()
 
@@ -1064,15 +1271,195 @@ class App:
 
 
 
+    def __draw_scene(self):
+        """ Everything that only changes on a full redraw """
+        self.display.fill((10, 10, 10))
+
+        self.__render_rooms()
+
+        if self.editing_layer == "rooms":
+            if self.selected_room_cache is not None:
+                self.display.blit(
+                    self.selected_room_cache,
+                    (self.display.get_width() - self.selected_room_cache.get_width(), 0)
+                )
+
+        if self.editing_layer == "walls":
+            if self.selected_room:
+                for wall, icon, xy, _ in self.wall_door_creation_locations:
+                    self.display.blit(
+                        icon, self.__world_space_to_camera(*xy)
+                    )
+
+                if self.wall_door_config_surf:
+                    self.display.blit(self.wall_door_config_surf, (self.display.get_width() - 400, 0))
+
+        if self.editing_layer == "lights":
+            self.display.blit(self.object_layer_surface, (0, 0))  # Under the preview, so objects get shadowed too
+
+            if self.show_lighting_preview:
+                self.__draw_lighting_preview()
+
+            for light in self.lights:  # [(x, y), brightness {0f-1f}, radius {int}, on_by_default {bool}, room_id]
+                (x, y), brightness, radius, _, _ = light
+
+                pygame.draw.circle(
+                    self.display,
+                    (255*brightness, 0, 0),
+                    self.__world_space_to_camera(x, y),
+                    radius*self.camera_scale, width=1
+                )
+
+                pygame.draw.circle(
+                    self.display,
+                    (242, 239, 55),
+                    self.__world_space_to_camera(x, y),
+                    7*self.camera_scale
+                )
+
+        else:
+            self.display.blit(self.object_layer_surface, (0, 0))
+
+        mode_rect = self.__render_text(f"Editing: {self.editing_layer}")
+        self.display.blit(mode_rect, (5, 5))
+        self.__display_tool_tips()
+
+    def toggle_lighting_preview(self):
+        if self.lighting_preview is None:
+            try:
+                import lighting_preview
+                self.lighting_preview = lighting_preview.LightingPreview()
+
+            except (ImportError, RuntimeError, OSError) as e:  # No pyopencl, or no CPU OpenCL device
+                print(f"[WARNING] Lighting preview unavailable: {e}")
+                return
+
+        self.show_lighting_preview = not self.show_lighting_preview
+
+    def __draw_lighting_preview(self):
+        """ What a player standing in the middle of the screen would see, drawn over the rooms and objects """
+        self.lighting_preview.update(self.room_layout, self.object_layout, self.lights)
+
+        centre_x, centre_y = self.__camera_to_world_space(self.display.get_width() / 2, self.display.get_height() / 2)
+        view_size = (math.ceil(self.display.get_width() / self.camera_scale),
+                     math.ceil(self.display.get_height() / self.camera_scale))
+
+        mask, top_left = self.lighting_preview.render(centre_x, centre_y, view_size)
+        if self.camera_scale != 1:
+            mask = pygame.transform.scale_by(mask, self.camera_scale)
+
+        self.display.blit(mask, self.__world_space_to_camera(*top_left))
+
+    def __light_at(self, mouse_x, mouse_y) -> int | None:
+        """ Index of the light whose handle is under the mouse, the newest one if they overlap """
+        world_x, world_y = self.__camera_to_world_space(mouse_x, mouse_y)
+
+        for i in range(len(self.lights) - 1, -1, -1):
+            x, y = self.lights[i][0]
+            if (x - world_x) ** 2 + (y - world_y) ** 2 <= 7 ** 2:
+                return i
+
+        return None
+
+    def __draw_overlays(self, mouse_x, mouse_y) -> list[pygame.Rect]:
+        """ The parts that follow the mouse, drawn over the scene every frame. Returns the rects drawn to """
+        rects = []
+
+        if self.editing_layer == "rooms" and self.dragging:
+            start_x, start_y = self.__world_space_to_camera(*self.dragging_start)
+
+            snapped_x, snapped_y = self.__world_space_to_camera(
+                *self.__snap_point_to_grid(
+                    *self.__camera_to_world_space(mouse_x, mouse_y)
+                )
+            )
+            w, h = snapped_x - start_x, snapped_y - start_y
+
+            if w < 0:
+                start_x += w
+                w *= -1
+
+            if h < 0:
+                start_y += h
+                h *= -1
+
+            rects.append(pygame.draw.rect(
+                self.display,
+                (10, 10, 150, 80),
+                (start_x, start_y, w, h)
+            ))
+
+        if self.dragging and self.editing_layer == "objects" and self.dragging_object is not None:
+            img, _, _ = self.object_layout[self.dragging_object]
+
+            pos = self.dragging_object_loc
+
+            if self.object_grid_snap:
+                pos = self.__snap_point_to_grid(*pos)
+
+            rects.append(self.display.blit(img, self.__world_space_to_camera(*pos)))
+
+        if self.editing_layer == "lights" and pygame.key.get_mods() & pygame.KMOD_ALT:  # render possible switch position
+            position = self.find_position_of_lightswitch(mouse_x, mouse_y)
+
+            if position:
+                xy = self.__world_space_to_camera(position[0], position[1])
+                rects.append(pygame.draw.line(
+                    self.display,
+                    (24, 216, 249),
+                    xy,
+                    [xy[0] + 10 * position[2], xy[1] + 10 * position[3]],
+                    width=max(1, round(5 * self.camera_scale))
+                ))
+
+        export_rect = self.__poll_export()
+        if export_rect is not None:
+            rects.append(export_rect)
+
+        return rects
+
+    def __render_text(self, text: str) -> pygame.Surface:
+        """ font.render, cached as the same few strings get drawn on every redraw """
+        if text not in self.text_cache:
+            self.text_cache[text] = self.font.render(text, True, (255, 255, 255))
+
+        return self.text_cache[text]
+
+    def __wants_full_redraw(self, event, mouse_buttons_pressed) -> bool:
+        """ Mouse movement only moves the overlays, unless it is panning the camera or dragging a door or light """
+        if event.type != pygame.MOUSEMOTION:
+            return True
+
+        return (bool(mouse_buttons_pressed[2]) or self.wall_door_dragging is not None or
+                self.dragging_light is not None)
+
+    def __wait_for_events(self) -> list:
+        """ Sleeps until there is input (or it's time to update the export progress), then returns every event """
+        timeout = self.EXPORT_POLL_MS if self.export_thread is not None else self.IDLE_WAIT_MS
+
+        first = pygame.event.wait(timeout)
+        if first.type == pygame.NOEVENT:
+            return []
+
+        return [first] + pygame.event.get()
+
     def run(self):
         self.running = True
 
         ignore_reselect = False
         while self.running:
+            if self.DIRTY_RENDERING and not self.full_redraw:
+                events = self.__wait_for_events()
+            else:
+                events = pygame.event.get()
+
             mouse_buttons_pressed = pygame.mouse.get_pressed()
             mouse_x, mouse_y = pygame.mouse.get_pos()
 
-            for event in pygame.event.get():
+            for event in events:
+                if self.__wants_full_redraw(event, mouse_buttons_pressed):
+                    self.full_redraw = True
+
                 if event.type == pygame.QUIT:
                     self.running = False
 
@@ -1109,6 +1496,10 @@ class App:
                         if self.editing_layer == "objects":
                             self.object_grid_snap = not self.object_grid_snap
 
+                    if event.key == pygame.K_p:
+                        if self.editing_layer == "lights":
+                            self.toggle_lighting_preview()
+
                 if event.type == pygame.MOUSEMOTION:
                     if self.mouse_held and not self.dragging:
                         camera_space = self.__world_space_to_camera(*self.dragging_start)
@@ -1120,7 +1511,7 @@ class App:
                         self.camera_position[0] += event.rel[0] * (1 / self.camera_scale)
                         self.camera_position[1] += event.rel[1] * (1 / self.camera_scale)
 
-                        self.create_object_layer()  # Update the objects
+                        self.__pan_object_layer()  # Only the strip that scrolled into view needs drawing
 
                     else:
                         if self.editing_layer == "walls":
@@ -1136,6 +1527,11 @@ class App:
                                 self.selected_room.render_room()
                                 self.render_door_creation_points()
 
+                        if self.dragging_light is not None and mouse_buttons_pressed[0]:
+                            x, y = self.lights[self.dragging_light][0]
+                            self.lights[self.dragging_light][0] = (x + event.rel[0] / self.camera_scale,
+                                                                   y + event.rel[1] / self.camera_scale)
+
                         if self.dragging and self.editing_layer == "objects" and self.dragging_object is not None:
                             self.dragging_object_loc[0] += event.rel[0] * (1 / self.camera_scale)
                             self.dragging_object_loc[1] += event.rel[1] * (1 / self.camera_scale)
@@ -1158,23 +1554,23 @@ class App:
                                     x, y, rx, ry = data
 
                                     self.switches.append((x, y, rx, ry, self.selected_room.room_id))
-                                    self.add_undo_step("switch-add", (len(self.switches) - 1, self.switches[-1]))
+                                    self.add_undo_step(AddItem("switch-add", self.switches, self.switches[-1]))
+
+                            elif (light_index := self.__light_at(mouse_x, mouse_y)) is not None:
+                                self.dragging_light = light_index
+                                self.dragging_light_start = self.lights[light_index][0]
 
                             else:
                                 # [ [(x, y), brightness {0f-1f}, radius {int}, on_by_default {bool}, room_id], ...]
 
                                 if self.selected_room:
-                                    if len(self.lights) == 63:
-                                        print("Max lights in-use (63) Ask daniel to update it to a 128 bit uint")
-                                        return
-
                                     self.lights.append([
                                         self.__camera_to_world_space(mouse_x, mouse_y),
                                         0.8, 200, True,
                                         self.selected_room.room_id
                                     ])
 
-                                    self.add_undo_step("light-add", (len(self.lights)-1, self.lights[-1]))
+                                    self.add_undo_step(AddItem("light-add", self.lights, self.lights[-1]))
 
 
                         if (self.editing_layer == "walls" and
@@ -1210,7 +1606,7 @@ class App:
                                             if event.button == 1:
                                                 new_door = Door()
                                                 self.selected_room.walls[data].doors.append(new_door)
-                                                self.add_undo_step("new-door", (self.selected_room, self.selected_room.walls[data].doors, new_door))
+                                                self.add_undo_step(ChangeDoors(self.selected_room, data, len(self.selected_room.walls[data].doors) - 1, new_door, True))
 
                                                 self.selected_room.render_room()
                                                 self.render_door_creation_points()
@@ -1222,7 +1618,12 @@ class App:
                         if self.wall_door_dragging is not None:
                             wall_index, door_index = self.wall_door_dragging
                             current_offset = self.selected_room.walls[wall_index].doors[door_index].offset
-                            self.add_undo_step("move-door", (self.selected_room, self.selected_room.walls[wall_index], door_index, self.wall_drag_start_offset, current_offset))
+                            self.add_undo_step(SetRoomValue(self.selected_room, self.selected_room.walls[wall_index].doors[door_index], "offset", self.wall_drag_start_offset, current_offset))
+
+                        if self.dragging_light is not None:
+                            self.add_undo_step(MoveLight(self.dragging_light, self.dragging_light_start,
+                                                         self.lights[self.dragging_light][0]))
+                            self.dragging_light = None
 
 
                         if self.dragging:
@@ -1234,14 +1635,15 @@ class App:
                                     if self.object_grid_snap:
                                         self.dragging_object_loc = self.__snap_point_to_grid(*self.dragging_object_loc)
 
-                                    self.add_undo_step("object-move", (
-                                        self.dragging_object, (self.dragging_object_start_loc[0], self.dragging_object_start_loc[1]),
-                                        (self.dragging_object_loc[0], self.dragging_object_loc[1])
+                                    self.add_undo_step(MoveObject(
+                                        self.object_layout[self.dragging_object],
+                                        self.dragging_object_start_loc, self.dragging_object_loc
                                     ))
 
 
                                     self.object_layout[self.dragging_object][1][0] = self.dragging_object_loc[0]
                                     self.object_layout[self.dragging_object][1][1] = self.dragging_object_loc[1]
+                                    self.index_object(self.dragging_object)
                                     self.dragging_object = None
                                     self.create_object_layer()
 
@@ -1271,101 +1673,35 @@ class App:
                     self.camera_position[0] += (mouse_x - new_screen_x) / self.camera_scale
                     self.camera_position[1] += (mouse_y - new_screen_y) / self.camera_scale
 
-                    self.create_object_layer()  # Update the objects
+                    self.create_object_layer()  # Same objects, new scale
 
-            self.display.fill((10, 10, 10))
+            if self.full_redraw:
+                self.__stream_chunks()  # Only camera moves and edits cause full redraws, so it's the place to check
 
-            self.__render_rooms()
+            if self.full_redraw or not self.DIRTY_RENDERING:
+                self.__draw_scene()
+                self.scene_surface.blit(self.display, (0, 0))
 
-            if self.editing_layer == "rooms":
-                if self.dragging:
-                    start_x, start_y = self.__world_space_to_camera(*self.dragging_start)
+                self.overlay_rects = self.__draw_overlays(mouse_x, mouse_y)
+                self.full_redraw = False
 
-                    snapped_x, snapped_y = self.__world_space_to_camera(
-                        *self.__snap_point_to_grid(
-                            *self.__camera_to_world_space(mouse_x, mouse_y)
-                        )
-                    )
-                    w, h = snapped_x - start_x, snapped_y - start_y
+                pygame.display.flip()
 
-                    if w < 0:
-                        start_x += w
-                        w *= -1
+            elif events or self.export_thread is not None:
+                # Put the scene back where the overlays were last frame, then draw them in their new spots
+                for rect in self.overlay_rects:
+                    self.display.blit(self.scene_surface, rect, rect)
 
-                    if h < 0:
-                        start_y += h
-                        h *= -1
+                rects = self.__draw_overlays(mouse_x, mouse_y)
+                pygame.display.update(self.overlay_rects + rects)
 
-                    pygame.draw.rect(
-                        self.display,
-                        (10, 10, 150, 80),
-                        (start_x, start_y, w, h)
-                    )
+                self.overlay_rects = rects
 
-                if self.selected_room_cache is not None:
-                    self.display.blit(
-                        self.selected_room_cache,
-                        (self.display.get_width() - self.selected_room_cache.get_width(), 0)
-                    )
+            self.__tick_autosave()
+            self.clock.tick(self.MAX_FPS)
 
-            if self.editing_layer == "walls":
-                if self.selected_room:
-                    for wall, icon, xy, _ in self.wall_door_creation_locations:
-                        self.display.blit(
-                            icon, self.__world_space_to_camera(*xy)
-                        )
-
-                    if self.wall_door_config_surf:
-                        self.display.blit(self.wall_door_config_surf, (self.display.get_width() - 400, 0))
-
-            if self.dragging and self.editing_layer == "objects" and self.dragging_object is not None:
-                img, _, _ = self.object_layout[self.dragging_object]
-
-                pos = self.dragging_object_loc
-
-                if self.object_grid_snap:
-                    pos = self.__snap_point_to_grid(*pos)
-
-                self.display.blit(img, self.__world_space_to_camera(*pos))
-
-            if self.editing_layer == "lights":
-                if pygame.key.get_mods() & pygame.KMOD_ALT:  # render possible switch position
-                    position = self.find_position_of_lightswitch(mouse_x, mouse_y)
-
-                    if position:
-                        xy = self.__world_space_to_camera(position[0], position[1])
-                        pygame.draw.line(
-                            self.display,
-                            (24, 216, 249),
-                            xy,
-                            [xy[0] + 10 * position[2], xy[1] + 10 * position[3]],
-                            width=max(1, round(5 * self.camera_scale))
-                        )
-
-                for light in self.lights:  # [(x, y), brightness {0f-1f}, radius {int}, on_by_default {bool}, room_id]
-                    (x, y), brightness, radius, _, _ = light
-
-                    pygame.draw.circle(
-                        self.display,
-                        (255*brightness, 0, 0),
-                        self.__world_space_to_camera(x, y),
-                        radius*self.camera_scale, width=1
-                    )
-
-                    pygame.draw.circle(
-                        self.display,
-                        (242, 239, 55),
-                        self.__world_space_to_camera(x, y),
-                        7*self.camera_scale
-                    )
-
-            self.display.blit(self.object_layer_surface, (0, 0))
-
-            mode_rect = self.font.render(f"Editing: {self.editing_layer}", True, (255,255,255))
-            self.display.blit(mode_rect, (5, 5))
-            self.__display_tool_tips()
-
-            pygame.display.flip()
+        self.__tick_autosave(force=True)
+        self.autosave.stop()
 
 
 if __name__ == "__main__":
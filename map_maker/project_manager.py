@@ -1,92 +1,342 @@
+import os
 import json
 import math
+import time
+import bisect
+import hashlib
+import zipfile
 
 import pygame
 import numpy as np
 from PIL import Image
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import maker_v2
+import texture_catalogue
 from map_maker.maker_v2 import Room
-
-
-def save_project(path, room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list):
+from engine.map_sections import write_section
+from engine.light_table import LightTable, LightTableBuilder
+
+
+def snapshot_project(room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list) -> dict:
+    """
+    Copies the layout into plain tuples / dicts (no surfaces or live objects), cheap enough to take on the UI thread.
+    Nothing else holds on to the result, so it can be handed to another thread and serialised there
+    """
+    return {
+        "rooms": tuple(
+            {
+                "id": room.room_id,
+                "position": (room.world_x, room.world_y),
+                "shape": (room.width, room.height),
+                "colour": tuple(room.colour),
+                "floor_tile": room.floor_tile[1] if room.floor_tile else None,
+                "is_hiding_spot": room.hiding_spot,
+                "walls": tuple(
+                    {
+                        "is_vertical": wall.is_vertical,
+                        "doorways": tuple(
+                            {
+                                "offset": door.offset,
+                                "width": door.width,
+                                "has_door": door.has_door,
+                            }
+                            for door in wall.doors
+                        )
+                    } if wall is not None else None
+                    for wall in room.walls
+                )
+            }
+            for room in room_layout
+        ),
+        "objects": tuple(
+            {
+                "position": (obj[1][0], obj[1][1]),
+                "size": obj[0].get_size(),
+                "path": obj[2]
+            }
+            for obj in object_layout
+        ),
+        "lights": tuple((tuple(light[0]), *light[1:]) for light in lights),
+        "switches": tuple(tuple(switch) for switch in switches)
+    }
+
+
+def write_atomic(path, text: str):
+    """ Writes to a temp file next to path then renames it over, so a crash never leaves half a file behind """
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, path)
+
+
+def write_project(path, snapshot: dict):
     if not path:
         return
 
-    with open(path, "w") as f:
-        json.dump({
-            "rooms": [
-                {
-                    "id": room.room_id,
-                    "position": [room.world_x, room.world_y],
-                    "shape": [room.width, room.height],
-                    "colour": room.colour,
-                    "floor_tile": room.floor_tile[1] if room.floor_tile else None,
-                    "is_hiding_spot": room.hiding_spot,
-                    "walls": [
-                        {
-                            "is_vertical": wall.is_vertical,
-                            "doorways": [
-                                {
-                                    "offset": door.offset,
-                                    "width": door.width,
-                                    "has_door": door.has_door,
-                                }
-                                for door in wall.doors
-                            ]
-                        } if wall is not None else None
-                        for wall in room.walls
-                    ]
-                }
-                for room in room_layout
-            ],
-            "objects": [
-                {
-                    "position": obj[1],
-                    "path": obj[2]
-                }
-                for obj in object_layout
-            ],
-            "lights": lights,
-            "switches": switches
-        }, f)
+    if path.endswith(CHUNKED_EXTENSION):
+        write_chunked_project(path, snapshot)
+    else:
+        write_atomic(path, json.dumps(snapshot))
+
+
+def save_project(path, room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list):
+    write_project(path, snapshot_project(room_layout, object_layout, lights, switches))
 
 
 def load_project(path):
+    if zipfile.is_zipfile(path):
+        with ChunkedProject(path) as project:
+            return project.load_all()
+
     with open(path, "r") as f:
         data = json.load(f)
 
-    room_layout = []
-    for room in data["rooms"]:
-        room_instance = maker_v2.Room(room["id"],
-                                      room["position"][0], room["position"][1],
-                                      room["shape"][0], room["shape"][1],
-                                      room["colour"])
-
-        room_instance.hiding_spot = room["is_hiding_spot"]
-        room_instance.floor_tile = ( pygame.image.load(room["floor_tile"]).convert_alpha(), room["floor_tile"] )
-
-        room_instance.walls = []
-        for wall in room["walls"]:
-            wall_instance = maker_v2.Wall(wall["is_vertical"])
-
-            for door in wall["doorways"]:
-                door_instance = maker_v2.Door()
-                door_instance.offset = door["offset"]
-                door_instance.width = door["width"]
-                door_instance.has_door = door["has_door"]
-
-                wall_instance.doors.append(door_instance)
-            room_instance.walls.append(wall_instance)
-        room_layout.append(room_instance)
-
-    object_layout = [
-        [pygame.image.load(obj["path"]), obj["position"], obj["path"]]
-        for obj in data["objects"]
-    ]
+    return project_from_data(data)
+
+
+def project_asset_paths(path) -> list[str]:
+    """ Every floor tile and object image a project uses, without loading any of them """
+    if zipfile.is_zipfile(path):
+        with ChunkedProject(path) as project:
+            rooms, objects = project.unloaded_entries()
+    else:
+        with open(path, "r") as f:
+            data = json.load(f)
+        rooms, objects = data["rooms"], data["objects"]
+
+    paths = {room["floor_tile"] for room in rooms if room["floor_tile"] is not None}
+    paths.update(obj["path"] for obj in objects)
+
+    return sorted(paths)
+
+
+def project_from_data(data: dict):
+    """ Builds the editors layout back up from a saved (or recovered autosave) project """
+    room_layout = [room_from_data(room) for room in data["rooms"]]
+    object_layout = [object_from_data(obj) for obj in data["objects"]]
+
+    lights = [[tuple(light[0]), *light[1:]] for light in data["lights"]]
+    switches = [tuple(switch) for switch in data["switches"]]
+
+    return room_layout, object_layout, lights, switches
+
+
+def room_from_data(room: dict) -> maker_v2.Room:
+    room_instance = maker_v2.Room(room["id"],
+                                  room["position"][0], room["position"][1],
+                                  room["shape"][0], room["shape"][1],
+                                  tuple(room["colour"]))
+
+    room_instance.hiding_spot = room["is_hiding_spot"]
+    if room["floor_tile"] is not None:
+        room_instance.floor_tile = ( texture_catalogue.textures.load(room["floor_tile"]), room["floor_tile"] )
+
+    room_instance.walls = []
+    for wall in room["walls"]:
+        if wall is None:
+            room_instance.walls.append(None)
+            continue
+
+        wall_instance = maker_v2.Wall(wall["is_vertical"])
+
+        for door in wall["doorways"]:
+            door_instance = maker_v2.Door()
+            door_instance.offset = door["offset"]
+            door_instance.width = door["width"]
+            door_instance.has_door = door["has_door"]
 
-    return room_layout, object_layout, data["lights"], data["switches"]
+            wall_instance.doors.append(door_instance)
+        room_instance.walls.append(wall_instance)
+
+    return room_instance
+
+
+def object_from_data(obj: dict) -> list:
+    return [texture_catalogue.textures.load(obj["path"]), list(obj["position"]), obj["path"]]
+
+
+# =============================================== #
+# ==>             CHUNKED PROJECTS            <== #
+# =============================================== #
+
+"""
+
+Chunked projects are a zip of:
+    index.json          - chunk size, the biggest room / object, lights, switches and which chunks exist
+    chunks/<x>,<y>.json - the rooms and objects whose top left corner is in that chunk, each with its "order" in the
+                          full layout so loading everything gives back exactly what was saved
+
+Opening one only reads the index, the editor then loads the chunks around what's on screen as you move about.
+
+"""
+
+CHUNKED_EXTENSION = ".cproject"
+CHUNK_SIZE = 2048
+
+
+def chunk_key(x, y, chunk_size: int = CHUNK_SIZE) -> str:
+    return f"{math.floor(x / chunk_size)},{math.floor(y / chunk_size)}"
+
+
+def write_chunked_project(path, snapshot: dict, chunk_size: int = CHUNK_SIZE):
+    chunks = {}
+    max_extent = [0, 0]
+
+    for section, entries in (("rooms", snapshot["rooms"]), ("objects", snapshot["objects"])):
+        for order, entry in enumerate(entries):
+            x, y = entry["position"]
+            width, height = entry["shape"] if section == "rooms" else entry["size"]
+            max_extent = [max(max_extent[0], width), max(max_extent[1], height)]
+
+            chunk = chunks.setdefault(chunk_key(x, y, chunk_size), {"rooms": [], "objects": []})
+            chunk[section].append({**entry, "order": order})
+
+    index = {
+        "format": 1,
+        "chunk_size": chunk_size,
+        "max_extent": max_extent,
+        "max_room_id": max((room["id"] for room in snapshot["rooms"]), default=0),
+        "lights": snapshot["lights"],
+        "switches": snapshot["switches"],
+        "chunks": {key: {"rooms": len(chunk["rooms"]), "objects": len(chunk["objects"])}
+                   for key, chunk in chunks.items()}
+    }
+
+    temp_path = f"{path}.tmp"
+    with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_DEFLATED) as f:
+        f.writestr("index.json", json.dumps(index))
+
+        for key, chunk in chunks.items():
+            f.writestr(f"chunks/{key}.json", json.dumps(chunk))
+
+    os.replace(temp_path, path)
+
+
+class ChunkedProject:
+    """ An open chunked project, hands out the rooms / objects of each chunk the first time its asked for """
+    def __init__(self, path):
+        self.path = path
+        self.__zip = zipfile.ZipFile(path, "r")
+
+        self.index = json.loads(self.__zip.read("index.json"))
+        self.chunk_size = self.index["chunk_size"]
+        self.loaded: set[str] = set()
+        self.loaded_orders = {"rooms": [], "objects": []}  # Saved order of everything loaded so far, sorted
+
+        self.lights = [[tuple(light[0]), *light[1:]] for light in self.index["lights"]]
+        self.switches = [tuple(switch) for switch in self.index["switches"]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.__zip.close()
+
+    @property
+    def fully_loaded(self) -> bool:
+        return len(self.loaded) == len(self.index["chunks"])
+
+    def __read_chunk(self, key: str) -> dict:
+        return json.loads(self.__zip.read(f"chunks/{key}.json"))
+
+    def __chunks_in(self, x, y, width, height) -> list[str]:
+        """ Chunks that could hold something overlapping the rect, as big as the biggest room / object can be """
+        max_width, max_height = self.index["max_extent"]
+        size = self.chunk_size
+
+        columns = range(math.floor((x - max_width) / size), math.floor((x + width) / size) + 1)
+        rows = range(math.floor((y - max_height) / size), math.floor((y + height) / size) + 1)
+
+        if len(columns) * len(rows) > len(self.index["chunks"]):  # Zoomed out past the whole map
+            keys = self.index["chunks"]
+        else:
+            keys = [f"{column},{row}" for column in columns for row in rows]
+
+        return [key for key in keys if key in self.index["chunks"] and key not in self.loaded]
+
+    def load_region(self, x, y, width, height) -> tuple[list, list]:
+        """ Rooms and objects of every not yet loaded chunk overlapping the world space rect, see __load """
+        return self.__load(self.__chunks_in(x, y, width, height))
+
+    def load_remaining(self) -> tuple[list, list]:
+        """ Rooms and objects of every chunk not loaded yet, see __load """
+        return self.__load([key for key in self.index["chunks"] if key not in self.loaded])
+
+    def __place(self, section: str, entries: list) -> list:
+        """ (layout index, entry) for each entry, sorted so inserting them in turn keeps the layout in saved order """
+        entries.sort(key=lambda entry: entry["order"])
+        placed = []
+
+        for entry in entries:
+            index = bisect.bisect_left(self.loaded_orders[section], entry["order"])
+            self.loaded_orders[section].insert(index, entry["order"])
+            placed.append((index, entry))
+
+        return placed
+
+    def __load(self, keys) -> tuple[list, list]:
+        """
+        Returns (layout index, room / object) pairs. The layout is expected to hold everything loaded so far in saved
+        order followed by anything made since, inserting each pair at its index in turn keeps it that way
+        """
+        rooms, objects = [], []
+
+        for key in keys:
+            chunk = self.__read_chunk(key)
+            rooms.extend(chunk["rooms"])
+            objects.extend(chunk["objects"])
+            self.loaded.add(key)
+
+        return ([(index, room_from_data(room)) for index, room in self.__place("rooms", rooms)],
+                [(index, object_from_data(obj)) for index, obj in self.__place("objects", objects)])
+
+    def load_all(self):
+        """ Everything, in the order it was saved. Returns the same as load_project, so only before any load_region """
+        rooms, objects = self.load_remaining()
+        return [room for _, room in rooms], [obj for _, obj in objects], self.lights, self.switches
+
+    def __unloaded_chunks(self) -> list[dict]:
+        return [self.__read_chunk(key) for key in self.index["chunks"] if key not in self.loaded]
+
+    def unloaded_entries(self) -> tuple[list, list]:
+        """ The saved room / object entries of every chunk not loaded yet, in no particular order """
+        rooms, objects = [], []
+
+        for chunk in self.__unloaded_chunks():
+            rooms.extend({k: v for k, v in room.items() if k != "order"} for room in chunk["rooms"])
+            objects.extend({k: v for k, v in obj.items() if k != "order"} for obj in chunk["objects"])
+
+        return rooms, objects
+
+    def merge_unloaded(self, snapshot: dict) -> dict:
+        """
+        Puts the saved entries of every chunk not loaded yet back into a snapshot of the layout (see __load for how
+        it's laid out), each in its saved order, so saving a partly loaded project doesn't reorder it
+        """
+        snapshot = dict(snapshot)
+        chunks = self.__unloaded_chunks()
+
+        for section in ("rooms", "objects"):
+            orders = self.loaded_orders[section]
+            entries = snapshot[section]
+
+            saved = list(zip(orders, entries))
+            for chunk in chunks:
+                saved.extend((entry.pop("order"), entry) for entry in chunk[section])
+            saved.sort(key=lambda pair: pair[0])
+
+            snapshot[section] = tuple(entry for _, entry in saved) + tuple(entries[len(orders):])
+
+        return snapshot
 
 
 # =============================================== #
@@ -129,21 +379,52 @@ def extract_height_from_path(path: str):  # Some light string manipulation - Thi
 
     return float(".".join(path.split("/")[-1].split("_")[-1].split(".")[:-1]))
 
+
+MAP_VERSION = 4  # What export writes unless asked for an older version
+EXPORTER_VERSION = 1  # Bump with any change to the exported bytes, batch_export skips maps whose hash hasn't changed
+
+WALL_HEIGHT = 1.0
+HEIGHT_FORMATS = ("float32", "uint8")  # uint8 packs 0-1 into 0-255, a quarter of the size
+
+
+def object_height_mask(img) -> np.ndarray:
+    """ (h, w) bool mask of the pixels an object actually covers, from its alpha channel """
+    return np.transpose(pygame.surfarray.array_alpha(img), (1, 0)) > 0
+
+
 def apply_object_heights(height_map, offset, object_layout):
+    """ Max-composites every objects alpha mask into the height map, so overlapping objects keep the tallest """
     dx, dy = offset
+    rows, cols = height_map.shape
+    masks = {}  # Objects sharing a texture share a mask
+
     for img, pos, path in object_layout:
-        x, y = pos
-        width, height = img.get_size()
         value = extract_height_from_path(path)
+        if value <= 0:
+            continue
 
-        print(value)
+        if path not in masks:
+            masks[path] = object_height_mask(img)
+        mask = masks[path]
 
-        # fy1:fy2, fx1:fx2
-        height_map[y+dy:y+dy + height, x+dx:x+dx + width] = value
+        x, y = pos[0] + dx, pos[1] + dy
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(cols, x + mask.shape[1]), min(rows, y + mask.shape[0])
 
-def apply_wall_heights(height_map, offset, room_layout: list[maker_v2.Room], wall_thickness=3):
-    def fill(fx1, fy1, fx2, fy2, value):
-        height_map[fy1:fy2, fx1:fx2] = value
+        if x2 <= x1 or y2 <= y1:
+            continue
+
+        window = height_map[y1:y2, x1:x2]
+        np.maximum(window, np.where(mask[y1 - y:y2 - y, x1 - x:x2 - x], value, 0).astype(height_map.dtype), out=window)
+
+
+def wall_rectangles(offset, room_layout: list[maker_v2.Room], wall_thickness=3) -> list:
+    """ Every solid stretch of wall (between doors) as (x1, y1, x2, y2) in height map space """
+    rectangles = []
+
+    def fill(fx1, fy1, fx2, fy2):
+        # Walls with a negative normal run backwards, sort each rectangles corners out
+        rectangles.append((min(fx1, fx2), min(fy1, fy2), max(fx1, fx2), max(fy1, fy2)))
 
     dx, dy = offset
     for room in room_layout:
@@ -172,7 +453,7 @@ def apply_wall_heights(height_map, offset, room_layout: list[maker_v2.Room], wal
                     if start < current[1]:
                         raise ValueError("At least 2 doors are interesting on a single wall")
 
-                    fill(current[0], current[1], sx + (normal * wall_thickness), start, 1)
+                    fill(current[0], current[1], sx + (normal * wall_thickness), start)
                     current = [sx, end]
 
                 else:
@@ -182,42 +463,262 @@ def apply_wall_heights(height_map, offset, room_layout: list[maker_v2.Room], wal
                     if start < current[0]:
                         raise ValueError("At least 2 doors are interesting on a single wall")
 
-                    fill(current[0], current[1], start, sy + (normal * wall_thickness), 1)
+                    fill(current[0], current[1], start, sy + (normal * wall_thickness))
                     current = [end, sy]
 
             if wall.is_vertical:
-                fill(current[0], current[1], ex + (normal * wall_thickness), ey, 1)
+                fill(current[0], current[1], ex + (normal * wall_thickness), ey)
 
             else:
-                fill(current[0], current[1], ex, ey + (normal * wall_thickness), 1)
+                fill(current[0], current[1], ex, ey + (normal * wall_thickness))
+
+    return rectangles
+
+
+def apply_wall_heights(height_map, offset, room_layout: list[maker_v2.Room], wall_thickness=3):
+    """
+    Rasterises every wall in one go: each rectangle marks its corners in a difference array,
+    two cumulative sums turn that into how many walls cover each pixel
+    """
+    rectangles = wall_rectangles(offset, room_layout, wall_thickness)
+    if not rectangles:
+        return
+
+    rows, cols = height_map.shape
+    x1, y1, x2, y2 = np.round(np.array(rectangles, dtype=np.float64)).astype(np.intp).T
+
+    x1, x2 = np.clip(x1, 0, cols), np.clip(x2, 0, cols)
+    y1, y2 = np.clip(y1, 0, rows), np.clip(y2, 0, rows)
+
+    coverage = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    np.add.at(coverage, (y1, x1), 1)
+    np.add.at(coverage, (y1, x2), -1)
+    np.add.at(coverage, (y2, x1), -1)
+    np.add.at(coverage, (y2, x2), 1)
+
+    np.cumsum(coverage, axis=0, out=coverage)
+    np.cumsum(coverage, axis=1, out=coverage)
+
+    walls = coverage[:rows, :cols] > 0
+    height_map[walls] = np.maximum(height_map[walls], WALL_HEIGHT)
+
+
+def pack_height_map(height_map, height_format: str = "float32") -> np.ndarray:
+    """ The height map as it is written to the file, see HEIGHT_FORMATS """
+    if height_format == "float32":
+        return height_map.astype(np.float32, copy=False)
+
+    if height_format == "uint8":
+        return np.rint(np.clip(height_map, 0, 1) * 255).astype(np.uint8)
+
+    raise ValueError(f"Unknown height format: {height_format}")
+
+
+LIGHT_HEIGHT = 0.9  # Height lights are baked from, the same the old editor used
+
+
+def light_bounds(light, offset, shape):
+    """ Returns the lights position on the map and its bounding square (x, y, x1, x2, y1, y2), clipped to the map """
+    lh, lw = shape
+    (x, y), brightness, radius, _, _ = light
+
+    x += offset[0]
+    y += offset[1]
+
+    x1, x2 = round(max(0, x - radius)), round(min(lw, x + radius))
+    y1, y2 = round(max(0, y - radius)), round(min(lh, y + radius))
+
+    return x, y, x1, x2, y1, y2
+
+
+def compute_visibility(heights, light_x: float, light_y: float, radius: float, light_height: float = LIGHT_HEIGHT):
+    """
+    Polar sweep shadow casting. Marches every ray out from the light at once, keeping the steepest slope seen so far,
+    a pixel is lit if nothing between it and the light rises above the line joining the two (like the old
+    ray_collides_with_something). Returns a bool mask the shape of heights
+    """
+    rows, cols = heights.shape
+    ray_count = max(8, math.ceil(2 * math.pi * radius))  # Rays ~1 pixel apart at the edge of the light
+    step_count = max(1, math.ceil(radius))
+
+    angles = np.arange(ray_count) * (2 * math.pi / ray_count)
+    steps = np.arange(1, step_count + 1, dtype=np.float64)
+
+    sample_x = np.rint(light_x + np.cos(angles)[:, np.newaxis] * steps).astype(np.intp)
+    sample_y = np.rint(light_y + np.sin(angles)[:, np.newaxis] * steps).astype(np.intp)
+    inside = (sample_x >= 0) & (sample_x < cols) & (sample_y >= 0) & (sample_y < rows)
+
+    sample_heights = np.zeros(sample_x.shape, dtype=np.float64)
+    sample_heights[inside] = heights[sample_y[inside], sample_x[inside]]
+
+    # horizon[ray, k] is the steepest slope within the first k steps, column 0 is "nothing in the way yet"
+    horizon = np.empty((ray_count, step_count + 1), dtype=np.float64)
+    horizon[:, 0] = -np.inf
+    np.maximum.accumulate((sample_heights - light_height) / steps, axis=1, out=horizon[:, 1:])
+
+    my = np.arange(rows, dtype=np.float64)[:, np.newaxis] - light_y
+    mx = np.arange(cols, dtype=np.float64)[np.newaxis, :] - light_x
+
+    distance = np.maximum(np.hypot(mx, my), 1e-6)
+    ray = np.rint(np.arctan2(my, mx) * (ray_count / (2 * math.pi))).astype(np.intp) % ray_count
+    # Only steps at least a pixel short of the target can block it, so walls still light their own face
+    steps_before = np.clip(np.floor(distance - 1), 0, step_count).astype(np.intp)
+
+    return (heights - light_height) / distance >= horizon[ray, steps_before]
+
+
+def compute_light(light_id: int, light, offset, shape, heights=None):
+    """
+    Works out a single lights contribution over its bounding square.
+    heights, if given, is the height map cut to that square and is used to cast shadows.
+    Returns (y1, y2, x1, x2), the float64 increment to add to the light map and the mask of pixels it reaches
+    """
+    _, brightness, radius, _, _ = light
+    x, y, x1, x2, y1, y2 = light_bounds(light, offset, shape)
+
+    if x2 <= x1 or y2 <= y1:
+        return (y1, y1, x1, x1), np.zeros((0, 0)), np.zeros((0, 0), dtype=bool)
+
+    # (rows, 1) and (1, cols), broadcast against each other instead of looping every pixel
+    my = np.arange(y1, y2, dtype=np.float64)[:, np.newaxis]
+    mx = np.arange(x1, x2, dtype=np.float64)[np.newaxis, :]
+
+    distance_squared = (x - mx) ** 2 + (y - my) ** 2
+    in_range = distance_squared <= radius * radius
+
+    if heights is not None:
+        in_range &= compute_visibility(heights, x - x1, y - y1, radius)
+
+    t = np.minimum(np.sqrt(distance_squared) / radius, 1.0)
+    intensity = brightness * ((1 - t) ** 2)
+    scaled = np.minimum(np.maximum(0, intensity), 0.8) * 1.25
+
+    increment = np.where(in_range, scaled * 255, 0.0)
+
+    return (y1, y2, x1, x2), increment, in_range
 
-def apply_lighting(light_map, id_map, lights: list, offset):
-    lh, lw = int(light_map.shape[0]), int(light_map.shape[1])
+
+def _compute_light_job(job):
+    return compute_light(*job)
+
+
+def light_jobs(lights: list, offset, shape, height_map=None) -> list:
+    """ Arguments for compute_light for every light, in light order """
     # [(x, y), brightness {0f-1f}, radius {int}, on_by_default {bool}, room_id]
-    for id, ((x, y), brightness, radius, _, _) in enumerate(lights):
-        x += offset[0]
-        y += offset[1]
+    jobs = []
+    for light_id, light in enumerate(lights):
+        heights = None
+        if height_map is not None:
+            # Only the lights own square, so the whole map isn't pickled over to the pool for every light
+            _, _, x1, x2, y1, y2 = light_bounds(light, offset, shape)
+            heights = height_map[y1:y2, x1:x2]
+
+        jobs.append((light_id, light, offset, shape, heights))
+
+    return jobs
+
+
+def apply_lighting(light_map, id_map, lights: list, offset, processes: int | None = None, height_map=None):
+    """
+    Adds every lights intensity into light_map and records which pixels it reaches in id_map,
+    either a dense uint64 map (a bit per light, 64 lights max) or a LightTableBuilder.
+    With processes > 1 the per light maths is spread over a process pool, results are still applied in light order.
+    Passing height_map casts shadows, otherwise light goes straight through walls
+    """
+    shape = (int(light_map.shape[0]), int(light_map.shape[1]))
+    jobs = light_jobs(lights, offset, shape, height_map)
+
+    if processes is not None and processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = executor.map(_compute_light_job, jobs)
+            _apply_light_results(light_map, id_map, results)
+    else:
+        _apply_light_results(light_map, id_map, map(_compute_light_job, jobs))
+
+
+def _apply_light_results(light_map, id_map, results):
+    for light_id, ((y1, y2, x1, x2), increment, in_range) in enumerate(results):
+        # Added at the light maps own precision, the same as the old per pixel loop did
+        window = light_map[y1:y2, x1:x2]
+        np.minimum(255, window + increment.astype(light_map.dtype), out=window)
+
+        if isinstance(id_map, LightTableBuilder):
+            id_map.add(light_id, y1, x1, in_range)
+        else:
+            id_map[y1:y2, x1:x2][in_range] |= np.uint64(1 << light_id)
+
+
+def create_light_ids(shape, light_count: int, version: int):
+    """ Sparse light table from version 4, the old dense bit per light map before that """
+    if version >= 4:
+        return LightTableBuilder(shape)
+
+    if light_count > 64:
+        raise ValueError(f"Version {version} maps hold at most 64 lights (got {light_count}), export as version 4")
+
+    return np.full(shape, 0, dtype=np.uint64)
+
+
+def finish_light_ids(light_ids):
+    return light_ids.build() if isinstance(light_ids, LightTableBuilder) else light_ids
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def encode_image(img_fp: str | Image.Image) -> bytes:
+    """ PNG bytes of an image file or PIL image, as embedded in the exported map. PNG files are passed through as is """
+    buffer = BytesIO()
+
+    if isinstance(img_fp, str):
+        with open(img_fp, "rb") as f:
+            file_bytes = f.read()
+
+        if file_bytes.startswith(PNG_SIGNATURE):
+            return file_bytes
+
+        with Image.open(BytesIO(file_bytes)) as img_file:
+            img_file.save(buffer, format="png")
+
+    else:
+        img_fp.save(buffer, format="png")
+
+    return buffer.getvalue()
+
+
+def floor_tiles(room_layout: list[maker_v2.Room]) -> list:
+    """ (x, y, w, h, tile_path) for every tiled room, plain data so it can be sent to another process """
+    return [
+        (room.world_x, room.world_y, round(room.width), round(room.height), room.floor_tile[1])
+        for room in room_layout
+        if room.floor_tile
+    ]
+
+
+def render_background(map_size, offset, tiles: list) -> Image.Image:
+    background_image = Image.new("RGB", map_size, (0, 0, 0))
+
+    for x, y, w, h, tile_path in tiles:
+        sub_image = Image.new("RGB", (w, h))
 
-        for mx in range(round(max(0, x-radius)), round(min(lw, x+radius))):
-            for my in range(round(max(0, y-radius)), round(min(lh, y+radius))):
-                distance_squared = ((x-mx)**2 + (y-my)**2)
+        tile = Image.open(tile_path)
+        tw, th = tile.width, tile.height
 
-                if distance_squared > radius * radius:
-                    continue
+        for dx in range(0, w, tw):
+            for dy in range(0, h, th):
+                sub_image.paste(tile, (dx, dy))
 
-                distance = math.sqrt(distance_squared)
-                t = min(distance / radius, 1.0)
+        background_image.paste(sub_image, (round(x + offset[0]), round(y + offset[1])))
 
-                intensity = brightness * ((1 - t) ** 2)
+    return background_image
 
-                scaled = min(max(0, intensity), 0.8) * 1.25
 
-                light_map[my, mx] = min(255, light_map[my, mx] + scaled * 255)
-                id_map[my, mx] |= 1 << id
+def _render_background_job(map_size, offset, tiles: list) -> bytes:
+    return encode_image(render_background(map_size, offset, tiles))
 
 
-def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list):
-    SAVE_VERSION = 2
+def prepare_export(room_layout: list[maker_v2.Room], object_layout: list):
+    """ Works out the maps layout and builds its height map, returns (padding, map_size, offset, height_map) """
     bounds = get_bounds(room_layout, object_layout)
 
     padding = 5
@@ -230,56 +731,120 @@ def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights:
     apply_object_heights(height_map, offset, object_layout)
     apply_wall_heights(height_map, offset, room_layout)
 
-    # > Create Light Maps
-    light_level_map = np.full(inverted_map_size, 0, dtype=np.float32)
-    light_id_map = np.full(inverted_map_size, 0, dtype=np.uint64)
+    return padding, map_size, offset, height_map
 
-    apply_lighting(light_level_map, light_id_map, lights, offset)
 
-    def write_image(file, img_fp: str | Image.Image):
-        if isinstance(img_fp, str):
-            with Image.open(img_fp) as img_file:
-                buffer = BytesIO()
-                img_file.save(buffer, format="png")
-                image_bytes = buffer.getvalue()
+def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list,
+           processes: int | None = None, occlusion: bool = True, height_format: str = "float32",
+           version: int = MAP_VERSION, timings: dict | None = None):
+    """ timings, if given, gets how many seconds each stage took """
+    if timings is None:
+        timings = {}
 
-        else:
-            buffer = BytesIO()
-            img_fp.save(buffer, format="png")
-            image_bytes = buffer.getvalue()
+    start = time.perf_counter()
 
-        file.write(len(image_bytes).to_bytes(8, byteorder="big"))
-        file.write(image_bytes)
+    def stage_done(stage):
+        nonlocal start
+        timings[stage] = time.perf_counter() - start
+        start = time.perf_counter()
 
+    padding, map_size, offset, height_map = prepare_export(room_layout, object_layout)
+    stage_done("height map")
 
-    # Generate Background image
-    background_image = Image.new("RGB", map_size, (0, 0, 0))
-
-    for room in room_layout:
-        x, y = room.world_x, room.world_y
-        w, h = round(room.width), round(room.height)
-
-        if room.floor_tile:
-            sub_image = Image.new("RGB", (w, h))
-
-            tile_path = room.floor_tile[1]
-            tile = Image.open(tile_path)
-            tw, th = tile.width, tile.height
+    # > Create Light Maps
+    light_level_map = np.full(height_map.shape, 0, dtype=np.float32)
+    light_id_map = create_light_ids(height_map.shape, len(lights), version)
 
-            for dx in range(0, w, tw):
-                for dy in range(0, h, th):
-                    sub_image.paste(tile, (dx, dy))
+    apply_lighting(light_level_map, light_id_map, lights, offset, processes,
+                   height_map if occlusion else None)
+    light_id_map = finish_light_ids(light_id_map)
+    stage_done("lighting")
 
-            background_image.paste(sub_image, (round(x + offset[0]), round(y + offset[1])))
+    # Generate Background image
+    background_bytes = encode_image(render_background(map_size, offset, floor_tiles(room_layout)))
+    stage_done("background")
+
+    image_bytes = {}
+    for _, _, image_path in object_layout:
+        if image_path not in image_bytes:
+            image_bytes[image_path] = encode_image(image_path)
+    stage_done("images")
+
+    write_export(path, padding, object_layout, lights, switches, background_bytes, image_bytes,
+                 pack_height_map(height_map, height_format), light_level_map, light_id_map, version)
+    stage_done("write")
+
+
+def export_parallel(path, room_layout: list[maker_v2.Room], object_layout: list, lights: list, switches: list,
+                    processes: int | None = None, occlusion: bool = True, height_format: str = "float32",
+                    version: int = MAP_VERSION, progress=None):
+    """
+    Produces exactly the same file as export, but the background, image re-encodes and every light all run at the
+    same time over a process pool. progress(stage, done, total) is called as each piece finishes, on whichever
+    thread this is running on (the editor runs it on a background thread and polls the latest value each frame)
+    """
+    if progress is None:
+        progress = lambda stage, done, total: None  # NOQA
+
+    progress("Height map", 0, 1)
+    padding, map_size, offset, height_map = prepare_export(room_layout, object_layout)
+
+    shape = (int(height_map.shape[0]), int(height_map.shape[1]))
+    jobs = light_jobs(lights, offset, shape, height_map if occlusion else None)
+    unique_paths = list(dict.fromkeys(image_path for _, _, image_path in object_layout))
+
+    light_level_map = np.full(height_map.shape, 0, dtype=np.float32)
+    light_id_map = create_light_ids(height_map.shape, len(lights), version)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        background_future = executor.submit(_render_background_job, map_size, offset, floor_tiles(room_layout))
+        image_futures = [executor.submit(encode_image, image_path) for image_path in unique_paths]
+        light_futures = [executor.submit(_compute_light_job, job) for job in jobs]
+
+        stages = {background_future: "Background"}
+        stages.update({future: "Images" for future in image_futures})
+        stages.update({future: "Lighting" for future in light_futures})
+
+        for done, future in enumerate(as_completed(stages), start=1):
+            future.result()  # Raise straight away if any stage failed
+            progress(stages[future], done, len(stages))
+
+        # Applied in light order, so overlapping lights add up the same as the serial export
+        _apply_light_results(light_level_map, light_id_map, (future.result() for future in light_futures))
+        light_id_map = finish_light_ids(light_id_map)
+
+        background_bytes = background_future.result()
+        image_bytes = {image_path: future.result() for image_path, future in zip(unique_paths, image_futures)}
+
+    progress("Writing", len(stages), len(stages))
+    write_export(path, padding, object_layout, lights, switches, background_bytes, image_bytes,
+                 pack_height_map(height_map, height_format), light_level_map, light_id_map, version)
+
+
+def write_export(path, padding, object_layout: list, lights: list, switches: list, background_bytes: bytes,
+                 image_bytes: dict, height_map, light_level_map, light_id_map, version: int = MAP_VERSION):
+    """
+    Version 3 is version 2 with the three maps written as compressed sections (see engine/map_sections.py).
+    Version 4 swaps the dense light id map for a LightTable and widens the light ids stored with switches
+    """
+    SAVE_VERSION = version
+
+    def write_image(file, png_bytes: bytes):
+        file.write(len(png_bytes).to_bytes(8, byteorder="big"))
+        file.write(png_bytes)
 
     # Write data
     with open(path, "wb") as f:
         f.write(SAVE_VERSION.to_bytes(2, byteorder="big"))
 
-        write_image(f, background_image)
+        write_image(f, background_bytes)
 
         f.write(len(object_layout).to_bytes(4, byteorder="big"))
 
+        # Keyed on the images content, so the same image under different paths is only stored once.
+        # Repeats point back at the first object that sent it, which is what the loaders cache is keyed on
+        content_hashes = {path: hashlib.sha256(data).digest() for path, data in image_bytes.items()}
+
         pre_sent = {}
         for i, obj in enumerate(object_layout):
             _, pos, path = obj
@@ -290,17 +855,20 @@ def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights:
             f.write((pos[1] + padding).to_bytes(4, byteorder="big", signed=True))
             f.write(round(extract_height_from_path(path) * 255).to_bytes(1, byteorder="big"))
 
-            if path in pre_sent:
+            content_hash = content_hashes[path]
+
+            if content_hash in pre_sent:
                 f.write(b"C")  # Cached
-                f.write(pre_sent[path].to_bytes(4, byteorder="big"))
+                f.write(pre_sent[content_hash].to_bytes(4, byteorder="big"))
 
             else:
                 f.write(b"N")  # New
-                write_image(f, path)
-                pre_sent[path] = i
+                write_image(f, image_bytes[path])
+                pre_sent[content_hash] = i
 
         f.write(len(switches).to_bytes(4, byteorder="big"))
 
+        switch_count_size, switch_id_size = (2, 4) if version >= 4 else (1, 1)
         for switch in switches:
             x, y, rx, ry, room_id = switch
 
@@ -314,10 +882,10 @@ def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights:
             f.write(rx.to_bytes(1, byteorder="big", signed=True))
             f.write(ry.to_bytes(1, byteorder="big", signed=True))
 
-            f.write(len(room_lights).to_bytes(1, byteorder="big"))
+            f.write(len(room_lights).to_bytes(switch_count_size, byteorder="big"))
 
             for light_id in room_lights:
-                f.write(light_id.to_bytes(1, byteorder="big"))
+                f.write(light_id.to_bytes(switch_id_size, byteorder="big"))
                 f.write(b"O" if lights[light_id][3] else b"F") # Default On/oFf
 
         f.write(len(lights).to_bytes(4, byteorder="big"))
@@ -327,6 +895,19 @@ def export(path, room_layout: list[maker_v2.Room], object_layout: list, lights:
             f.write(round(y).to_bytes(8, byteorder="big"))
             f.write(round(radius).to_bytes(4, byteorder="big"))
 
+        if version >= 4:
+            write_section(f, height_map)
+            write_section(f, light_level_map)
+            light_id_map.write(f)
+
+            return
+
+        if version == 3:
+            for array in (height_map, light_level_map, light_id_map):
+                write_section(f, array)
+
+            return
+
         height_data = height_map.tobytes()
         height_map_width, height_map_height = height_map.shape
 
@@ -0,0 +1,130 @@
+import os
+import hashlib
+
+import pygame
+
+"""
+
+Lazy texture loading for the map maker. TextureCatalogue only indexes the library (paths and sizes, read from the PNG
+headers) so startup doesn't depend on how many textures there are, the pixels are decoded the first time something
+asks for them. Every decode goes through the shared TextureCache, keyed by path and modified time, so the same
+file used by many objects / rooms is only ever loaded once (and is the same Surface).
+
+"""
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+THUMBNAIL_SIZE = 64
+
+
+def png_size(path: str) -> tuple[int, int] | None:
+    """ (width, height) from the IHDR chunk, without decoding anything. None if it isn't a PNG """
+    with open(path, "rb") as f:
+        header = f.read(24)
+
+    if len(header) < 24 or not header.startswith(PNG_SIGNATURE) or header[12:16] != b"IHDR":
+        return None
+
+    return int.from_bytes(header[16:20], byteorder="big"), int.from_bytes(header[20:24], byteorder="big")
+
+
+class TextureCache:
+    def __init__(self):
+        self.__surfaces: dict[str, tuple[int, pygame.Surface]] = {}  # absolute path -> (mtime, surface)
+
+    def load(self, path: str) -> pygame.Surface:
+        """ Decodes path, or returns the copy already loaded if the file hasn't changed since """
+        key = os.path.abspath(path)
+        mtime = os.stat(key).st_mtime_ns
+
+        cached = self.__surfaces.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        surface = pygame.image.load(key)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+
+        self.__surfaces[key] = (mtime, surface)
+        return surface
+
+    def clear(self):
+        self.__surfaces.clear()
+
+    def __len__(self):
+        return len(self.__surfaces)
+
+
+textures = TextureCache()  # Shared by the editor and project_manager
+
+
+class CatalogueEntry:
+    def __init__(self, path: str, size: tuple[int, int], mtime: int):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return f"CatalogueEntry(path={self.path}, size={self.size})"
+
+
+class TextureCatalogue:
+    def __init__(self, root: str, thumbnail_dir: str | None = None, cache: TextureCache = textures):
+        self.root = root
+        self.thumbnail_dir = thumbnail_dir
+        self.cache = cache
+
+        self.entries: dict[str, CatalogueEntry] = {}  # path -> entry
+        self.tree = self.__index(root)  # Same layout as the folders, filename -> entry or sub folder dict
+
+    def __index(self, path) -> dict:
+        tree = {}
+
+        with os.scandir(path) as it:
+            for item in it:
+                if item.is_file() and item.name.endswith(".png"):
+                    size = png_size(item.path)
+                    if size is None:
+                        print(f"[WARNING] {item.path} isn't a valid PNG, skipping it")
+                        continue
+
+                    entry = CatalogueEntry(item.path, size, item.stat().st_mtime_ns)
+                    self.entries[item.path] = entry
+                    tree[item.name] = entry
+
+                elif item.is_dir():
+                    tree[item.name] = self.__index(item.path)
+
+        return tree
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, path: str) -> pygame.Surface:
+        return self.cache.load(path)
+
+    def thumbnail(self, path: str, size: int = THUMBNAIL_SIZE) -> pygame.Surface:
+        """ A copy scaled to fit in size x size, kept on disk (if there's a thumbnail_dir) between sessions """
+        mtime = os.stat(path).st_mtime_ns
+        cached_path = None
+
+        if self.thumbnail_dir is not None:
+            key = hashlib.sha1(f"{os.path.abspath(path)}|{mtime}|{size}".encode()).hexdigest()
+            cached_path = os.path.join(self.thumbnail_dir, f"{key}.png")
+
+            if os.path.exists(cached_path):
+                return self.cache.load(cached_path)
+
+        surface = self.cache.load(path)
+        scale = min(size / surface.get_width(), size / surface.get_height(), 1)
+        if scale >= 1:
+            thumbnail = surface.copy()
+        elif surface.get_bitsize() >= 24:  # smoothscale can't do palette images
+            thumbnail = pygame.transform.smoothscale_by(surface, scale)
+        else:
+            thumbnail = pygame.transform.scale_by(surface, scale)
+
+        if cached_path is not None:
+            os.makedirs(self.thumbnail_dir, exist_ok=True)
+            pygame.image.save(thumbnail, cached_path)
+
+        return thumbnail
@@ -0,0 +1,321 @@
+import time
+from collections import deque
+
+"""
+
+Undo / redo for the map maker. Each edit is a Command holding only the values it changed (plus the object they
+belong to), apply() redoes it and revert() undoes it. The history drops its oldest steps once it goes over MAX_STEPS or
+MAX_BYTES, and repeated edits of the same thing in quick succession (e.g. nudging a door a few times) are merged into a
+single step.
+
+Most commands apply / revert in O(1), the exceptions are linear in the size of the layout:
+    AddRoom.revert   - room_layout.remove finds the room by scanning
+    AddObject.revert - app.object_index scans for the object, then every object after it is reindexed
+    MoveObject       - app.object_index scans for the object (chunks loading in can move it, so no stored index)
+
+Commands are pushed after the edit has already been made, the same way the editor always recorded them.
+
+"""
+
+SURFACE_OVERHEAD = 64
+
+
+def surface_bytes(surface) -> int:
+    """ Rough size of a pygame surface, 0 for None """
+    if surface is None:
+        return 0
+
+    return surface.get_width() * surface.get_height() * surface.get_bytesize() + SURFACE_OVERHEAD
+
+
+class Command:
+    name = "command"
+    bytes = 0  # size() when it was pushed
+
+    def apply(self, app):
+        raise NotImplementedError
+
+    def revert(self, app):
+        raise NotImplementedError
+
+    def merge(self, newer: "Command") -> bool:
+        """ Absorb a newer command into this one, returns False if they can't be merged """
+        return False
+
+    def is_noop(self) -> bool:
+        return False
+
+    def size(self) -> int:
+        """ Approximate bytes kept alive only by this step """
+        return SURFACE_OVERHEAD
+
+    def __repr__(self):
+        return f"{self.name} | {vars(self)}"
+
+
+class AddRoom(Command):
+    name = "create-room"
+
+    def __init__(self, room):
+        self.room = room
+
+    def apply(self, app):
+        app.room_layout.append(self.room)
+        app.index_room(self.room)
+
+    def revert(self, app):
+        app.room_layout.remove(self.room)  # Not always the last one, chunked projects add rooms as you scroll
+        app.unindex_room(self.room)
+
+        if app.selected_room is self.room:
+            app.selected_room = None
+            app.selected_room_cache = None
+
+
+class SetRoomValue(Command):
+    """ Any single attribute on a room or one of its doors, re-renders the room afterwards """
+    name = "room-value"
+
+    def __init__(self, room, target, attribute: str, old, new):
+        self.room = room
+        self.target = target
+        self.attribute = attribute
+        self.old = old
+        self.new = new
+
+    def __set(self, app, value):
+        setattr(self.target, self.attribute, value)
+
+        self.room.render_room()
+        app.render_door_creation_points()
+
+    def apply(self, app):
+        self.__set(app, self.new)
+
+    def revert(self, app):
+        self.__set(app, self.old)
+
+    def merge(self, newer: Command) -> bool:
+        if not isinstance(newer, SetRoomValue) or newer.target is not self.target or newer.attribute != self.attribute:
+            return False
+
+        self.new = newer.new
+        return True
+
+    def is_noop(self) -> bool:
+        return self.old == self.new
+
+    def size(self) -> int:
+        if isinstance(self.old, (list, tuple)) and self.old:  # A replaced floor tile ([surface, path])
+            return SURFACE_OVERHEAD + surface_bytes(self.old[0])
+
+        return SURFACE_OVERHEAD
+
+
+class ChangeDoors(Command):
+    """ Adding (or deleting) a door in one of a rooms walls """
+    name = "door"
+
+    def __init__(self, room, wall_index: int, door_index: int, door, added: bool):
+        self.room = room
+        self.wall_index = wall_index
+        self.door_index = door_index
+        self.door = door
+        self.added = added
+
+    def __set(self, app, present: bool):
+        doors = self.room.walls[self.wall_index].doors
+
+        if present:
+            doors.insert(self.door_index, self.door)
+        else:
+            doors.pop(self.door_index)
+
+        self.room.render_room()
+        app.render_door_creation_points()
+
+    def apply(self, app):
+        self.__set(app, self.added)
+
+    def revert(self, app):
+        self.__set(app, not self.added)
+
+
+class AddObject(Command):
+    """
+    Holds the object itself rather than its index, chunked projects insert objects before it as they load in.
+    New objects always go on the end, so redoing one appends it again
+    """
+    name = "new-object"
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def apply(self, app):
+        app.object_layout.append(self.obj)
+        app.index_object(len(app.object_layout) - 1)
+        app.create_object_layer()
+
+    def revert(self, app):
+        index = app.object_index(self.obj)
+
+        app.object_layout.pop(index)
+        app.reindex_objects_from(index, len(app.object_layout) + 1)
+        app.create_object_layer()
+
+
+class MoveObject(Command):
+    name = "object-move"
+
+    def __init__(self, obj, start, end):
+        self.obj = obj
+        self.start = (start[0], start[1])
+        self.end = (end[0], end[1])
+
+    def __move(self, app, pos):
+        self.obj[1][0] = pos[0]
+        self.obj[1][1] = pos[1]
+
+        app.index_object(app.object_index(self.obj))
+        app.create_object_layer()
+
+    def apply(self, app):
+        self.__move(app, self.end)
+
+    def revert(self, app):
+        self.__move(app, self.start)
+
+    def merge(self, newer: Command) -> bool:
+        if not isinstance(newer, MoveObject) or newer.obj is not self.obj:
+            return False
+
+        self.end = newer.end
+        return True
+
+    def is_noop(self) -> bool:
+        return self.start == self.end
+
+
+class MoveLight(Command):
+    name = "light-move"
+
+    def __init__(self, index: int, start, end):
+        self.index = index
+        self.start = (start[0], start[1])
+        self.end = (end[0], end[1])
+
+    def apply(self, app):
+        app.lights[self.index][0] = self.end
+
+    def revert(self, app):
+        app.lights[self.index][0] = self.start
+
+    def merge(self, newer: Command) -> bool:
+        if not isinstance(newer, MoveLight) or newer.index != self.index:
+            return False
+
+        self.end = newer.end
+        return True
+
+    def is_noop(self) -> bool:
+        return self.start == self.end
+
+
+class AddItem(Command):
+    """ Appending to a plain list, lights and switches """
+    def __init__(self, name: str, items: list, item):
+        self.name = name
+        self.items = items
+        self.item = item
+
+    def apply(self, app):
+        self.items.append(self.item)
+
+    def revert(self, app):
+        self.items.pop()
+
+
+class UndoHistory:
+    MAX_STEPS = 500
+    MAX_BYTES = 64_000_000
+    COALESCE_SECONDS = 1.5
+
+    def __init__(self):
+        self.__undo: deque[Command] = deque()
+        self.__redo: list[Command] = []
+        self.__bytes = 0
+        self.__last_push = 0.0
+        self.version = 0  # Bumped on every change to the layout, so the autosave knows when there's something new
+
+    def push(self, command: Command):
+        """ Records a command for an edit that has already been made """
+        if command.is_noop():
+            return
+
+        self.__clear_redo()
+        self.version += 1
+
+        now = time.monotonic()
+        if self.__undo and now - self.__last_push < self.COALESCE_SECONDS:
+            previous = self.__undo[-1]
+
+            if previous.merge(command):
+                self.__last_push = now
+
+                if previous.is_noop():  # Put back how it started, nothing left to undo
+                    self.__bytes -= self.__undo.pop().bytes
+                return
+
+        self.__last_push = now
+
+        command.bytes = command.size()
+        self.__undo.append(command)
+        self.__bytes += command.bytes
+
+        while self.__undo and (len(self.__undo) > self.MAX_STEPS or self.__bytes > self.MAX_BYTES):
+            self.__bytes -= self.__undo.popleft().bytes
+
+    def undo(self, app):
+        if not self.__undo:
+            return
+
+        command = self.__undo.pop()
+        command.revert(app)
+        self.version += 1
+
+        self.__redo.append(command)
+        self.__last_push = 0.0  # Never merge into a step that was undone and redone
+
+    def redo(self, app):
+        if not self.__redo:
+            return
+
+        command = self.__redo.pop()
+        command.apply(app)
+        self.version += 1
+
+        self.__undo.append(command)
+        self.__last_push = 0.0
+
+    def __clear_redo(self):
+        for command in self.__redo:
+            self.__bytes -= command.bytes
+
+        self.__redo.clear()
+
+    def clear(self):
+        self.__undo.clear()
+        self.__redo.clear()
+        self.__bytes = 0
+
+    @property
+    def undo_steps(self) -> list[Command]:
+        return list(self.__undo)
+
+    @property
+    def redo_steps(self) -> list[Command]:
+        return list(self.__redo)
+
+    @property
+    def size(self) -> int:
+        return self.__bytes
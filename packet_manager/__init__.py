@@ -1,3 +1,4 @@
 from .connection import createTCPsocket, createUDPsocket
 from .tcp import ConnectionTCP
-from .udp import ConnectionUDP
\ No newline at end of file
+from .udp import ConnectionUDP
+from .channels import ConnectionChannelUDP, Channel
\ No newline at end of file
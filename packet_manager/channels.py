@@ -0,0 +1,250 @@
+import socket
+import time
+import weakref
+
+from typing import Callable
+
+from .udp import ConnectionUDP
+from .exceptions import ConnectionDroppedError
+
+
+class Channel:
+    """ Delivery guarantees available on a ConnectionChannelUDP """
+    UNRELIABLE = 0            # Fire and forget, may arrive out of order or not at all
+    UNRELIABLE_SEQUENCED = 1  # May be lost, but anything older than the newest packet (of the same type) is dropped
+    RELIABLE_ORDERED = 2      # Resent until acknowledged, delivered in the order it was sent
+
+
+ACK_PACKET_TYPE = "_UDP:Ack"
+
+SEQUENCE_BITS = 32
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+ACK_MASK_BITS = 32  # How many packets past the ack base a single ack can (selectively) acknowledge
+
+
+def sequence_newer(a: int, b: int) -> bool:
+    """ Returns true if sequence 'a' is newer than 'b', handling wrap around """
+    return a != b and ((a - b) & SEQUENCE_MASK) < (1 << (SEQUENCE_BITS - 1))
+
+
+def sequence_distance(a: int, b: int) -> int:
+    """ How many sequence numbers 'a' is ahead of 'b' """
+    return (a - b) & SEQUENCE_MASK
+
+
+class _PeerState:
+    """ Channel bookkeeping for one direction of a connection, only the sending or receiving half is used """
+    def __init__(self):
+        # Sending
+        self.next_sequenced: dict[str, int] = {}
+        self.next_reliable = 0
+        self.pending: dict[int, list] = {}  # seq -> [packet_type, data, first_sent, last_sent]
+
+        # Receiving
+        self.latest_sequenced: dict[bytes, int] = {}
+        self.expected_reliable = 0
+        self.out_of_order: dict[int, tuple[bytes, bytes]] = {}
+        self.ack_required = False
+
+
+class _SocketState:
+    """
+    Every connection sharing a socket (the server uses one UDP socket for all clients) must also share this, as
+    whichever connection drains the socket receives packets (and acks) for all the others
+    """
+    def __init__(self):
+        self.receiving: dict[tuple[str, int], _PeerState] = {}  # By the address packets arrive from
+        self.sending: dict[tuple[str, int], _PeerState] = {}  # Each connections own state, by where it sends to
+
+
+_socket_states: weakref.WeakKeyDictionary[socket.socket, _SocketState] = weakref.WeakKeyDictionary()
+
+
+class ConnectionChannelUDP(ConnectionUDP):
+    """ ConnectionUDP with unreliable, unreliable-sequenced and reliable-ordered channels """
+    HEADER_SIZE = 5  # channel (1) + sequence (4)
+
+    RESEND_INTERVAL = 0.1  # seconds
+    RELIABLE_TIMEOUT = 10  # seconds before an unacknowledged reliable packet drops the connection
+    MAX_OUT_OF_ORDER = 1024
+
+    def __init__(self, sock: socket.socket, target: tuple[str, int], callbacks: dict[bytes, Callable] | None = None,
+                 generic_callback: None | Callable = None):
+        super().__init__(sock, target, callbacks, generic_callback)
+
+        if self.sock not in _socket_states:
+            _socket_states[self.sock] = _SocketState()
+
+        self.__socket = _socket_states[self.sock]
+
+        # Sending state belongs to this connection (not an address), acks find it by the address it sends to
+        self.__peer = _PeerState()
+        self.__socket.sending[self.target_addr] = self.__peer
+
+    def retarget(self, address: tuple[str, int]):
+        """
+        Sends to a new address from now on, e.g. the one the handshake actually came from. Anything not acked yet is
+        resent there, and acks from it are matched to this connection
+        """
+        if self.__socket.sending.get(self.target_addr) is self.__peer:
+            del self.__socket.sending[self.target_addr]
+
+        self.target_addr = address
+        self.__socket.sending[address] = self.__peer
+
+    def close(self):
+        """
+        Forgets this connections channel state, including what was received from its address, so a new connection from
+        the same address starts from scratch. Call when the connection is closed, a reliable timeout calls it itself
+        """
+        if self.__socket.sending.get(self.target_addr) is self.__peer:
+            del self.__socket.sending[self.target_addr]
+
+        self.__socket.receiving.pop(self.target_addr, None)
+        self.__peer.pending.clear()
+
+    def __get_receiving_peer(self, address: tuple[str, int]) -> _PeerState:
+        if address not in self.__socket.receiving:
+            self.__socket.receiving[address] = _PeerState()
+
+        return self.__socket.receiving[address]
+
+    @staticmethod
+    def __header(channel: int, sequence: int) -> bytes:
+        return channel.to_bytes(1, byteorder="big") + sequence.to_bytes(4, byteorder="big")
+
+    # Sending
+    def send(self, packet_type: str, packet_data: bytes, channel: int = Channel.UNRELIABLE):
+        try:
+            self._send_on_channel(packet_type, packet_data, channel)
+        except ConnectionDroppedError:
+            pass
+
+    def _send(self, packet_type: str, packet_data: bytes):
+        self._send_on_channel(packet_type, packet_data, Channel.UNRELIABLE)
+
+    def _send_on_channel(self, packet_type: str, packet_data: bytes, channel: int):
+        peer = self.__peer
+
+        if channel == Channel.UNRELIABLE:
+            sequence = 0
+
+        elif channel == Channel.UNRELIABLE_SEQUENCED:
+            sequence = peer.next_sequenced.get(packet_type, 0)
+            peer.next_sequenced[packet_type] = (sequence + 1) & SEQUENCE_MASK
+
+        elif channel == Channel.RELIABLE_ORDERED:
+            sequence = peer.next_reliable
+            peer.next_reliable = (sequence + 1) & SEQUENCE_MASK
+
+            now = time.time()
+            peer.pending[sequence] = [packet_type, packet_data, now, now]
+
+        else:
+            raise ValueError(f"Unknown channel: {channel}")
+
+        self._send_to(self.target_addr, packet_type, self.__header(channel, sequence) + packet_data)
+
+    def __send_ack(self, address: tuple[str, int], peer: _PeerState):
+        mask = 0
+        for sequence in peer.out_of_order:
+            distance = sequence_distance(sequence, peer.expected_reliable)
+
+            if 0 < distance <= ACK_MASK_BITS:
+                mask |= 1 << (distance - 1)
+
+        self._send_to(address, ACK_PACKET_TYPE,
+                      peer.expected_reliable.to_bytes(4, byteorder="big") + mask.to_bytes(4, byteorder="big"))
+        peer.ack_required = False
+
+    def __resend_unacked(self):
+        now = time.time()
+        peer = self.__peer
+
+        for sequence, entry in peer.pending.items():
+            packet_type, packet_data, first_sent, last_sent = entry
+
+            if now - first_sent > self.RELIABLE_TIMEOUT:
+                self.close()  # Given up on them (so the drop is only reported once) and on the peer
+                self.on_connection_drop()
+                return
+
+            if now - last_sent >= self.RESEND_INTERVAL:
+                self._send_to(self.target_addr, packet_type, self.__header(Channel.RELIABLE_ORDERED, sequence) + packet_data)
+                entry[3] = now
+
+    # Receiving
+    def __on_ack(self, sender, data: bytes):
+        peer = self.__socket.sending.get(sender)
+        if peer is None:
+            return  # Not for any connection on this socket
+
+        ack_base = int.from_bytes(data[:4], byteorder="big")
+        mask = int.from_bytes(data[4:8], byteorder="big")
+
+        for sequence in list(peer.pending):
+            if sequence_newer(ack_base, sequence):  # Everything before the base has been received
+                del peer.pending[sequence]
+                continue
+
+            distance = sequence_distance(sequence, ack_base)
+            if 0 < distance <= ACK_MASK_BITS and mask & (1 << (distance - 1)):
+                del peer.pending[sequence]
+
+    def __on_reliable(self, peer: _PeerState, packet_type: bytes, payload: bytes, sequence: int, sender):
+        peer.ack_required = True
+
+        if sequence == peer.expected_reliable:
+            self.process_packet(packet_type, payload, sender)
+            peer.expected_reliable = (peer.expected_reliable + 1) & SEQUENCE_MASK
+
+            # Release anything that was waiting on this packet
+            while peer.expected_reliable in peer.out_of_order:
+                buffered_type, buffered_payload = peer.out_of_order.pop(peer.expected_reliable)
+                self.process_packet(buffered_type, buffered_payload, sender)
+                peer.expected_reliable = (peer.expected_reliable + 1) & SEQUENCE_MASK
+
+        elif sequence_newer(sequence, peer.expected_reliable):
+            if sequence_distance(sequence, peer.expected_reliable) <= self.MAX_OUT_OF_ORDER:
+                peer.out_of_order[sequence] = (packet_type, payload)
+
+        # else: duplicate of something already delivered, just re-ack it
+
+    def _pre_packet_processing(self, packet_type, packet_bytes, sender):
+        if packet_type == ACK_PACKET_TYPE.encode("utf-8"):
+            return self.__on_ack(sender, packet_bytes)
+
+        if len(packet_bytes) < self.HEADER_SIZE:
+            return None  # Not from a channel connection, ignore it
+
+        peer = self.__get_receiving_peer(sender)
+
+        channel = packet_bytes[0]
+        sequence = int.from_bytes(packet_bytes[1:5], byteorder="big")
+        payload = packet_bytes[5:]
+
+        if channel == Channel.UNRELIABLE:
+            return self.process_packet(packet_type, payload, sender)
+
+        elif channel == Channel.UNRELIABLE_SEQUENCED:
+            latest = peer.latest_sequenced.get(packet_type)
+
+            if latest is not None and not sequence_newer(sequence, latest):
+                return None  # Stale
+
+            peer.latest_sequenced[packet_type] = sequence
+            return self.process_packet(packet_type, payload, sender)
+
+        elif channel == Channel.RELIABLE_ORDERED:
+            return self.__on_reliable(peer, packet_type, payload, sequence, sender)
+
+        return None
+
+    def _process_inbound_messages(self):
+        super()._process_inbound_messages()
+
+        for address, peer in self.__socket.receiving.items():
+            if peer.ack_required:
+                self.__send_ack(address, peer)
+
+        self.__resend_unacked()
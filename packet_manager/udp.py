@@ -36,13 +36,16 @@ class ConnectionUDP(Connection):
         return len(data).to_bytes(8, byteorder="big")
 
     def _send(self, packet_type: str, packet_data: bytes):
-        if self.target_addr == ("", 0):
+        self._send_to(self.target_addr, packet_type, packet_data)
+
+    def _send_to(self, address: tuple[str, int], packet_type: str, packet_data: bytes):
+        if address == ("", 0):
             return
 
         packet_bytes = self.__length_as_bytes(packet_type) + packet_type.encode('utf-8') + self.__length_as_bytes(packet_data) + packet_data
 
         try:
-            self.sock.sendto(packet_bytes, self.target_addr)
+            self.sock.sendto(packet_bytes, address)
 
         except (ConnectionAbortedError, ConnectionResetError):
             self.on_connection_drop()
@@ -1,9 +1,11 @@
+import os
 import socket
 
 from typing import Callable
 
 from .tcp import ConnectionTCP
 from .udp import ConnectionUDP
+from .channels import ConnectionChannelUDP, Channel
 from .connection import createUDPsocket
 
 
@@ -12,12 +14,13 @@ class Client:
     def __on_udp_creation_request(tcp_conn: ConnectionTCP, data: bytes):
         ip = ".".join([str(byte) for byte in list(data[:4])])
         port = int.from_bytes(data[4:8], byteorder="big")
+        token = data[8:]
 
         udp_socket = createUDPsocket()
         udp_socket.connect((ip, port))
 
-        udp_conn = ConnectionUDP(udp_socket, (ip, port))
-        udp_conn.send("_UDP:Handshake", b"OK")
+        udp_conn = ConnectionChannelUDP(udp_socket, (ip, port))
+        udp_conn.send("_UDP:Handshake", b"OK" + token, channel=Channel.RELIABLE_ORDERED)
 
         setattr(tcp_conn, "_udp_conn", udp_conn)
 
@@ -43,14 +46,23 @@ class Client:
 
 
 class PeerServer:
+    TOKEN_SIZE = 8
+
+    # Connections still waiting on their handshake, by token. Every connection shares the servers socket, so the one
+    # that receives a handshake isn't necessarily the one it's for
+    __pending_handshakes: dict[bytes, ConnectionChannelUDP] = {}
+
     @staticmethod
     def __on_udp_handshake(udp_conn: ConnectionUDP, sender_addr: tuple[str, int], data):
-        if data != b"OK":
+        if not data.startswith(b"OK"):
             raise ValueError("Invalid data sent on UDP Handshake packet!")
 
-        #udp_conn.target_addr = sender_addr
-        #udp_conn.remove_callback('_UDP:Handshake')
-        print(udp_conn)
+        connection = PeerServer.__pending_handshakes.pop(data[2:], None)
+        if connection is None:
+            return
+
+        # The client sends from whatever port it was given, not the one it was asked to use
+        connection.retarget(sender_addr)
 
     @staticmethod
     def request_udp_connection(tcp_connection: ConnectionTCP, udp_socket: socket.socket):
@@ -60,10 +72,13 @@ class PeerServer:
         print("Server:", server_ip, port)
         print("Client:", client_ip, p)
 
-        udp_connection = ConnectionUDP(udp_socket, (client_ip, port))
+        udp_connection = ConnectionChannelUDP(udp_socket, (client_ip, port))
         udp_connection.add_packet_callback("_UDP:Handshake", PeerServer.__on_udp_handshake, overwrite=True)
 
-        addr_bytes = bytes(int(chunk) for chunk in server_ip.split(".")) + port.to_bytes(4, byteorder="big")
+        token = os.urandom(PeerServer.TOKEN_SIZE)
+        PeerServer.__pending_handshakes[token] = udp_connection
+
+        addr_bytes = bytes(int(chunk) for chunk in server_ip.split(".")) + port.to_bytes(4, byteorder="big") + token
 
         tcp_connection.send("_TCP:Request_UDP", addr_bytes)
 
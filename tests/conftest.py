@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+"""
+
+Shared setup for the tests. The map maker modules import each other by their bare names (the editor is run from inside
+map_maker), so both the repo root and map_maker need to be importable. Nothing opens a window.
+
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAP_MAKER_DIR = os.path.join(ROOT, "map_maker")
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+for path in (ROOT, MAP_MAKER_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(autouse=True)
+def log_to_tmp(tmp_path, monkeypatch):
+    """ Log.log appends to log/latest.txt in the checkout, keep test runs out of it """
+    from engine import logger
+    monkeypatch.setattr(logger, "ACTIVE_LOG_PATH", str(tmp_path / "latest.txt"))
@@ -0,0 +1,35 @@
+import sys
+import types
+
+"""
+
+Swaps sounddevice's streams for ones that never touch a device, so ProxyChat can be built on machines without audio
+hardware (or without PortAudio at all). Import this before anything from engine.audio_engine.
+
+"""
+
+
+class NullStream:
+    """ Stands in for sd.RawInputStream / sd.RawOutputStream """
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def stub_sounddevice():
+    try:
+        import sounddevice as sd
+    except (ImportError, OSError):  # Not installed, or no PortAudio on this machine
+        sd = types.ModuleType("sounddevice")
+        sys.modules["sounddevice"] = sd
+
+    sd.RawInputStream = NullStream
+    sd.RawOutputStream = NullStream
+
+
+stub_sounddevice()
@@ -0,0 +1,47 @@
+import pygame
+import pytest
+
+from engine.assets import Texture2D, build_mip_chain, scale_from_mips
+
+
+@pytest.fixture
+def texture_path(tmp_path):
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    surface = pygame.Surface((64, 32), pygame.SRCALPHA)
+    surface.fill((200, 100, 50, 255))
+
+    path = str(tmp_path / "texture.png")
+    pygame.image.save(surface, path)
+
+    yield path
+    pygame.display.quit()
+
+
+def test_mip_chain_halves_down_to_min_size():
+    levels = build_mip_chain(pygame.Surface((64, 32)), min_size=8)
+    assert [level.get_size() for level in levels] == [(64, 32), (32, 16), (16, 8)]
+
+
+def test_scale_from_mips_gives_the_requested_size():
+    levels = build_mip_chain(pygame.Surface((64, 32)))
+
+    assert scale_from_mips(levels, 0.25).get_size() == (16, 8)
+    assert scale_from_mips(levels, 0.3).get_size() == (19, 10)
+    assert scale_from_mips(levels, 2).get_size() == (128, 64)
+
+
+def test_scaled_texture_uses_its_own_mips(texture_path):
+    texture = Texture2D(texture_path, 0.5, load_pygame=True, mode="RGBA")
+    other = Texture2D(texture_path, 1, load_pygame=False, mode="RGBA")
+
+    assert texture.get_scaled().get_size() == (32, 16)
+    assert other.mip_levels == []  # Not shared with the first texture
+
+
+def test_texture_without_pygame_surface_falls_back(texture_path):
+    texture = Texture2D(texture_path, 0.5, load_pygame=False, mode="RGBA")
+
+    assert texture.get_scaled() is None
+    assert texture.get_scaled(0.25) is None
@@ -0,0 +1,113 @@
+import json
+
+import project_manager  # NOQA - Imported before autosave, like the editor does
+import autosave
+
+
+def snapshot(rooms=(), objects=(), lights=(), switches=()) -> dict:
+    return {"rooms": list(rooms), "objects": list(objects), "lights": list(lights), "switches": list(switches)}
+
+
+def room(room_id, x=0) -> dict:
+    return {"id": room_id, "position": [x, 0], "shape": [100, 100]}
+
+
+def run_service(jobs) -> autosave.AutosaveService:
+    """ Queues every (kind, path, snapshot) job, then waits for the worker to finish them all """
+    service = autosave.AutosaveService()
+
+    for kind, path, data in jobs:
+        getattr(service, kind)(path, data)
+
+    service.stop()
+    return service
+
+
+def test_diff_then_apply_gives_the_new_snapshot():
+    old = snapshot(rooms=[room(1), room(2), room(3)], lights=[[[0, 0], 1, 100, True, 1]])
+    new = snapshot(rooms=[room(1), room(2, x=50)], objects=[{"position": [1, 2], "path": "a.png"}])
+
+    changes = autosave.diff_snapshots(old, new)
+
+    assert set(changes) == {"rooms", "objects", "lights"}
+    assert list(changes["rooms"]["changed"]) == ["1"]  # Only the moved room is stored
+    assert autosave.apply_diff(old, changes) == new
+
+
+def test_recover_gives_the_last_autosave(tmp_path):
+    path = str(tmp_path / "map.project")
+    states = [snapshot(rooms=[room(i, x=j) for i in range(3)]) for j in range(5)]
+
+    run_service([("autosave", path, state) for state in states])
+
+    assert autosave.recover(path) == {**states[-1], "generation": autosave.recover(path)["generation"]}
+    assert autosave.has_newer_autosave(path)
+
+
+def test_recover_every_step_of_the_journal(tmp_path):
+    path = str(tmp_path / "map.project")
+    service = autosave.AutosaveService()
+
+    for i in range(autosave.FULL_SNAPSHOT_EVERY + 5):  # Past a journal fold
+        state = snapshot(rooms=[room(1, x=i)], lights=[[[i, 0], 1, 100, True, 1]] * (i % 3))
+        service.autosave(path, state)
+        service.stop()  # Waits for the write
+
+        recovered = autosave.recover(path)
+        recovered.pop("generation")
+        assert recovered == state
+
+        service = autosave.AutosaveService()
+
+    service.stop()
+
+
+def test_torn_and_stale_journal_lines_are_ignored(tmp_path):
+    path = str(tmp_path / "map.project")
+    first, second = snapshot(rooms=[room(1)]), snapshot(rooms=[room(1, x=10)])
+
+    service = autosave.AutosaveService()
+    service.autosave(path, first)
+    service.autosave(path, second)
+    service.stop()
+
+    with open(autosave.journal_path(path), "a") as f:
+        f.write(json.dumps({"generation": -1, "changes": autosave.diff_snapshots(second, snapshot())}) + "\n")
+        f.write('{"generation": ')  # Cut off by a crash
+
+    recovered = autosave.recover(path)
+    recovered.pop("generation")
+    assert recovered == second
+
+
+def test_save_writes_the_project_and_removes_autosaves(tmp_path):
+    path = str(tmp_path / "map.project")
+    state = snapshot(rooms=[room(1)])
+
+    run_service([("autosave", path, snapshot()), ("save", path, state)])
+
+    with open(path, "r") as f:
+        assert json.load(f) == state
+
+    assert autosave.recover(path) is None
+
+
+def test_worker_keeps_going_after_a_failed_job(tmp_path):
+    path = str(tmp_path / "map.project")
+    state = snapshot(rooms=[room(1)])
+
+    service = run_service([
+        ("save", path, snapshot(rooms=[object()])),  # Can't be written as JSON
+        ("save", path, state),
+    ])
+
+    with open(path, "r") as f:
+        assert json.load(f) == state
+
+    assert service.error is None  # Cleared by the save that worked
+
+
+def test_failed_job_is_reported(tmp_path):
+    service = run_service([("save", str(tmp_path / "map.project"), snapshot(rooms=[object()]))])
+
+    assert isinstance(service.error, TypeError)
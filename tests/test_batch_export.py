@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import MAP_MAKER_DIR
+
+import batch_export
+import project_manager
+
+OPTIONS = {"occlusion": True, "height_format": "float32"}
+
+
+@pytest.fixture
+def project_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(MAP_MAKER_DIR)
+    path = str(tmp_path / "map.project")
+
+    project_manager.write_project(path, {
+        "rooms": (),
+        "objects": ({"position": (0, 0), "size": (16, 16), "path": "../data/textures/demo_object@0.5.png"},),
+        "lights": (),
+        "switches": ()
+    })
+    return path
+
+
+def test_hash_is_stable(project_path):
+    assert batch_export.content_hash(project_path, OPTIONS) == batch_export.content_hash(project_path, dict(OPTIONS))
+
+
+def test_hash_changes_with_options(project_path):
+    assert batch_export.content_hash(project_path, OPTIONS) != \
+        batch_export.content_hash(project_path, {**OPTIONS, "height_format": "uint8"})
+
+
+def test_hash_changes_with_exporter_version(project_path, monkeypatch):
+    before = batch_export.content_hash(project_path, OPTIONS)
+    monkeypatch.setattr(project_manager, "EXPORTER_VERSION", project_manager.EXPORTER_VERSION + 1)
+
+    assert batch_export.content_hash(project_path, OPTIONS) != before
+
+
+def test_hash_covers_engine_format_modules(project_path, tmp_path, monkeypatch):
+    """ A copy of light_table.py stands in for it, so editing the copy is editing the format """
+    copy = tmp_path / "light_table.py"
+    monkeypatch.setattr(batch_export, "EXPORTER_FILES",
+                        tuple(str(copy) if path == batch_export.light_table.__file__ else path
+                              for path in batch_export.EXPORTER_FILES))
+
+    with open(batch_export.light_table.__file__, "rb") as f:
+        source = f.read()
+
+    copy.write_bytes(source)
+    before = batch_export.content_hash(project_path, OPTIONS)
+
+    copy.write_bytes(source + b"\n# changed\n")
+    assert batch_export.content_hash(project_path, OPTIONS) != before
@@ -0,0 +1,173 @@
+import time
+
+from packet_manager import createTCPsocket, createUDPsocket, ConnectionTCP, ConnectionChannelUDP, Channel
+from packet_manager import udp_handshake, channels
+
+
+def pump(connections, condition, timeout=5.0):
+    """ Updates every connection until condition() is true """
+    end = time.time() + timeout
+    while time.time() < end:
+        for connection in connections:
+            connection.update()
+
+        if condition():
+            return True
+
+        time.sleep(0.005)
+
+    return False
+
+
+def handshake_pair():
+    """ A server and client ConnectionChannelUDP set up through the real TCP + UDP handshake, over loopback """
+    listener = createTCPsocket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    client_tcp_sock = createTCPsocket()
+    client_tcp_sock.connect(listener.getsockname())
+    server_tcp_sock, _ = listener.accept()
+    listener.close()
+
+    server_tcp = ConnectionTCP(server_tcp_sock)
+    client_tcp = ConnectionTCP(client_tcp_sock)
+
+    server_udp_sock = createUDPsocket()
+    server_udp_sock.bind(("127.0.0.1", 0))
+
+    udp_handshake.Client.enable_udp_creation(client_tcp)
+    server = udp_handshake.PeerServer.request_udp_connection(server_tcp, server_udp_sock)
+
+    assert pump([client_tcp], lambda: udp_handshake.Client.get_udp_from_tcp(client_tcp) is not None)
+    client = udp_handshake.Client.get_udp_from_tcp(client_tcp)
+
+    # The handshake is reliable, so the server has it (and retargeted) once the client's copy is acked
+    assert pump([server, client], lambda: server.target_addr == client.sock.getsockname())
+
+    return server, client, (server_tcp, client_tcp)
+
+
+def test_reliable_ordered_both_ways_over_loopback():
+    server, client, _ = handshake_pair()
+
+    to_client, to_server = [], []
+    client.add_packet_callback("test", lambda conn, sender, data: to_client.append(data))
+    server.add_packet_callback("test", lambda conn, sender, data: to_server.append(data))
+
+    for i in range(20):
+        server.send("test", i.to_bytes(2, byteorder="big"), channel=Channel.RELIABLE_ORDERED)
+        client.send("test", i.to_bytes(2, byteorder="big"), channel=Channel.RELIABLE_ORDERED)
+
+    assert pump([server, client], lambda: len(to_client) == 20 and len(to_server) == 20)
+    assert [int.from_bytes(data, byteorder="big") for data in to_client] == list(range(20))
+    assert [int.from_bytes(data, byteorder="big") for data in to_server] == list(range(20))
+
+    # Both sides got their acks, nothing is left to resend
+    assert pump([server, client], lambda: not pending(server) and not pending(client))
+
+
+def pending(connection: ConnectionChannelUDP) -> dict:
+    return connection._ConnectionChannelUDP__peer.pending
+
+
+def loopback_pair():
+    """ Two channel connections pointed at each other, without the handshake """
+    a_sock, b_sock = createUDPsocket(), createUDPsocket()
+    a_sock.bind(("127.0.0.1", 0))
+    b_sock.bind(("127.0.0.1", 0))
+
+    return ConnectionChannelUDP(a_sock, b_sock.getsockname()), ConnectionChannelUDP(b_sock, a_sock.getsockname())
+
+
+def test_reliable_out_of_order_is_delivered_in_order():
+    a, b = loopback_pair()
+
+    received = []
+    b.add_packet_callback("test", lambda conn, sender, data: received.append(data))
+
+    a._ConnectionChannelUDP__peer.next_reliable = 1  # 0 is "lost", it's sent last
+    a.send("test", b"1", channel=Channel.RELIABLE_ORDERED)
+    a.send("test", b"2", channel=Channel.RELIABLE_ORDERED)
+
+    pump([b], lambda: False, timeout=0.1)
+    assert received == []  # Held back waiting on 0
+
+    # 1 and 2 were selectively acked, so only they are gone from the sender
+    pump([a], lambda: False, timeout=0.1)
+    assert pending(a) == {}
+
+    a._ConnectionChannelUDP__peer.next_reliable = 0
+    a.send("test", b"0", channel=Channel.RELIABLE_ORDERED)
+
+    assert pump([b], lambda: len(received) == 3)
+    assert received == [b"0", b"1", b"2"]
+
+
+def test_unreliable_sequenced_drops_stale_packets():
+    a, b = loopback_pair()
+
+    received = []
+    b.add_packet_callback("state", lambda conn, sender, data: received.append(data))
+
+    a.send("state", b"new", channel=Channel.UNRELIABLE_SEQUENCED)
+    a._ConnectionChannelUDP__peer.next_sequenced["state"] = 0  # Next send reuses an older sequence
+    a.send("state", b"old", channel=Channel.UNRELIABLE_SEQUENCED)
+
+    pump([b], lambda: False, timeout=0.1)
+    assert received == [b"new"]
+
+
+def test_reliable_timeout_drops_connection_once():
+    a, b = loopback_pair()
+    receiving = channels._socket_states[a.sock].receiving
+
+    b.send("hello", b"")
+    assert pump([a], lambda: a.target_addr in receiving)
+
+    drops = []
+    a.set_connection_drop_callback(lambda: drops.append(1))
+
+    a.send("test", b"x", channel=Channel.RELIABLE_ORDERED)
+    for entry in pending(a).values():
+        entry[2] -= ConnectionChannelUDP.RELIABLE_TIMEOUT + 1
+
+    for _ in range(3):
+        a.update()
+
+    assert drops == [1]
+    assert pending(a) == {}
+    assert a.target_addr not in receiving  # Forgotten along with the connection
+
+
+def test_close_forgets_the_peer_so_a_reconnect_starts_fresh():
+    a, b = loopback_pair()
+
+    received = []
+    b.add_packet_callback("test", lambda conn, sender, data: received.append(data))
+
+    for i in range(3):
+        a.send("test", bytes([i]), channel=Channel.RELIABLE_ORDERED)
+    assert pump([a, b], lambda: len(received) == 3 and not pending(a))
+
+    b.close()
+    assert channels._socket_states[b.sock].receiving == {}
+    assert channels._socket_states[b.sock].sending == {}
+
+    # Reconnecting from the same address, sequences start at 0 again
+    reconnected = ConnectionChannelUDP(a.sock, a.target_addr)
+    reconnected.send("test", b"again", channel=Channel.RELIABLE_ORDERED)
+
+    new_b = ConnectionChannelUDP(b.sock, b.target_addr)
+    new_b.add_packet_callback("test", lambda conn, sender, data: received.append(data))
+
+    assert pump([reconnected, new_b], lambda: len(received) == 4)
+    assert received[-1] == b"again"
+
+
+def test_junk_packets_dont_create_peer_state():
+    a, b = loopback_pair()
+    a._send_to(a.target_addr, "junk", b"")
+
+    pump([b], lambda: False, timeout=0.1)
+    assert channels._socket_states[b.sock].receiving == {}
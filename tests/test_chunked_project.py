@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from conftest import MAP_MAKER_DIR
+
+import project_manager
+
+OBJECT_PATH = "../data/textures/demo_object@0.5.png"
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    """ Rooms and objects scattered over a 4x4 grid of chunks, saved out of chunk order on purpose """
+    monkeypatch.chdir(MAP_MAKER_DIR)
+    rng = random.Random(0)
+    size = project_manager.CHUNK_SIZE
+
+    rooms = tuple(
+        {
+            "id": room_id,
+            "position": (rng.randrange(4) * size + 10, rng.randrange(4) * size + 10),
+            "shape": (100, 80),
+            "colour": (200, 200, 200),
+            "floor_tile": None,
+            "is_hiding_spot": False,
+            "walls": (None, None, None, None)
+        }
+        for room_id in range(1, 21)
+    )
+    objects = tuple(
+        {
+            "position": (rng.randrange(4 * size), rng.randrange(4 * size)),
+            "size": (16, 16),
+            "path": OBJECT_PATH
+        }
+        for _ in range(40)
+    )
+
+    return {"rooms": rooms, "objects": objects, "lights": (), "switches": ()}
+
+
+def room_ids(rooms) -> list:
+    return [room.room_id for room in rooms]
+
+
+def object_positions(objects) -> list:
+    return [tuple(obj[1]) for obj in objects]
+
+
+def insert_pairs(layout: list, pairs: list):
+    """ What the editor does with the pairs from load_region """
+    for index, entity in pairs:
+        layout.insert(index, entity)
+
+
+def test_load_project_keeps_saved_order(tmp_path, snapshot):
+    path = str(tmp_path / "map.cproject")
+    project_manager.write_chunked_project(path, snapshot)
+
+    rooms, objects, _, _ = project_manager.load_project(path)
+
+    assert room_ids(rooms) == [room["id"] for room in snapshot["rooms"]]
+    assert object_positions(objects) == [obj["position"] for obj in snapshot["objects"]]
+
+
+def test_streamed_regions_insert_in_saved_order(tmp_path, snapshot):
+    path = str(tmp_path / "map.cproject")
+    project_manager.write_chunked_project(path, snapshot)
+    size = project_manager.CHUNK_SIZE
+
+    regions = [(x * size, y * size) for x in range(4) for y in range(4)]
+    random.Random(1).shuffle(regions)
+
+    rooms, objects = [], []
+    with project_manager.ChunkedProject(path) as project:
+        for x, y in regions:
+            new_rooms, new_objects = project.load_region(x, y, 1, 1)
+            insert_pairs(rooms, new_rooms)
+            insert_pairs(objects, new_objects)
+
+            assert room_ids(rooms) == sorted(room_ids(rooms))  # Ids were handed out in saved order
+
+        assert project.fully_loaded
+
+    assert room_ids(rooms) == [room["id"] for room in snapshot["rooms"]]
+    assert object_positions(objects) == [obj["position"] for obj in snapshot["objects"]]
+
+
+def test_merge_unloaded_saves_in_original_order(tmp_path, snapshot):
+    path = str(tmp_path / "map.cproject")
+    project_manager.write_chunked_project(path, snapshot)
+    size = project_manager.CHUNK_SIZE
+
+    rooms, objects = [], []
+    with project_manager.ChunkedProject(path) as project:
+        for x, y in ((3 * size, 0), (0, 2 * size), (size, size)):
+            new_rooms, new_objects = project.load_region(x, y, 1, 1)
+            insert_pairs(rooms, new_rooms)
+            insert_pairs(objects, new_objects)
+
+        assert not project.fully_loaded
+
+        objects.append(project_manager.object_from_data({"position": (5, 5), "path": OBJECT_PATH}))
+        partial = project_manager.snapshot_project(rooms, objects, [], [])
+        merged = project.merge_unloaded(partial)
+
+    assert [room["id"] for room in merged["rooms"]] == [room["id"] for room in snapshot["rooms"]]
+    assert [tuple(obj["position"]) for obj in merged["objects"]] == \
+        [obj["position"] for obj in snapshot["objects"]] + [(5, 5)]
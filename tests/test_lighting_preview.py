@@ -0,0 +1,56 @@
+import numpy as np
+import pygame
+import pytest
+
+from conftest import MAP_MAKER_DIR
+
+pytest.importorskip("pyopencl")
+
+import project_manager  # NOQA: E402 - Before maker_v2, they import each other
+import maker_v2  # NOQA: E402
+import lighting_preview  # NOQA: E402
+
+
+@pytest.fixture
+def preview(monkeypatch):
+    monkeypatch.chdir(MAP_MAKER_DIR)  # Kernels are found relative to map_maker
+    pygame.display.set_mode((10, 10))
+
+    try:
+        return lighting_preview.LightingPreview()
+    except Exception as e:  # No OpenCL platform / CPU device on this machine
+        pytest.skip(f"No OpenCL CPU device: {e}")
+
+
+def rooms() -> list:
+    return [maker_v2.Room(1, 0, 0, 200, 100, (10, 10, 10)), maker_v2.Room(2, 200, 50, 100, 100, (10, 10, 10))]
+
+
+def test_removing_every_light_clears_the_map(preview):
+    room_layout = rooms()
+
+    preview.update(room_layout, [], [[(100.0, 50.0), 0.8, 1000, True, 1]])  # Covers the whole map, (0, 0) included
+    assert preview.read_light_map()[0, 0] > 0
+
+    preview.update(room_layout, [], [])
+    light_map = preview.read_light_map()
+
+    assert np.isfinite(light_map).all()
+    assert not light_map.any()
+
+
+def test_zero_radius_lights_are_ignored(preview):
+    room_layout = rooms()
+
+    preview.update(room_layout, [], [[(100.0, 50.0), 0.8, 1000, True, 1]])
+    preview.update(room_layout, [], [[(100.0, 50.0), 0.8, 0, True, 1]])
+
+    light_map = preview.read_light_map()
+    assert np.isfinite(light_map).all()
+    assert not light_map.any()
+
+
+def test_no_lights_pass_a_count_of_zero(preview):
+    """ The kernel divides by each lights radius, the placeholder row it's given when there are none must go unread """
+    _, count = preview._LightingPreview__light_data([[(5.0, 5.0), 0.8, 0, True, 1]])
+    assert count == 0
@@ -0,0 +1,158 @@
+import json
+import os
+import types
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, MAP_MAKER_DIR
+
+import project_manager
+from engine.map import Map, LoadedMap
+from engine.light_table import LightTable
+
+
+class RecordingRenderEngine:
+    """ Just enough of the render engine for LoadedMap, remembers every texture path it was asked to load """
+    def __init__(self):
+        self.paths = []
+
+    def load_texture(self, path, *args, **kwargs) -> int:
+        self.paths.append(path)
+        return len(self.paths) - 1
+
+    def get_asset(self, asset_id):
+        return types.SimpleNamespace(pygame_surface=None)
+
+
+@pytest.fixture
+def demo_layout(monkeypatch):
+    """ demo.project, with its texture paths pointed at this checkout. Runs from map_maker, like the editor """
+    monkeypatch.chdir(MAP_MAKER_DIR)
+
+    with open(os.path.join(ROOT, "demo.project"), "r") as f:
+        text = f.read().replace("E:/Python/2D phas v2/Ghost-Hunting-Game/", "../")
+
+    return project_manager.project_from_data(json.loads(text))
+
+
+def load_map(path, tmp_path) -> LoadedMap:
+    """ LoadedMap without its constructor, which wipes the real data/temp/map. Images go to tmp_path / "images" """
+    loaded = LoadedMap.__new__(LoadedMap)
+    Map.__init__(loaded, RecordingRenderEngine())
+
+    loaded.temp_path = str(tmp_path / "images")
+    os.makedirs(loaded.temp_path, exist_ok=True)
+    loaded.temp_load_cache = {}
+    loaded.images_loaded = 0
+
+    loaded.load(str(path))
+    return loaded
+
+
+def export_version(layout, path, version: int):
+    room_layout, object_layout, lights, switches = layout
+    project_manager.export(str(path), room_layout, object_layout, lights, switches, processes=1, version=version)
+
+
+def table_pixels(table: LightTable, light_count: int) -> list[set]:
+    return [set(zip(*(axis.tolist() for axis in table.pixels_of(light_id)))) for light_id in range(light_count)]
+
+
+def test_light_table_matches_dense_ids():
+    rng = np.random.default_rng(0)
+    dense = np.zeros((37, 53), dtype=np.uint64)
+
+    for light_id in range(5):
+        dense[rng.random(dense.shape) < 0.3] |= np.uint64(1 << light_id)
+
+    table = LightTable.from_dense(dense)
+
+    for y in range(dense.shape[0]):
+        for x in range(dense.shape[1]):
+            expected = [light_id for light_id in range(64) if int(dense[y, x]) & (1 << light_id)]
+            assert table.lights_at(x, y) == expected
+
+
+def test_light_table_write_read_round_trip(tmp_path):
+    dense = np.zeros((40, 20), dtype=np.uint64)
+    dense[5:30, 2:15] |= np.uint64(1)
+    dense[20:40, 10:20] |= np.uint64(1 << 3)
+    table = LightTable.from_dense(dense)
+
+    with open(tmp_path / "table.bin", "wb") as f:
+        table.write(f)
+
+    with open(tmp_path / "table.bin", "rb") as f:
+        read = LightTable.read(f)
+
+    assert read.shape == table.shape
+    assert np.array_equal(read.tile_offsets, table.tile_offsets)
+    assert np.array_equal(read.light_ids, table.light_ids)
+    assert np.array_equal(read.masks, table.masks)
+
+
+@pytest.mark.parametrize("version", [2, 3])
+def test_legacy_light_ids_become_a_table_only_when_asked_for(demo_layout, tmp_path, version):
+    export_version(demo_layout, tmp_path / "v4.bin", 4)
+    export_version(demo_layout, tmp_path / "legacy.bin", version)
+
+    light_count = len(demo_layout[2])
+    expected = table_pixels(load_map(tmp_path / "v4.bin", tmp_path).get_light_table(), light_count)
+
+    legacy = load_map(tmp_path / "legacy.bin", tmp_path)
+    assert legacy._Map__maps["light-table"] is None  # Not built while loading
+
+    assert table_pixels(legacy.get_light_table(), light_count) == expected
+    assert legacy.get_light_table() is legacy.get_light_table()
+
+
+def test_identical_images_are_embedded_once(demo_layout, tmp_path):
+    """ Objects sharing a path, or an identical image under another path, come back through the load cache """
+    room_layout, object_layout, lights, switches = demo_layout
+    img, pos, path = object_layout[0]
+
+    copy_path = str(tmp_path / os.path.basename(path))
+    with open(path, "rb") as src, open(copy_path, "wb") as dst:
+        dst.write(src.read())
+
+    object_layout = object_layout + [[img, [pos[0] + 50, pos[1]], path], [img, [pos[0], pos[1] + 50], copy_path]]
+    export_version((room_layout, object_layout, lights, switches), tmp_path / "map.bin", 4)
+
+    loaded = load_map(tmp_path / "map.bin", tmp_path)
+
+    unique_images = {project_manager.encode_image(obj[2]) for obj in object_layout}
+    assert len(os.listdir(loaded.temp_path)) == len(unique_images) + 1  # And the background
+    assert len(loaded.temp_load_cache) == len(unique_images)
+    assert loaded.images_loaded == len(object_layout)
+
+
+def test_png_files_are_passed_through(demo_layout):
+    path = demo_layout[1][0][2]
+
+    with open(path, "rb") as f:
+        assert project_manager.encode_image(path) == f.read()
+
+
+@pytest.mark.parametrize("version", [2, 3])
+def test_legacy_versions_load_the_same_maps(demo_layout, tmp_path, version):
+    export_version(demo_layout, tmp_path / "v4.bin", 4)
+    export_version(demo_layout, tmp_path / "legacy.bin", version)
+
+    current = load_map(tmp_path / "v4.bin", tmp_path)
+    legacy = load_map(tmp_path / "legacy.bin", tmp_path)
+
+    assert np.array_equal(legacy.compute_height_map(), current.compute_height_map())
+    assert np.array_equal(legacy.compute_light_map(), current.compute_light_map())
+    assert [obj["position"] for obj in legacy.scene.values()] == [obj["position"] for obj in current.scene.values()]
+    assert legacy.get_lights() == current.get_lights()
+
+
+def test_parallel_export_matches_export(demo_layout, tmp_path):
+    room_layout, object_layout, lights, switches = demo_layout
+
+    project_manager.export(str(tmp_path / "serial.bin"), room_layout, object_layout, lights, switches, processes=1)
+    project_manager.export_parallel(str(tmp_path / "parallel.bin"), room_layout, object_layout, lights, switches,
+                                    processes=2)
+
+    assert (tmp_path / "serial.bin").read_bytes() == (tmp_path / "parallel.bin").read_bytes()
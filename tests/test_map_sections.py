@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+
+from engine import map_sections
+from engine.map_sections import write_section, read_section
+
+
+def sample(dtype) -> np.ndarray:
+    """ Runs of repeats with some noise, so both the raw and run-length paths get real data """
+    rng = np.random.default_rng(0)
+    array = np.repeat(rng.integers(0, 200, size=(30, 8)), 5, axis=1).astype(dtype)
+    array[rng.random(array.shape) < 0.05] = 7
+    return array
+
+
+def round_trip(array: np.ndarray, **kwargs) -> tuple[np.ndarray, int]:
+    """ (read array, flags written) """
+    f = io.BytesIO()
+    write_section(f, array, **kwargs)
+
+    flags = f.getvalue()[9]
+    f.seek(0)
+    read = read_section(f)
+
+    assert f.read() == b""  # Reads exactly the section
+    return read, flags
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.uint8, np.uint16, np.uint32, np.uint64])
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("rle", [True, False, None])
+@pytest.mark.parametrize("narrow", [True, False])
+def test_round_trip(dtype, compress, rle, narrow):
+    array = sample(dtype)
+    read, flags = round_trip(array, compress=compress, rle=rle, narrow=narrow)
+
+    assert read.dtype == array.dtype
+    assert np.array_equal(read, array)
+    read[0, 0] = 1  # Writable
+
+    assert bool(flags & map_sections.FLAG_LZ4) == compress
+    if rle is not None:
+        assert bool(flags & map_sections.FLAG_RLE) == rle
+    if not narrow or dtype in (np.float32, np.uint8):
+        assert not flags & map_sections.FLAG_NARROW
+
+
+def test_narrows_to_the_smallest_dtype():
+    array = np.zeros((4, 4), dtype=np.uint64)
+    array[1, 2] = 300
+
+    f = io.BytesIO()
+    write_section(f, array, compress=False, rle=False)
+
+    assert f.getvalue()[10] == map_sections.DTYPE_CODES[np.dtype("<u2")]
+    assert len(f.getvalue()) == 27 + array.size * 2
+
+    f.seek(0)
+    assert np.array_equal(read_section(f), array)
+
+
+def test_full_range_values_keep_their_dtype():
+    array = np.full((3, 3), np.iinfo(np.uint64).max, dtype=np.uint64)
+    read, flags = round_trip(array)
+
+    assert not flags & map_sections.FLAG_NARROW
+    assert np.array_equal(read, array)
+
+
+def test_empty_array():
+    read, _ = round_trip(np.zeros((0, 5), dtype=np.uint32))
+    assert read.shape == (0, 5)
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        write_section(io.BytesIO(), np.zeros((2, 2), dtype=np.int16))
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_truncated_section(compress):
+    f = io.BytesIO()
+    write_section(f, sample(np.uint32), compress=compress)
+
+    with pytest.raises(EOFError):
+        read_section(io.BytesIO(f.getvalue()[:-3]))
@@ -0,0 +1,88 @@
+import null_audio  # NOQA - Must come before the engine imports
+from engine.network import Server, Player
+from engine.audio_engine import PCMCodec, MuLawCodec, OpusCodec
+from packet_manager import Channel
+
+
+class FakeUDP:
+    """ Records what the server sends a player, and lets the test trigger its connection drop """
+    def __init__(self):
+        self.sent = []
+        self.drop_callback = None
+        self.closed = False
+
+    def send(self, packet_type, data, channel=Channel.UNRELIABLE):
+        self.sent.append((packet_type, data, channel))
+
+    def set_connection_drop_callback(self, callback):
+        self.drop_callback = callback
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTCP:
+    def __init__(self, player_index):
+        self._player_index = player_index
+        self.sock = self
+
+    def close(self):
+        pass
+
+
+def lobby(player_codecs: list) -> tuple[Server, list]:
+    """ A server (without any sockets) with a player per entry of player_codecs, each already sent their codecs """
+    server = Server.__new__(Server)
+    server.players = [Player() for _ in player_codecs]
+    server.connections = []
+    server._Server__addr_lookup = {}
+    server._Server__voice_connections = {}
+    server._Server__voice_codecs = {}
+
+    udps = []
+    for index, codecs in enumerate(player_codecs):
+        udp = FakeUDP()
+        server.connections.append([FakeTCP(index), udp])
+        server._Server__addr_lookup[f"10.0.0.{index}"] = index
+        server._Server__voice_connections[index] = udp
+        udp.set_connection_drop_callback(lambda index=index: server._Server__forget_voice_player(index))
+        udps.append(udp)
+
+    for index, codecs in enumerate(player_codecs):
+        server.on_voice_codecs(udps[index], (f"10.0.0.{index}", 1000), bytes(codecs))
+
+    return server, udps
+
+
+def last_codecs(udp: FakeUDP) -> set:
+    packet_type, data, channel = udp.sent[-1]
+    assert packet_type == "voice_codecs" and channel == Channel.RELIABLE_ORDERED
+    return set(data)
+
+
+OPUS, MULAW, PCM = OpusCodec.codec_id, MuLawCodec.codec_id, PCMCodec.codec_id
+
+
+def test_lobby_is_told_the_common_codecs():
+    _, udps = lobby([[OPUS, MULAW, PCM], [MULAW, PCM]])
+    assert all(last_codecs(udp) == {MULAW, PCM} for udp in udps)
+
+
+def test_renegotiates_when_a_player_disconnects():
+    server, udps = lobby([[OPUS, MULAW], [OPUS, MULAW], [MULAW]])
+
+    server.on_disconnect(server.connections[2][0], b"")
+
+    assert udps[2].closed
+    assert last_codecs(udps[0]) == last_codecs(udps[1]) == {OPUS, MULAW}
+    assert len(udps[2].sent) == 3  # Nothing more for the player who left
+
+
+def test_renegotiates_when_a_player_times_out():
+    server, udps = lobby([[OPUS, MULAW], [MULAW]])
+
+    udps[1].drop_callback()
+    assert last_codecs(udps[0]) == {OPUS, MULAW}
+
+    udps[1].drop_callback()  # Already gone, nothing to renegotiate
+    assert len(udps[0].sent) == 3
@@ -0,0 +1,59 @@
+import pygame
+
+from maker_v2 import ScaledSurfaceCache
+
+
+def surface(width, height=1) -> pygame.Surface:
+    return pygame.Surface((width, height))
+
+
+def test_hits_until_the_owner_is_re_rendered():
+    cache = ScaledSurfaceCache(1000)
+    made = []
+
+    def create():
+        made.append(surface(10))
+        return made[-1]
+
+    first = cache.get(1, 0, 0.5, create)
+    assert cache.get(1, 0, 0.5, create) is first
+    cache.get(1, 0, 2, create)
+    assert cache.pixels == 20
+
+    cache.get(1, 1, 0.5, create)  # New rendering, both old scales go
+    assert len(made) == 3
+    assert cache.pixels == 10
+
+
+def test_only_counts_and_keeps_scaled_copies():
+    cache = ScaledSurfaceCache(1000)
+    source = surface(500, 500)
+
+    cache.get(1, 0, 0.1, lambda: pygame.transform.scale(source, (50, 5)))
+    assert cache.pixels == 250
+
+
+def test_evicts_least_recently_used_past_max_pixels():
+    cache = ScaledSurfaceCache(30)
+
+    for owner in range(3):
+        cache.get(owner, 0, 1, lambda: surface(10))
+
+    cache.get(0, 0, 1, lambda: surface(10))  # Used again, so owner 1 is now the oldest
+    cache.get(3, 0, 1, lambda: surface(10))
+
+    assert cache.pixels == 30
+    replacement = surface(10)
+    assert cache.get(1, 0, 1, lambda: replacement) is replacement
+
+
+def test_discard():
+    cache = ScaledSurfaceCache(1000)
+    cache.get(1, 0, 1, lambda: surface(10))
+    cache.get(1, 0, 2, lambda: surface(20))
+    cache.get(2, 0, 1, lambda: surface(5))
+
+    cache.discard(1)
+    cache.discard(7)  # Never cached, nothing to do
+
+    assert cache.pixels == 5
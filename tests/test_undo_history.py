@@ -0,0 +1,181 @@
+import pytest
+
+import undo_history
+from undo_history import UndoHistory, Command, MoveLight, AddItem, AddObject, MoveObject
+
+
+class FakeApp:
+    """ The bits of the editor the light / item / object commands touch """
+    def __init__(self):
+        self.lights = [[(0, 0), 1, 100, True, 1], [(5, 5), 1, 100, True, 1]]
+        self.switches = []
+        self.object_layout = []
+        self.indexed = []
+
+    def object_index(self, obj) -> int:
+        return next(i for i, other in enumerate(self.object_layout) if other is obj)
+
+    def index_object(self, index: int):
+        self.indexed.append(index)
+
+    def reindex_objects_from(self, index: int, old_count: int):
+        self.indexed.extend(range(index, len(self.object_layout)))
+
+    def create_object_layer(self):
+        pass
+
+
+class Sized(Command):
+    name = "sized"
+
+    def __init__(self, bytes_held: int):
+        self.bytes_held = bytes_held
+
+    def apply(self, app):
+        pass
+
+    def revert(self, app):
+        pass
+
+    def size(self) -> int:
+        return self.bytes_held
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ time.monotonic as seen by the history, only moves when told to """
+    now = [1000.0]
+    monkeypatch.setattr(undo_history.time, "monotonic", lambda: now[0])
+    return now
+
+
+def move_light(app, history, index, end):
+    start = app.lights[index][0]
+    app.lights[index][0] = end
+    history.push(MoveLight(index, start, end))
+
+
+def test_undo_redo(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    move_light(app, history, 0, (10, 10))
+    clock[0] += 10
+    move_light(app, history, 1, (20, 20))
+
+    history.undo(app)
+    assert app.lights[1][0] == (5, 5)
+    history.undo(app)
+    assert app.lights[0][0] == (0, 0)
+    history.undo(app)  # Nothing left, does nothing
+
+    history.redo(app)
+    history.redo(app)
+    assert [light[0] for light in app.lights] == [(10, 10), (20, 20)]
+    assert history.version == 6
+
+
+def test_quick_edits_of_the_same_thing_merge(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    for x in range(1, 6):
+        move_light(app, history, 0, (x, 0))
+        clock[0] += 0.5
+
+    assert len(history.undo_steps) == 1
+    history.undo(app)
+    assert app.lights[0][0] == (0, 0)
+
+
+def test_slow_or_different_edits_dont_merge(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    move_light(app, history, 0, (1, 0))
+    clock[0] += UndoHistory.COALESCE_SECONDS + 0.1
+    move_light(app, history, 0, (2, 0))
+    move_light(app, history, 1, (3, 0))
+
+    assert len(history.undo_steps) == 3
+
+
+def test_no_merge_into_an_undone_step(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    move_light(app, history, 0, (1, 0))
+    history.undo(app)
+    history.redo(app)
+    move_light(app, history, 0, (2, 0))
+
+    assert len(history.undo_steps) == 2
+
+
+def test_noops_are_dropped(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    history.push(MoveLight(0, (0, 0), (0, 0)))
+    assert history.undo_steps == [] and history.version == 0
+
+    move_light(app, history, 0, (4, 4))
+    move_light(app, history, 0, (0, 0))  # Merged back to where it started
+    assert history.undo_steps == []
+    assert history.size == 0
+
+
+def test_new_edit_clears_redo(clock):
+    app, history = FakeApp(), UndoHistory()
+
+    history.push(Sized(100))
+    clock[0] += 10
+    history.push(Sized(200))
+    history.undo(app)
+    assert history.size == 300
+
+    history.push(AddItem("new-switch", app.switches, (0, 0, 1, 0, 1)))
+    assert history.redo_steps == []
+    assert history.size == 100 + undo_history.SURFACE_OVERHEAD
+
+
+def test_trims_to_max_steps(clock, monkeypatch):
+    monkeypatch.setattr(UndoHistory, "MAX_STEPS", 5)
+    history = UndoHistory()
+
+    commands = [Sized(10) for _ in range(8)]
+    for command in commands:
+        history.push(command)
+
+    assert history.undo_steps == commands[-5:]
+    assert history.size == 50
+
+
+def test_trims_to_max_bytes(clock, monkeypatch):
+    monkeypatch.setattr(UndoHistory, "MAX_BYTES", 1000)
+    history = UndoHistory()
+
+    for bytes_held in (400, 400, 400, 100):
+        history.push(Sized(bytes_held))
+
+    assert [command.bytes_held for command in history.undo_steps] == [400, 400, 100]
+    assert history.size == 900
+
+
+def test_object_commands_follow_the_object_not_its_index(clock):
+    app, history = FakeApp(), UndoHistory()
+    first, second = [None, [0, 0], "a.png"], [None, [10, 10], "b.png"]
+
+    for obj in (first, second):
+        app.object_layout.append(obj)
+        history.push(AddObject(obj))
+        clock[0] += 10
+
+    second[1][:] = [50, 50]
+    history.push(MoveObject(second, (10, 10), (50, 50)))
+
+    app.object_layout.insert(0, [None, [99, 99], "streamed.png"])  # A chunk loading in before them
+
+    history.undo(app)
+    assert second[1] == [10, 10]
+    history.undo(app)
+    assert app.object_layout[-1] is first
+
+    history.redo(app)
+    assert app.object_layout[-1] is second
+    assert app.object_layout[0][2] == "streamed.png"
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import null_audio  # NOQA - Must come before the engine imports
+from engine import audio_engine
+from engine.audio_engine import (ProxyChat, JitterBuffer, PCMCodec, MuLawCodec, OpusCodec, VOICE_FRAME_HEADER,
+                                 encode_voice_header, decode_voice_packet)
+
+
+def voice_packet(speaker: int, sequence: int, codec_id: int, payload: bytes) -> bytes:
+    return encode_voice_header(speaker, False, 1.0, 0, 0) + VOICE_FRAME_HEADER.pack(sequence, codec_id) + payload
+
+
+def test_pcm_round_trip():
+    pcm = (np.arange(audio_engine.BLOCKSIZE) * 31 - 15000).astype(np.int16)
+    codec = PCMCodec()
+
+    assert np.array_equal(codec.decode(codec.encode(pcm)), pcm)
+
+
+def test_mulaw_round_trip_is_close():
+    pcm = (np.sin(np.linspace(0, 20, audio_engine.BLOCKSIZE)) * 20000).astype(np.int16)
+    codec = MuLawCodec()
+
+    encoded = codec.encode(pcm)
+    assert len(encoded) == len(pcm)
+
+    error = np.abs(codec.decode(encoded).astype(np.int32) - pcm)
+    assert error.max() <= np.abs(pcm).max() * 0.05
+
+
+def test_choose_codec_falls_back_to_mulaw():
+    assert isinstance(audio_engine.choose_codec([]), MuLawCodec)
+    assert isinstance(audio_engine.choose_codec([PCMCodec.codec_id]), PCMCodec)
+
+
+@pytest.mark.skipif(audio_engine.opuslib is not None, reason="opuslib is installed")
+def test_unavailable_codec_frames_are_dropped():
+    assert OpusCodec.codec_id not in audio_engine.available_codec_ids()
+
+    chat = ProxyChat(None, decode_voice_packet, codec=MuLawCodec())
+    chat.active = True
+
+    for sequence in range(3):
+        chat.output_callback(None, None, voice_packet(0, sequence, OpusCodec.codec_id, b"\x00" * 60))
+
+    assert chat.unusable_codecs == {OpusCodec.codec_id}
+    assert chat.audio_buffers == {}
+
+    # Speakers using something we can decode still come through
+    chat.output_callback(None, None, voice_packet(1, 0, MuLawCodec.codec_id, MuLawCodec().encode(
+        np.zeros(audio_engine.BLOCKSIZE, dtype=np.int16))))
+    assert list(chat.audio_buffers) == [1]
+
+
+def test_jitter_buffer_reorders_and_waits_for_depth():
+    buffer = JitterBuffer(target_depth=3)
+
+    buffer.push(0, "a")
+    buffer.push(2, "c")
+    assert buffer.pop() is None  # Still buffering
+
+    buffer.push(1, "b")
+    assert [buffer.pop() for _ in range(3)] == ["a", "b", "c"]
+
+
+def test_jitter_buffer_plays_silence_for_lost_frames_and_grows_on_late_ones():
+    buffer = JitterBuffer(target_depth=1)
+
+    buffer.push(0, "a")
+    buffer.push(2, "c")
+    assert [buffer.pop() for _ in range(3)] == ["a", None, "c"]
+    assert buffer.lost_frames == 1
+    assert buffer.pop() is None and buffer.lost_frames == 1  # Ran dry, not a lost frame
+
+    buffer.push(1, "late")
+    buffer.pop()
+    assert buffer.late_frames == 1
+    assert buffer.target_depth == 2
+
+
+def test_jitter_buffer_skips_ahead_when_too_far_behind():
+    buffer = JitterBuffer(target_depth=1, max_depth=4)
+
+    for sequence in range(10):
+        buffer.push(sequence, sequence)
+
+    assert buffer.pop() == 6  # Only the newest max_depth frames are kept
+    assert buffer.skipped_frames == 6
+
+
+def reference_gains(state: np.ndarray, channels: int) -> np.ndarray:
+    """ The panning / muffling maths written out plainly, in float64 """
+    volume, radio, rel_x, rel_y = state.astype(np.float64).T
+
+    muffle = np.where(radio > 0, 0, 1 - volume) * ProxyChat.MUFFLE_AMOUNT
+    dry, wet = volume * (1 - muffle), volume * muffle
+
+    if channels == 1:
+        return np.concatenate((dry, wet))[None]
+
+    pan = np.clip(-rel_y / np.maximum(np.hypot(rel_x, rel_y), ProxyChat.PAN_DISTANCE), -1, 1)
+    pan[radio > 0] = 0
+    angle = (pan + 1) * np.pi / 4
+
+    return np.stack((np.concatenate((np.cos(angle) * dry, np.cos(angle) * wet)),
+                     np.concatenate((np.sin(angle) * dry, np.sin(angle) * wet))))
+
+
+@pytest.mark.parametrize("stereo", [True, False])
+def test_gains_match_reference(stereo):
+    rng = np.random.default_rng(0)
+    chat = ProxyChat(None, decode_voice_packet, codec=MuLawCodec(), stereo=stereo)
+
+    for active in (1, 5, ProxyChat.MAX_SPEAKERS):
+        state = np.column_stack((rng.random(active), rng.random(active) < 0.3,
+                                 rng.uniform(-300, 300, active), rng.uniform(-300, 300, active)))
+        state[0, 2:] = 0  # Right on top of the listener
+
+        chat._ProxyChat__speaker_state[:active] = state
+        gains = chat._ProxyChat__compute_gains(active)
+
+        assert np.allclose(gains, reference_gains(state, chat.output_channels), atol=1e-6)